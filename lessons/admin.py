@@ -36,3 +36,22 @@ class InvoiceAdmin(admin.ModelAdmin):
     get_request_id.short_description = 'Request ID'  
     
 admin.site.register(Invoice, InvoiceAdmin)
+
+
+class UnmatchedPaymentAdmin(admin.ModelAdmin):
+    list_display=('id', 'line_number', 'reference', 'amount', 'date_paid', 'reason', 'created_date')
+    list_filter=('reason',)
+    search_fields=('reference',)
+    ordering=('-created_date', 'line_number')
+
+admin.site.register(UnmatchedPayment, UnmatchedPaymentAdmin)
+
+
+class LessonAdmin(admin.ModelAdmin):
+    list_display=('id', 'request', 'number', 'student', 'teacher', 'start', 'end')
+    list_filter=('teacher',)
+    search_fields=('student__email',)
+    ordering=('start',)
+    raw_id_fields=('request', 'student', 'teacher')
+
+admin.site.register(Lesson, LessonAdmin)
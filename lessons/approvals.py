@@ -0,0 +1,96 @@
+"""
+Bulk approval of pending lesson requests.
+
+bulk_approve() validates a whole batch of approvals against the database with
+a fixed number of queries. It then applies every valid row with bulk_update,
+fills in their lessons and invoices them all in one batch. The check and the
+writes share one transaction, under conflicts.lock_bookings(). Invalid rows
+are reported back and do not stop the valid ones from being approved.
+"""
+from django.db import transaction
+
+from lessons import caching, metrics
+from lessons.conflicts import ConflictIndex, describe_conflicts, lock_bookings
+from lessons.invoicing import invoice_requests
+from lessons.ledger import recalculate_balances
+from lessons.occurrences import replace_lessons
+from lessons.models import Request, User, Invoice
+
+SCHEDULE_FIELDS = ['teacher', 'class_Day', 'class_Time', 'start_Date']
+REQUIRED_FIELDS = {'class_Day': 'day', 'class_Time': 'time', 'start_Date': 'start date'}
+
+
+def validate_rows(rows):
+    """
+    Check a batch of approvals together.
+    Returns the requests ready to be saved, with their new schedule set, and a dict of request id to error message.
+    """
+    requests = Request.objects.in_bulk([row['request_id'] for row in rows])
+    teacher_ids = {row['teacher'] for row in rows if row.get('teacher')}
+    staff_ids = set(User.objects.filter(pk__in=teacher_ids, is_staff=True).values_list('pk', flat=True))
+    # Rows accepted earlier in the batch are added to the index, so they are checked against each other too
+    bookings = ConflictIndex.for_teachers(staff_ids)
+
+    valid, errors = [], {}
+    for row in rows:
+        request_id = row['request_id']
+        request = requests.get(request_id)
+        if request is None:
+            errors[request_id] = "This request no longer exists."
+            continue
+        if request.isApproved:
+            errors[request_id] = "This request has already been approved."
+            continue
+        missing = [label for field, label in REQUIRED_FIELDS.items() if not row.get(field)]
+        if missing:
+            errors[request_id] = "Please choose a " + " and ".join(missing) + "."
+            continue
+        teacher_id = row.get('teacher') or None
+        if teacher_id is not None:
+            if teacher_id not in staff_ids:
+                errors[request_id] = "The selected Teacher must be a Staff Member!"
+                continue
+            schedule = (row['class_Day'], row['class_Time'], request.duration, row['start_Date'],
+                        request.number_of_lessons, request.interval)
+            conflicts = bookings.conflicts(teacher_id, *schedule)
+            if conflicts:
+                errors[request_id] = describe_conflicts(conflicts)
+                continue
+            bookings.add(request_id, teacher_id, *schedule)
+
+        # Its old teacher's feed loses the request, so is invalidated too
+        request._old_teacher_id = request.teacher_id
+        request.teacher_id = teacher_id
+        request.class_Day = row['class_Day']
+        request.class_Time = row['class_Time']
+        request.start_Date = row['start_Date']
+        request.isApproved = True
+        valid.append(request)
+    return valid, errors
+
+
+def bulk_approve(rows):
+    """
+    Approve many pending requests at once.
+    Each row is a dict with a request_id plus the teacher (a staff user id, or None), class_Day,
+    class_Time and start_Date to schedule the request with.
+    Returns the approved requests and a dict of request id to error message for the rejected rows.
+    """
+    with transaction.atomic():
+        # Checked under the lock, so no other approval can book the teachers between the check and the write
+        lock_bookings({row['teacher'] for row in rows if row.get('teacher')})
+        approved, errors = validate_rows(rows)
+        if not approved:
+            return approved, errors
+        Request.objects.bulk_update(approved, SCHEDULE_FIELDS + ['isApproved'])
+        metrics.requests_approved.inc_on_commit(len(approved))
+        caching.bump_owners({request.user_id for request in approved},
+                            {teacher_id for request in approved for teacher_id in (request.teacher_id,
+                                                                                   request._old_teacher_id)})
+        replace_lessons(approved)
+        invoiced = set(Invoice.objects.filter(request__in=approved).values_list('request_id', flat=True))
+        invoice_requests([request for request in approved if request.request_id not in invoiced])
+        if invoiced:
+            # Existing invoices only count towards the balance once their request is approved
+            recalculate_balances({request.user_id for request in approved if request.request_id in invoiced})
+    return approved, errors
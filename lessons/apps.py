@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class LessonsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'lessons'
+
+    def ready(self):
+        # Connect the signal receivers that keep User.balance up to date, queue background jobs,
+        # invalidate cached dashboard tables and tune new SQLite connections
+        from lessons import caching, ledger, jobs, sqlite  # noqa: F401
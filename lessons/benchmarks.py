@@ -0,0 +1,217 @@
+"""
+End-to-end latency benchmarks of the pages in msms/urls.py.
+
+For each dataset size the database is unseeded and seeded afresh with that
+many students (see lessons.seeding). Each target URL is then requested
+through the Django test client, logged in as the role that uses the page.
+Every request goes through the full middleware, view and template stack,
+but not a network or WSGI server. The first few requests warm the template
+and fragment caches and are not measured. For the rest the benchmark records:
+
+- the p50, p95 and p99 latency
+- the number of queries, counted by middleware.QueryRecorder
+- the peak memory allocated by one request, traced with tracemalloc
+
+Results are plain JSON, so a run can be saved as a baseline and later runs
+compared with it. compare() reports every URL whose p95 latency grew by more
+than the threshold, or whose query count grew at all.
+
+Views that delete or log out (and the Django admin) are not benchmarked, as
+requesting them would change the data the other targets read.
+"""
+import datetime as dt
+import math
+import os
+import tempfile
+import time
+import tracemalloc
+from collections import namedtuple
+from contextlib import contextmanager
+
+from django.core.cache import cache
+from django.db import connection
+from django.test import Client
+from django.urls import reverse
+
+from lessons import seeding
+from lessons.calendars import feed_token
+from lessons.middleware import QueryRecorder
+from lessons.models import Request, User
+
+SIZES = [100, 1000]
+ITERATIONS = 20
+WARMUP = 3
+THRESHOLD = 0.25
+# Latency changes smaller than this are noise at any threshold, in milliseconds
+MIN_REGRESSION_MS = 1.0
+
+# A page to benchmark: its URL name, the role to request it as and a function from the subjects to its URL kwargs
+Target = namedtuple('Target', ['name', 'role', 'kwargs'])
+TARGETS = [
+    Target('home', None, lambda subjects: {}),
+    Target('sign_up', None, lambda subjects: {}),
+    Target('log_in', None, lambda subjects: {}),
+    Target('user_home', 'student', lambda subjects: {}),
+    Target('make_request', 'student', lambda subjects: {}),
+    Target('edit_request', 'student', lambda subjects: {'requestId': subjects['pending'].pk}),
+    Target('see_more_request', 'student', lambda subjects: {'requestId': subjects['pending'].pk}),
+    Target('register_child', 'student', lambda subjects: {}),
+    Target('edit_child', 'student', lambda subjects: {'child_id': subjects['child'].pk}),
+    Target('calendar_feed', None, lambda subjects: {'token': feed_token('student', subjects['student'].pk)}),
+    Target('admin_home', 'staff', lambda subjects: {}),
+    Target('approve', 'staff', lambda subjects: {'requestId': subjects['pending'].pk}),
+    Target('bulk_approve', 'staff', lambda subjects: {}),
+    Target('create_transaction', 'staff', lambda subjects: {}),
+    Target('import_statement', 'staff', lambda subjects: {}),
+    Target('export_data', 'staff', lambda subjects: {'name': 'invoices'}),
+    Target('view_student', 'staff', lambda subjects: {'user_id': subjects['student'].pk}),
+    Target('query_stats', 'staff', lambda subjects: {}),
+    Target('profiles', 'staff', lambda subjects: {}),
+    Target('metrics', None, lambda subjects: {}),
+    Target('director_home', 'director', lambda subjects: {}),
+    Target('edit_user', 'director', lambda subjects: {'user_id': subjects['student'].pk}),
+]
+# URL names that are deliberately not benchmarked, with why
+SKIPPED = {
+    'log_out': "logs the client out",
+    'propose_timetable': "POST only",
+    'delete': "deletes a request",
+    'delete_invoice': "deletes an invoice",
+    'delete_user': "deletes a user",
+    'delete_child': "deletes a child",
+    'profile_file': "needs a saved profile",
+}
+
+
+@contextmanager
+def scratch_database():
+    """Run the block against a freshly migrated, empty database in place of the configured one"""
+    test_settings = connection.settings_dict.setdefault('TEST', {})
+    old_test_name = test_settings.get('NAME')
+    with tempfile.TemporaryDirectory() as directory:
+        if connection.vendor == 'sqlite':
+            # On disk rather than in memory, so reads cost what they do in development
+            test_settings['NAME'] = os.path.join(directory, 'benchmark.sqlite3')
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            yield
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            test_settings['NAME'] = old_test_name
+
+
+def subjects():
+    """
+    The users and rows the targets are requested with: a student with a pending request for one of their
+    children, a teacher and the director
+    """
+    pending = Request.objects.filter(isApproved=False, child__isnull=False) \
+        .select_related('user', 'child').order_by('pk').first()
+    if pending is None:
+        raise ValueError("No student has a pending request for a child; benchmark more students.")
+    return {
+        'student': pending.user,
+        'pending': pending,
+        'child': pending.child,
+        'staff': User.objects.filter(is_staff=True, is_superuser=False).order_by('pk').first(),
+        'director': User.objects.filter(is_superuser=True).order_by('pk').first(),
+    }
+
+
+def seed_dataset(size, seed=0):
+    """Replace the data with the fixed accounts and size random students"""
+    seeding.unseed(truncate=connection.vendor == 'sqlite')
+    seeding.seed(students=size, seed=seed)
+    cache.clear()
+
+
+def percentile(values, fraction):
+    """The nearest-rank percentile of a list of numbers"""
+    ordered = sorted(values)
+    return ordered[max(math.ceil(fraction * len(ordered)) - 1, 0)]
+
+
+def fetch(client, path):
+    response = client.get(path)
+    if response.streaming:
+        b''.join(response.streaming_content)
+    return response
+
+
+def measure(client, path, iterations=ITERATIONS, warmup=WARMUP):
+    """Request a path warmup times, then iterations times timed. Returns the measurements of the timed requests."""
+    for _ in range(warmup):
+        fetch(client, path)
+    latencies, queries = [], 0
+    for _ in range(iterations):
+        recorder = QueryRecorder()
+        with connection.execute_wrapper(recorder):
+            began = time.perf_counter()
+            response = fetch(client, path)
+            latencies.append((time.perf_counter() - began) * 1000)
+        queries = max(queries, recorder.count)
+
+    # Once more for memory, which tracing slows down too much to time at the same time
+    tracemalloc.start()
+    try:
+        fetch(client, path)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {
+        'status': response.status_code,
+        'p50_ms': round(percentile(latencies, 0.50), 3),
+        'p95_ms': round(percentile(latencies, 0.95), 3),
+        'p99_ms': round(percentile(latencies, 0.99), 3),
+        'queries': queries,
+        'peak_kb': round(peak / 1024, 1),
+    }
+
+
+def run(sizes=SIZES, names=None, iterations=ITERATIONS, warmup=WARMUP, seed=0, progress=None):
+    """
+    Benchmark the targets (or those named) at each dataset size, on the current database, which is replaced.
+    Returns the results as a dict that can be dumped as JSON.
+    """
+    targets = [target for target in TARGETS if names is None or target.name in names]
+    results = {}
+    for size in sizes:
+        seed_dataset(size, seed)
+        people = subjects()
+        clients = {None: Client()}
+        for role in {target.role for target in targets} - {None}:
+            clients[role] = Client()
+            clients[role].force_login(people[role])
+        results[str(size)] = {}
+        for target in targets:
+            path = reverse(target.name, kwargs=target.kwargs(people))
+            results[str(size)][target.name] = measure(clients[target.role], path, iterations, warmup)
+            if progress is not None:
+                progress(size, target.name, results[str(size)][target.name])
+    return {
+        'created': dt.datetime.now(dt.timezone.utc).isoformat(timespec='seconds'),
+        'iterations': iterations,
+        'warmup': warmup,
+        'seed': seed,
+        'results': results,
+    }
+
+
+def compare(current, baseline, threshold=THRESHOLD):
+    """
+    The regressions of a run against a baseline run, as messages: URLs whose p95 latency grew by more than
+    threshold (a fraction) and MIN_REGRESSION_MS, or whose query count grew. Only sizes and URLs in both are compared.
+    """
+    regressions = []
+    for size, pages in current['results'].items():
+        for name, now in pages.items():
+            before = baseline['results'].get(size, {}).get(name)
+            if before is None:
+                continue
+            grown = now['p95_ms'] - before['p95_ms']
+            if grown > before['p95_ms'] * threshold and grown >= MIN_REGRESSION_MS:
+                regressions.append(f"{name} at {size} students: p95 {before['p95_ms']:.1f} ms -> "
+                                   f"{now['p95_ms']:.1f} ms")
+            if now['queries'] > before['queries']:
+                regressions.append(f"{name} at {size} students: {before['queries']} -> {now['queries']} queries")
+    return regressions
@@ -0,0 +1,149 @@
+"""
+Versioned template fragment caching for the dashboard tables.
+
+Each table fragment is cached under a key that includes the version number
+of the scope whose data it shows:
+
+- 'user:<id>' covers a student's own requests, invoices, payments and children
+- 'teacher:<id>' covers the requests a teacher is booked for
+- 'staff' covers the tables on the admin and director dashboards
+
+Rather than deleting cached fragments, the receivers below bump the versions
+of every scope a changed Request, Invoice, Transaction, Child or User
+belongs to, so the next render misses the cache under the new key. Old
+fragments simply expire. Bulk writes do not send signals, so they call
+bump_owners() with the students and teachers whose requests they wrote,
+including the teachers the requests were booked with before the write.
+ledger.recalculate_balances() bumps the users it is given the same way.
+
+Versions are kept in the default cache and start from the current time in
+nanoseconds. A version that was evicted therefore never comes back as a
+number an old fragment was cached under. With more than one server process,
+CACHES must point at a cache they all share, or a bump only reaches the
+process that made the change.
+"""
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete, pre_save
+from django.dispatch import receiver
+
+from lessons.models import User, Child, Request, Invoice, Transaction
+from msms import routers
+
+FRAGMENT_TIMEOUT = 60 * 60
+STAFF = 'staff'
+
+
+def user_scope(user_id):
+    return f'user:{user_id}'
+
+
+def teacher_scope(teacher_id):
+    return f'teacher:{teacher_id}'
+
+
+def _key(scope):
+    return f'lessons:version:{scope}'
+
+
+def version(scope):
+    """The current version of a scope, to be included in the cache key of every fragment showing its data"""
+    key = _key(scope)
+    current = cache.get(key)
+    if current is None:
+        cache.add(key, time.time_ns(), timeout=None)
+        current = cache.get(key)
+    return current
+
+
+def fragment_context(scope):
+    """Template context for the {% cache %} tags of the fragments showing the data of scope"""
+    current = version(scope)
+    if routers.current_read_alias() == routers.REPLICA:
+        # A render from a replica that is behind would cache old data under the new version, so it is only
+        # kept until the replica is next synced
+        current = f'{current}:{routers.replica_synced_at().timestamp()}'
+    return {'cache_timeout': FRAGMENT_TIMEOUT, 'cache_scope': scope, 'cache_version': current}
+
+
+def _incr(scopes):
+    for scope in scopes:
+        try:
+            cache.incr(_key(scope))
+        except ValueError:
+            # Nothing has been cached under this scope since its version was evicted
+            pass
+
+
+def bump(*scopes):
+    """
+    Invalidate every fragment cached for the given scopes.
+    The bump is repeated when the surrounding transaction commits, so a render that ran between the
+    change and the commit, and so cached the old data under the new version, is not served afterwards.
+    """
+    scopes = set(scopes)
+    _incr(scopes)
+    transaction.on_commit(lambda: _incr(scopes))
+
+
+def bump_owners(user_ids=(), teacher_ids=()):
+    """Invalidate the fragments and calendar feeds of the given students and teachers, and the staff dashboards"""
+    bump(STAFF, *(user_scope(user_id) for user_id in user_ids if user_id is not None),
+         *(teacher_scope(teacher_id) for teacher_id in teacher_ids if teacher_id is not None))
+
+
+def bump_users(user_ids):
+    """Invalidate the fragments of the given users and the staff dashboards"""
+    bump_owners(user_ids)
+
+
+def _request_owner(request_id):
+    return Request.objects.filter(pk=request_id).values_list('user_id', flat=True).first()
+
+
+@receiver(pre_save, sender=Request)
+def request_changing(sender, instance, raw=False, **kwargs):
+    """Remember who a request belonged to and was booked with, so they are invalidated too if that changes"""
+    instance._old_owners = None
+    if not raw and not instance._state.adding:
+        instance._old_owners = Request.objects.filter(pk=instance.pk).values_list('user_id', 'teacher_id').first()
+
+
+@receiver(post_save, sender=Request)
+@receiver(post_delete, sender=Request)
+def request_changed(sender, instance, **kwargs):
+    users, teachers = {instance.user_id}, {instance.teacher_id}
+    old = getattr(instance, '_old_owners', None)
+    if old is not None:
+        users.add(old[0])
+        teachers.add(old[1])
+    bump_owners(users, teachers)
+
+
+@receiver(post_save, sender=Invoice)
+@receiver(post_delete, sender=Invoice)
+def invoice_changed(sender, instance, **kwargs):
+    bump_users([_request_owner(instance.request_id)])
+
+
+@receiver(post_save, sender=Transaction)
+@receiver(post_delete, sender=Transaction)
+def transaction_changed(sender, instance, **kwargs):
+    bump_users([instance.created_by_id])
+
+
+@receiver(post_save, sender=Child)
+@receiver(post_delete, sender=Child)
+def child_changed(sender, instance, **kwargs):
+    bump_users([instance.parent_id])
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def user_changed(sender, instance, update_fields=None, **kwargs):
+    # Names, emails and roles appear in the staff tables, but logging in only touches last_login
+    if update_fields is not None and set(update_fields) <= {'last_login'}:
+        return
+    bump_users([instance.pk])
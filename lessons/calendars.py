@@ -0,0 +1,136 @@
+"""
+iCalendar feeds of approved lessons.
+
+Each student, child and teacher has a feed at a URL containing a signed
+token, so a calendar app can subscribe without logging in and the URL
+cannot be guessed from an id. Every approved request is one VEVENT with a
+weekly RRULE (INTERVAL weeks, COUNT lessons), so a feed stays small
+however long the terms are.
+
+Calendar apps poll feeds constantly, so the rendered feed is cached under
+the version of the caching scope that covers its requests: the user's
+scope for a student and their children, and the teacher's scope for a
+teacher. Every change to those requests bumps that version (see
+lessons.caching), so a feed is only rebuilt after something in it changed.
+The version also makes the ETag, and the time the version was first
+rendered is the Last-Modified. Most polls are therefore answered with a
+304 after a single primary key lookup that checks the owner still exists.
+"""
+import datetime as dt
+
+from django.core import signing
+from django.core.cache import cache
+from django.utils import timezone
+
+from lessons import caching
+from lessons.models import Child, Request, User
+from lessons.occurrences import first_lesson_date
+
+SALT = 'lessons.calendars'
+FEED_TIMEOUT = 24 * 60 * 60
+KINDS = ('student', 'child', 'teacher')
+
+
+def feed_token(kind, owner_id):
+    """The token in the URL of the feed of a student, child or teacher"""
+    return signing.Signer(salt=SALT).sign(f'{kind}.{owner_id}')
+
+
+def read_token(token):
+    """The (kind, owner id) a token was made for, or None if it was not made by feed_token()"""
+    try:
+        kind, owner_id = signing.Signer(salt=SALT).unsign(token).split('.')
+    except (signing.BadSignature, ValueError):
+        return None
+    if kind not in KINDS or not owner_id.isdigit():
+        return None
+    return kind, int(owner_id)
+
+
+def feed_scope(kind, owner_id):
+    """The caching scope whose version changes whenever a request in the feed does, or None if the owner is gone"""
+    if kind == 'teacher':
+        return caching.teacher_scope(owner_id) if User.objects.filter(pk=owner_id, is_staff=True).exists() else None
+    if kind == 'child':
+        parent_id = Child.objects.filter(pk=owner_id).values_list('parent_id', flat=True).first()
+        return caching.user_scope(parent_id) if parent_id is not None else None
+    return caching.user_scope(owner_id) if User.objects.filter(pk=owner_id).exists() else None
+
+
+def feed_requests(kind, owner_id):
+    requests = Request.objects.filter(isApproved=True).select_related('child').only(
+        'request_id', 'lesson_content', 'class_Day', 'class_Time', 'start_Date', 'interval', 'number_of_lessons',
+        'duration', 'child__name').order_by('request_id')
+    return requests.filter(**{{'student': 'user', 'child': 'child', 'teacher': 'teacher'}[kind]: owner_id})
+
+
+def escape(text):
+    """Escape a TEXT value (RFC 5545 3.3.11)"""
+    return text.replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,').replace('\n', '\\n')
+
+
+def fold(line):
+    """Fold a content line into chunks of at most 75 octets, continued with a leading space (RFC 5545 3.1)"""
+    encoded = line.encode()
+    chunks, limit = [], 75
+    while len(encoded) > limit:
+        cut = limit
+        while encoded[cut] & 0xC0 == 0x80:  # Never split a UTF-8 character
+            cut -= 1
+        chunks.append(encoded[:cut].decode())
+        encoded = encoded[cut:]
+        limit = 74
+    chunks.append(encoded.decode())
+    return '\r\n '.join(chunks)
+
+
+def _utc(value):
+    return value.astimezone(dt.timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+
+
+def event(request, stamp, teacher_view=False):
+    """The VEVENT lines of the lessons of an approved request"""
+    first = timezone.make_aware(dt.datetime.combine(first_lesson_date(request.start_Date, request.class_Day),
+                                                    request.class_Time))
+    summary = request.lesson_content
+    if request.child is not None and not teacher_view:
+        summary += f" ({request.child.name})"
+    return [
+        'BEGIN:VEVENT',
+        f'UID:request-{request.request_id}@msms',
+        f'DTSTAMP:{_utc(stamp)}',
+        f'DTSTART:{_utc(first)}',
+        f'DTEND:{_utc(first + dt.timedelta(minutes=request.duration))}',
+        f'RRULE:FREQ=WEEKLY;INTERVAL={request.interval};COUNT={request.number_of_lessons}',
+        f'SUMMARY:{escape(summary)}',
+        f'DESCRIPTION:{escape(f"Request {request.request_id}")}',
+        'END:VEVENT',
+    ]
+
+
+def render_feed(kind, owner_id, stamp):
+    lines = ['BEGIN:VCALENDAR', 'VERSION:2.0', 'PRODID:-//MSMS//Lessons//EN', 'CALSCALE:GREGORIAN',
+             'X-WR-CALNAME:Music lessons']
+    for request in feed_requests(kind, owner_id):
+        lines.extend(event(request, stamp, teacher_view=kind == 'teacher'))
+    lines.append('END:VCALENDAR')
+    return '\r\n'.join(fold(line) for line in lines) + '\r\n'
+
+
+def get_feed(kind, owner_id):
+    """
+    The (body, etag, last modified) of a feed, rendered at most once per version of its scope,
+    or None if its owner no longer exists.
+    """
+    scope = feed_scope(kind, owner_id)
+    if scope is None:
+        return None
+    version = caching.version(scope)
+    key = f'lessons:ics:{kind}:{owner_id}:{version}'
+    cached = cache.get(key)
+    if cached is None:
+        stamp = timezone.now().replace(microsecond=0)
+        cached = (render_feed(kind, owner_id, stamp), stamp)
+        cache.set(key, cached, FEED_TIMEOUT)
+    body, stamp = cached
+    return body, f'"{kind}-{owner_id}-{version}"', stamp
@@ -0,0 +1,154 @@
+"""
+Teacher double-booking detection.
+
+A booking is a weekly slot, stored as minutes from the start of the week
+(Monday 00:00): [day * 1440 + time, that + duration). It is kept together with
+the dates of the first and last lessons of its request. ConflictIndex keeps
+each teacher's bookings sorted by start offset. No booking is longer than
+the longest one indexed, so every booking that can overlap a new slot starts
+within that length before the slot's end. Two bisections find those
+candidates, so a check costs O(log n) plus the number of candidates, rather
+than a scan of every approved request.
+
+Building an index sorts each teacher's bookings once, so it costs
+O(n log n) and one query. That only pays off when one index answers many
+checks, as when approvals.validate_rows() checks a whole batch. A single
+approval (forms.ApproveForm) builds the index of one teacher for one check,
+which costs as much as scanning that teacher's bookings would. add()
+inserts into the sorted lists, so it is O(n) a booking and is only meant for
+the few bookings made after the index is built.
+
+Slots that run past the end of Sunday wrap round to Monday. Bookings whose
+terms do not overlap in time do not conflict, even in the same weekly slot.
+Lessons every other week are still treated as weekly, so alternating
+bookings in the same slot are reported as conflicts.
+
+A check only holds until another approval commits. Approvals therefore call
+lock_bookings() first thing in the transaction that writes them, and check
+again under the lock, so two approvals cannot both book the same teacher.
+"""
+import bisect
+import datetime as dt
+from collections import defaultdict, namedtuple
+from operator import attrgetter
+
+from django.db import connection
+from django.db.models import F
+
+from lessons.models import Request, User
+from lessons.occurrences import WEEKDAYS, first_lesson_date
+
+DAY_MINUTES = 24 * 60
+WEEK_MINUTES = 7 * DAY_MINUTES
+
+Booking = namedtuple('Booking', ['start', 'end', 'request_id', 'first', 'last'])
+
+
+def weekly_slot(class_day, class_time, duration):
+    """The [start, end) of a weekly slot in minutes from Monday 00:00, where end may run past the end of the week"""
+    start = WEEKDAYS[class_day] * DAY_MINUTES + class_time.hour * 60 + class_time.minute
+    return start, start + duration
+
+
+def term(start_date, class_day, number_of_lessons, interval):
+    """The dates of the first and last lessons of a schedule"""
+    first = first_lesson_date(start_date, class_day)
+    return first, first + dt.timedelta(weeks=interval * (number_of_lessons - 1))
+
+
+def _segments(start, end):
+    """Split a slot that runs past the end of Sunday into the part before and the part after midnight"""
+    if end <= WEEK_MINUTES:
+        return [(start, end)]
+    return [(start, WEEK_MINUTES), (0, end - WEEK_MINUTES)]
+
+
+def _bookings(request_id, class_day, class_time, duration, start_date, number_of_lessons, interval):
+    first, last = term(start_date, class_day, number_of_lessons, interval)
+    return [Booking(start, end, request_id, first, last)
+            for start, end in _segments(*weekly_slot(class_day, class_time, duration))]
+
+
+class TeacherBookings:
+    """The bookings of one teacher, sorted by start offset"""
+
+    def __init__(self, bookings=()):
+        self.bookings = sorted(bookings, key=attrgetter('start'))
+        self.starts = [booking.start for booking in self.bookings]
+        self.longest = max((booking.end - booking.start for booking in self.bookings), default=0)
+
+    def add(self, booking):
+        index = bisect.bisect_right(self.starts, booking.start)
+        self.starts.insert(index, booking.start)
+        self.bookings.insert(index, booking)
+        self.longest = max(self.longest, booking.end - booking.start)
+
+    def overlapping(self, start, end):
+        """Bookings that overlap [start, end): they start before end and finish after start"""
+        low = bisect.bisect_right(self.starts, start - self.longest)
+        high = bisect.bisect_left(self.starts, end)
+        return [booking for booking in self.bookings[low:high] if booking.end > start]
+
+
+class ConflictIndex:
+    """Per-teacher interval index over the weekly slots of approved requests"""
+
+    def __init__(self):
+        self.teachers = defaultdict(TeacherBookings)
+
+    @classmethod
+    def for_teachers(cls, teacher_ids=None):
+        """An index of the approved requests of the given teachers, or of every teacher, loaded with one query"""
+        requests = Request.objects.filter(isApproved=True, teacher__isnull=False)
+        if teacher_ids is not None:
+            requests = requests.filter(teacher__in=teacher_ids)
+        return cls.from_rows(requests.values_list('request_id', 'teacher_id', 'class_Day', 'class_Time', 'duration',
+                                                  'start_Date', 'number_of_lessons', 'interval').iterator())
+
+    @classmethod
+    def from_rows(cls, rows):
+        """An index of rows of the arguments of add(), sorting each teacher's bookings once"""
+        bookings = defaultdict(list)
+        for request_id, teacher_id, *schedule in rows:
+            bookings[teacher_id].extend(_bookings(request_id, *schedule))
+        index = cls()
+        for teacher_id, teacher_bookings in bookings.items():
+            index.teachers[teacher_id] = TeacherBookings(teacher_bookings)
+        return index
+
+    def add(self, request_id, teacher_id, class_day, class_time, duration, start_date, number_of_lessons, interval):
+        """Add one booking to the index, after it is built"""
+        for booking in _bookings(request_id, class_day, class_time, duration, start_date, number_of_lessons, interval):
+            self.teachers[teacher_id].add(booking)
+
+    def conflicts(self, teacher_id, class_day, class_time, duration, start_date, number_of_lessons, interval,
+                  exclude=None):
+        """The ids of the approved requests, other than exclude, that the teacher would be double-booked with"""
+        bookings = self.teachers.get(teacher_id)
+        if bookings is None:
+            return []
+        first, last = term(start_date, class_day, number_of_lessons, interval)
+        found = set()
+        for start, end in _segments(*weekly_slot(class_day, class_time, duration)):
+            found.update(booking.request_id for booking in bookings.overlapping(start, end)
+                         if booking.request_id != exclude and booking.first <= last and first <= booking.last)
+        return sorted(found)
+
+
+def lock_bookings(teacher_ids):
+    """
+    Keep other approvals from booking the given teachers until the current transaction ends.
+    Call it inside transaction.atomic() before the transaction reads anything, then check for conflicts.
+    """
+    teachers = User.objects.filter(pk__in=teacher_ids)
+    if connection.features.has_select_for_update:
+        list(teachers.select_for_update().values_list('pk', flat=True))
+    else:
+        # SQLite has no row locks. The first write of a transaction takes the database's write lock, which other
+        # writers wait for until it ends, so write the teachers' rows without changing them
+        teachers.update(is_staff=F('is_staff'))
+
+
+def describe_conflicts(request_ids):
+    return "The teacher is already booked at that time for request " + \
+        ", ".join(str(request_id) for request_id in request_ids) + "."
@@ -0,0 +1,104 @@
+"""
+Streaming exports of invoices, transactions and requests for the finance team.
+
+Rows are read with values() so related fields come from joins in the same
+query rather than a query per row, and with iterator(chunk_size=...) so only
+one chunk is held in memory at a time. The CSV or JSON Lines output, and
+optionally gzip, is produced as a generator for StreamingHttpResponse or a
+file, so memory use does not depend on the number of rows exported.
+"""
+import csv
+import datetime as dt
+import json
+import zlib
+
+from django.utils import timezone
+
+from lessons.models import Request, Invoice, Transaction
+from msms.routers import reporting
+
+CHUNK_SIZE = 2000
+
+# Each export: the model, the field its date range filters on, and the columns to export
+EXPORTS = {
+    'invoices': (Invoice, 'created_date', [
+        'id', 'invoice_number', 'request_id', 'request__user__email', 'amount_to_be_paid', 'status', 'created_date',
+    ]),
+    'transactions': (Transaction, 'date_paid', [
+        'id', 'invoice__invoice_number', 'amount', 'date_paid', 'created_by__email', 'administrated_by__email',
+    ]),
+    'requests': (Request, 'submission_date', [
+        'request_id', 'user__email', 'child__name', 'lesson_content', 'availability', 'number_of_lessons', 'interval',
+        'duration', 'teacher__email', 'class_Day', 'class_Time', 'start_Date', 'isApproved', 'submission_date',
+        'invoice__invoice_number',
+    ]),
+}
+FORMATS = {
+    'csv': 'text/csv',
+    'jsonl': 'application/x-ndjson',
+}
+
+
+def _start_of_day(date):
+    return timezone.make_aware(dt.datetime.combine(date, dt.time.min))
+
+
+def export_rows(name, start=None, end=None, chunk_size=CHUNK_SIZE):
+    """Yield the rows of an export as dicts, optionally only those dated between start and end inclusive."""
+    model, date_field, columns = EXPORTS[name]
+    rows = model.objects.all()
+    if start is not None:
+        rows = rows.filter(**{date_field + '__gte': _start_of_day(start)})
+    if end is not None:
+        rows = rows.filter(**{date_field + '__lt': _start_of_day(end + dt.timedelta(days=1))})
+    # Exports are read while the response streams, after the view has returned, so they are marked for the
+    # replica here rather than by the view
+    return reporting(rows).order_by('pk').values(*columns).iterator(chunk_size=chunk_size)
+
+
+class _Echo:
+    """A file-like object for csv.writer that hands back each line instead of storing it"""
+
+    def write(self, value):
+        return value
+
+
+def render_csv(name, rows):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(EXPORTS[name][2])
+    for row in rows:
+        yield writer.writerow(row.values())
+
+
+def render_jsonl(name, rows):
+    for row in rows:
+        yield json.dumps(row, default=str) + '\n'
+
+
+RENDERERS = {
+    'csv': render_csv,
+    'jsonl': render_jsonl,
+}
+
+
+def gzip_chunks(chunks, buffer_size=64 * 1024):
+    """Gzip a stream of text chunks as they are produced, yielding compressed bytes."""
+    compressor = zlib.compressobj(wbits=zlib.MAX_WBITS | 16)
+    buffer = []
+    size = 0
+    for chunk in chunks:
+        data = chunk.encode()
+        buffer.append(data)
+        size += len(data)
+        if size >= buffer_size:
+            compressed = compressor.compress(b''.join(buffer))
+            buffer, size = [], 0
+            if compressed:
+                yield compressed
+    yield compressor.compress(b''.join(buffer)) + compressor.flush()
+
+
+def export(name, export_format='csv', start=None, end=None, gzip=False, chunk_size=CHUNK_SIZE):
+    """The whole export as a generator of str chunks, or of bytes if gzip is True."""
+    chunks = RENDERERS[export_format](name, export_rows(name, start, end, chunk_size))
+    return gzip_chunks(chunks) if gzip else chunks
@@ -1,7 +1,12 @@
+import datetime as dt
+
 from django import forms
 from django.core.validators import MinLengthValidator
+from django.db import transaction
 from django.forms.utils import ErrorList
 
+from lessons import metrics, occurrences
+from lessons.conflicts import ConflictIndex, describe_conflicts, lock_bookings
 from lessons.models import User, Request, Child
 from lessons.models import User, Request, Transaction, Invoice
 from crispy_forms.helper import FormHelper
@@ -138,6 +143,8 @@ class EditRequestForm(forms.ModelForm):
         request.teacher = self.cleaned_data.get('teacher')
         request.child = self.cleaned_data.get('child')
         request.save()
+        if request.isApproved:
+            occurrences.sync_lessons(request)
 
         return request
 
@@ -176,6 +183,26 @@ class ApproveForm(forms.ModelForm):
 
     teacher = forms.ModelChoiceField(queryset=User.objects.filter(is_staff=True), blank=True, required=False,
                                      label="Requested Teacher:")
+
+    SCHEDULE_FIELDS = ['class_Day', 'class_Time', 'duration', 'start_Date', 'number_of_lessons', 'interval']
+
+    def clean(self):
+        super().clean()
+        teacher = self.cleaned_data.get('teacher')
+        schedule = [self.cleaned_data.get(field) for field in self.SCHEDULE_FIELDS]
+        if teacher is None or any(value in (None, '') for value in schedule):
+            return self.cleaned_data
+        conflicts = self.conflicts(teacher, exclude=self.request_id)
+        if conflicts:
+            self.add_error('class_Time', describe_conflicts(conflicts))
+        return self.cleaned_data
+
+    def conflicts(self, teacher, exclude=None):
+        """The approved requests the teacher would be double-booked with on the cleaned schedule"""
+        schedule = [self.cleaned_data.get(field) for field in self.SCHEDULE_FIELDS]
+        # One check, so building the teacher's index costs as much as scanning their bookings (see conflicts.py)
+        return ConflictIndex.for_teachers([teacher.id]).conflicts(teacher.id, *schedule, exclude=exclude)
+
     def save(self, request, commit=True):
         super().save(commit=False)
 
@@ -188,13 +215,25 @@ class ApproveForm(forms.ModelForm):
         request.class_Day = self.cleaned_data.get('class_Day')
         request.class_Time = self.cleaned_data.get('class_Time')
         request.start_Date = self.cleaned_data.get('start_Date')
-        request.isApproved = True
-        request.save()
+        with transaction.atomic():
+            if request.teacher is not None:
+                # Checked again under the lock, as another approval may have booked the teacher since clean()
+                lock_bookings([request.teacher.id])
+                conflicts = self.conflicts(request.teacher, exclude=request.request_id)
+                if conflicts:
+                    raise forms.ValidationError(describe_conflicts(conflicts))
+            if not request.isApproved:
+                metrics.requests_approved.inc_on_commit()
+            request.isApproved = True
+            request.save()
+            occurrences.sync_lessons(request)
 
         return request
 
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, request_id=None, **kwargs):
         super().__init__(*args, **kwargs)
+        # The request being approved, so re-approving it is not reported as clashing with itself
+        self.request_id = request_id
         self.helper = FormHelper()
         self.helper.form_id = 'request_form'
         # self.helper.form_class = 'blueForms' # Lyn version
@@ -278,13 +317,16 @@ class TransactionForm(forms.ModelForm):
         payment.administrated_by = user
         payment.created_by = localInvoice.request.user
         payment.save()
+        metrics.transactions_recorded.inc_on_commit()
 
         return payment
 
     def __init__(self, *args, **kwargs):
         super(TransactionForm, self).__init__(*args, **kwargs)
+        # Typed in rather than picked from a dropdown, so the page does not load every invoice
         self.fields['invoice'] = forms.ModelChoiceField(queryset=Invoice.objects.all(),
-                                                        to_field_name="invoice_number")
+                                                        to_field_name="invoice_number", widget=forms.TextInput(),
+                                                        label="Invoice number")
         self.helper = FormHelper()
         self.helper.form_id = 'request_form'
         self.helper.form_class = 'blueForms'
@@ -296,3 +338,56 @@ class TransactionForm(forms.ModelForm):
             'date_paid',
             Submit('submitTransaction', 'Create transaction')
         )
+
+
+def teacher_choices():
+    """Choices for picking a teacher, evaluated once so a formset does not query the teachers for every row"""
+    return [('', '---------')] + [(teacher.id, teacher.first_name + " " + teacher.last_name)
+                                  for teacher in User.objects.filter(is_staff=True)]
+
+
+class BulkApproveDefaultsForm(forms.Form):
+    """Schedule details shared by every row of a bulk approval, unless a row sets its own"""
+    teacher = forms.TypedChoiceField(coerce=int, empty_value=None, required=False, label="Teacher")
+    class_Day = forms.ChoiceField(choices=[('', '---------')] + Request.DAY_CHOICES, required=False, label="Class day")
+    class_Time = forms.TypedChoiceField(choices=[('', '---------')] + Request.TIME_CHOICES, coerce=dt.time.fromisoformat,
+                                        empty_value=None, required=False, label="Class time")
+    start_Date = forms.DateTimeField(required=False, label="Start date")
+
+    def __init__(self, *args, teachers=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fields['teacher'].choices = teachers if teachers is not None else teacher_choices()
+
+
+class BulkApproveRowForm(BulkApproveDefaultsForm):
+    request_id = forms.IntegerField(widget=forms.HiddenInput())
+    selected = forms.BooleanField(required=False)
+
+    def schedule(self, defaults):
+        """The details to approve this row with, falling back to the shared defaults for any left blank"""
+        return {
+            'request_id': self.cleaned_data['request_id'],
+            **{field: self.cleaned_data.get(field) or defaults.get(field)
+               for field in ('teacher', 'class_Day', 'class_Time', 'start_Date')}
+        }
+
+
+BulkApproveFormSet = forms.formset_factory(BulkApproveRowForm, extra=0)
+
+
+class StatementUploadForm(forms.Form):
+    statement = forms.FileField(label="Bank statement")
+    statement_format = forms.ChoiceField(choices=[('csv', 'CSV'), ('ofx', 'OFX')], initial='csv', label="Format")
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.helper = FormHelper()
+        self.helper.form_id = 'statement_form'
+        self.helper.form_class = 'blueForms'
+        self.helper.form_method = 'post'
+        self.helper.form_action = 'import_statement'
+        self.helper.layout = Layout(
+            'statement',
+            'statement_format',
+            Submit('submitStatement', 'Import statement')
+        )
@@ -0,0 +1,65 @@
+"""
+Set-based invoice generation.
+
+Instead of walking users one at a time, generate_invoices() finds every approved
+request without an invoice in one query and invoices them in batches: a handful
+of queries to reserve blocks of invoice numbers, one bulk insert, one UPDATE
+linking the requests back to their invoices and one UPDATE recalculating the
+balances. The number of queries therefore does not grow with the number of users.
+"""
+from collections import Counter
+
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Subquery
+
+from lessons import metrics
+from lessons.ledger import recalculate_balances
+from lessons.models import Request, Invoice, InvoiceSequence
+
+BATCH_SIZE = 500
+
+
+def uninvoiced_requests(user_ids=None):
+    """Approved requests that have no invoice yet, optionally only those of the given users."""
+    requests = Request.objects.filter(isApproved=True, invoice=None) \
+        .exclude(Exists(Invoice.objects.filter(request=OuterRef('pk'))))
+    if user_ids is not None:
+        requests = requests.filter(user__in=user_ids)
+    return requests.only('request_id', 'user_id', 'number_of_lessons', 'duration').order_by('request_id')
+
+
+def next_invoice_numbers(requests):
+    """
+    Reserve an invoice number for each request, one block per user.
+    Returns a dict of request id to invoice number.
+    """
+    blocks = InvoiceSequence.objects.reserve_blocks(Counter(request.user_id for request in requests))
+    return {request.request_id: blocks[request.user_id].pop(0) for request in requests}
+
+
+def invoice_requests(requests):
+    """Create and link invoices for a batch of approved, uninvoiced requests. Returns the new invoices."""
+    if not requests:
+        return []
+    with transaction.atomic():
+        numbers = next_invoice_numbers(requests)
+        invoices = Invoice.objects.bulk_create([
+            Invoice(request_id=request.request_id, amount_to_be_paid=request.get_total_amount_payable(),
+                    invoice_number=numbers[request.request_id])
+            for request in requests
+        ])
+        request_ids = [request.request_id for request in requests]
+        Request.objects.filter(request_id__in=request_ids).update(
+            invoice=Subquery(Invoice.objects.filter(request=OuterRef('pk')).values('pk')[:1]))
+        recalculate_balances({request.user_id for request in requests})
+        metrics.invoices_created.inc_on_commit(len(invoices))
+    return invoices
+
+
+def generate_invoices(user_ids=None, batch_size=BATCH_SIZE):
+    """Invoice every approved request that has no invoice yet. Returns the number of invoices created."""
+    requests = list(uninvoiced_requests(user_ids))
+    created = 0
+    for start in range(0, len(requests), batch_size):
+        created += len(invoice_requests(requests[start:start + batch_size]))
+    return created
@@ -0,0 +1,107 @@
+"""
+Database-backed background job queue.
+
+Dashboard views only read. Writes that follow from an approval or a payment
+(invoicing newly approved requests, refreshing a balance) are queued as Job rows
+in the same transaction as the event. The run_worker management command then
+processes them in batches. A user has at most one pending job of each kind, so
+repeated events coalesce. A failed job is retried with exponential backoff until
+it has failed MAX_ATTEMPTS times.
+"""
+import datetime as dt
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from lessons.invoicing import generate_invoices
+from lessons.ledger import recalculate_balances
+from lessons.models import Job, Request, Transaction
+
+BATCH_SIZE = 100
+MAX_ATTEMPTS = 5
+RETRY_DELAY = dt.timedelta(seconds=30)
+
+
+def enqueue(kind, user_ids):
+    """Queue a job of the given kind for each user, unless one is already pending."""
+    Job.objects.bulk_create([Job(kind=kind, user_id=user_id) for user_id in set(user_ids) if user_id is not None],
+                            ignore_conflicts=True)
+
+
+def _generate_invoices(user_ids):
+    generate_invoices(user_ids=user_ids)
+
+
+HANDLERS = {
+    Job.INVOICE: _generate_invoices,
+    Job.BALANCE: recalculate_balances,
+}
+
+
+@receiver(post_save, sender=Request)
+def request_saved(sender, instance, raw=False, **kwargs):
+    if not raw and instance.isApproved and instance.invoice_id is None:
+        enqueue(Job.INVOICE, [instance.user_id])
+
+
+@receiver(post_save, sender=Transaction)
+def transaction_saved(sender, instance, raw=False, **kwargs):
+    if not raw:
+        enqueue(Job.BALANCE, [instance.created_by_id])
+
+
+def _fail(job, error):
+    job.attempts += 1
+    job.last_error = f"{type(error).__name__}: {error}"
+    if job.attempts >= MAX_ATTEMPTS:
+        job.status = Job.FAILED
+    else:
+        job.run_after = timezone.now() + RETRY_DELAY * 2 ** (job.attempts - 1)
+
+
+def run_jobs(batch_size=BATCH_SIZE):
+    """
+    Process one batch of due jobs, handling all the jobs of a kind with a single call.
+    Returns the number of jobs taken off the queue, whether they succeeded or not.
+    """
+    with transaction.atomic():
+        jobs = list(Job.objects.select_for_update(skip_locked=True)
+                    .filter(status=Job.PENDING, run_after__lte=timezone.now())
+                    .order_by('run_after', 'pk')[:batch_size])
+        by_kind = defaultdict(list)
+        for job in jobs:
+            by_kind[job.kind].append(job)
+
+        done, failed = [], []
+        for kind, kind_jobs in by_kind.items():
+            try:
+                with transaction.atomic():
+                    HANDLERS[kind]([job.user_id for job in kind_jobs])
+                done.extend(kind_jobs)
+            except Exception:
+                # Retry the jobs one at a time so a single bad job does not hold up the rest of the batch
+                for job in kind_jobs:
+                    try:
+                        with transaction.atomic():
+                            HANDLERS[kind]([job.user_id])
+                        done.append(job)
+                    except Exception as error:
+                        _fail(job, error)
+                        failed.append(job)
+
+        Job.objects.filter(pk__in=[job.pk for job in done]).delete()
+        Job.objects.bulk_update(failed, ['status', 'attempts', 'run_after', 'last_error'])
+    return len(jobs)
+
+
+def run_until_empty(batch_size=BATCH_SIZE):
+    """Process batches until no due jobs are left. Returns the total number of jobs processed."""
+    processed = 0
+    while True:
+        count = run_jobs(batch_size)
+        processed += count
+        if count == 0:
+            return processed
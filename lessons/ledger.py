@@ -0,0 +1,186 @@
+"""
+Running balance ledger for users.
+
+User.balance is the amount a user still owes: the total of the invoices on their
+approved requests minus the total of their transactions. Rather than re-summing
+every invoice and transaction on each read, the signal receivers below apply a
+signed delta to the stored balance whenever an Invoice, Transaction or Request
+changes. Invoice, Transaction and Request wrap save() in transaction.atomic and
+deletes already run inside one, so each delta commits or rolls back together
+with the row change that caused it.
+
+Queryset update() and bulk_create() do not send signals; code that uses them
+must call recalculate_balances() for the users it touched.
+
+Amounts are MoneyFields, stored in pence (see lessons.money), so deltas are
+merged as ints and the aggregates below sum integer columns. They ask for a
+BigIntegerField result so no Money is built per row, and wrap the totals once.
+"""
+from collections import defaultdict
+
+from django.db.models import BigIntegerField, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.db.models.signals import pre_save, pre_delete
+from django.dispatch import receiver
+
+from lessons import caching
+from lessons.models import User, Request, Invoice, Transaction
+from lessons.money import Money
+
+ZERO = Money(0)
+PENCE = BigIntegerField()
+
+
+def _pence(amount):
+    """An amount (Money, or pounds as a Decimal, str or int) as a whole number of pence"""
+    return Money.of(amount).cents if amount else 0
+
+
+def apply_balance_delta(user_id, delta):
+    """Add delta to the stored balance of a single user with one UPDATE."""
+    pence = _pence(delta)
+    if user_id is None or not pence:
+        return
+    User.objects.filter(pk=user_id).update(
+        balance=Coalesce(F('balance'), Value(0), output_field=PENCE) + Value(pence, output_field=PENCE))
+
+
+def _apply(entries):
+    """Apply a list of (user_id, delta) pairs, merging the deltas per user."""
+    totals = defaultdict(int)
+    for user_id, delta in entries:
+        if user_id is not None and delta:
+            totals[user_id] += _pence(delta)
+    for user_id, pence in totals.items():
+        apply_balance_delta(user_id, Money(pence))
+
+
+def _invoice_entry(request_id, amount):
+    """The (user_id, delta) an invoice for the given request adds, or None if it adds nothing."""
+    if request_id is None or not amount:
+        return None
+    row = Request.objects.filter(pk=request_id).values_list('user_id', 'isApproved').first()
+    if row is None or not row[1]:
+        return None
+    return row[0], amount
+
+
+@receiver(pre_save, sender=Invoice)
+def invoice_saved(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    entries = []
+    if not instance._state.adding:
+        old = Invoice.objects.filter(pk=instance.pk).values_list(
+            'request__user_id', 'request__isApproved', 'amount_to_be_paid').first()
+        if old is not None and old[1] and old[2]:
+            entries.append((old[0], -old[2]))
+    new = _invoice_entry(instance.request_id, instance.amount_to_be_paid)
+    if new is not None:
+        entries.append(new)
+    _apply(entries)
+
+
+@receiver(pre_delete, sender=Invoice)
+def invoice_deleted(sender, instance, **kwargs):
+    entry = _invoice_entry(instance.request_id, instance.amount_to_be_paid)
+    if entry is not None:
+        _apply([(entry[0], -entry[1])])
+
+
+@receiver(pre_save, sender=Transaction)
+def transaction_saved(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    entries = []
+    if not instance._state.adding:
+        old = Transaction.objects.filter(pk=instance.pk).values_list('created_by_id', 'amount').first()
+        if old is not None:
+            entries.append((old[0], old[1]))
+    entries.append((instance.created_by_id, -Money(_pence(instance.amount))))
+    _apply(entries)
+
+
+@receiver(pre_delete, sender=Transaction)
+def transaction_deleted(sender, instance, **kwargs):
+    _apply([(instance.created_by_id, instance.amount)])
+
+
+@receiver(pre_save, sender=Request)
+def request_saved(sender, instance, raw=False, **kwargs):
+    """Approving, unapproving or re-assigning an invoiced request moves its invoice on the ledger."""
+    if raw or instance._state.adding:
+        return
+    old = Request.objects.filter(pk=instance.pk).values_list('user_id', 'isApproved').first()
+    if old is None or old == (instance.user_id, instance.isApproved):
+        return
+    amount = Invoice.objects.filter(request_id=instance.pk).values_list('amount_to_be_paid', flat=True).first()
+    if not amount:
+        return
+    entries = []
+    if old[1]:
+        entries.append((old[0], -amount))
+    if instance.isApproved:
+        entries.append((instance.user_id, amount))
+    _apply(entries)
+
+
+def calculate_balances(user_ids=None):
+    """
+    Work out balances from scratch with two grouped aggregates.
+    Returns a dict of user id to balance for every user in user_ids (or every user).
+    """
+    users = User.objects.all()
+    invoices = Invoice.objects.filter(request__isApproved=True)
+    transactions = Transaction.objects.all()
+    if user_ids is not None:
+        users = users.filter(pk__in=user_ids)
+        invoices = invoices.filter(request__user__in=user_ids)
+        transactions = transactions.filter(created_by__in=user_ids)
+
+    balances = {user_id: 0 for user_id in users.values_list('pk', flat=True)}
+    for row in invoices.values('request__user').annotate(total=Sum('amount_to_be_paid', output_field=PENCE)):
+        if row['request__user'] in balances:
+            balances[row['request__user']] += int(row['total'])
+    for row in transactions.values('created_by').annotate(total=Sum('amount', output_field=PENCE)):
+        if row['created_by'] in balances:
+            balances[row['created_by']] -= int(row['total'])
+    return {user_id: Money(pence) for user_id, pence in balances.items()}
+
+
+def recalculate_balances(user_ids):
+    """
+    Overwrite the stored balances of the given users in a single UPDATE, summing their
+    invoices and transactions in correlated subqueries. Used after bulk writes that skip the signals.
+    """
+    invoiced = Invoice.objects.filter(request__isApproved=True, request__user=OuterRef('pk')) \
+        .values('request__user').annotate(total=Sum('amount_to_be_paid', output_field=PENCE)).values('total')
+    paid = Transaction.objects.filter(created_by=OuterRef('pk')) \
+        .values('created_by').annotate(total=Sum('amount', output_field=PENCE)).values('total')
+    # The rows behind these balances were written in bulk, without the signals that invalidate cached tables
+    user_ids = set(user_ids)
+    caching.bump_users(user_ids)
+    return User.objects.filter(pk__in=user_ids).update(
+        balance=Coalesce(Subquery(invoiced), Value(0), output_field=PENCE)
+        - Coalesce(Subquery(paid), Value(0), output_field=PENCE))
+
+
+def rebuild_balances(user_ids=None, commit=True):
+    """
+    Recalculate balances from scratch and compare them with the stored ones.
+    Returns a list of (user, stored balance, calculated balance) for every mismatch,
+    which is written back in one bulk update unless commit is False.
+    """
+    balances = calculate_balances(user_ids)
+    users = User.objects.only('pk', 'email', 'balance')
+    if user_ids is not None:
+        users = users.filter(pk__in=user_ids)
+    mismatched = []
+    for user in users:
+        if user.balance != balances[user.pk]:
+            mismatched.append((user, user.balance, balances[user.pk]))
+            user.balance = balances[user.pk]
+    if commit and mismatched:
+        User.objects.bulk_update([user for user, _, _ in mismatched], ['balance'])
+        caching.bump_users([user.pk for user, _, _ in mismatched])
+    return mismatched
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from lessons.occurrences import backfill_lessons, BATCH_SIZE
+
+
+class Command(BaseCommand):
+    """
+    Fills in the Lesson table from the schedules of every approved request.
+    """
+
+    help = "Expand all approved requests into their lesson occurrences in batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE,
+                            help="Number of requests to expand per batch.")
+
+    def handle(self, *args, **options):
+        expanded, created = backfill_lessons(batch_size=options['batch_size'])
+        self.stdout.write(f"Expanded {expanded} request(s) into {created} lesson(s).")
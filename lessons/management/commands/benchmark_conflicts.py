@@ -0,0 +1,73 @@
+import datetime as dt
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from lessons.conflicts import ConflictIndex, weekly_slot, term
+from lessons.models import Request
+
+
+class Command(BaseCommand):
+    """
+    Times teacher double-booking checks against the interval index and against a scan of every booking,
+    using randomly generated approved requests held in memory.
+    """
+
+    help = "Benchmark double-booking checks for a large number of approved requests."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=10000, help="Number of approved requests to index.")
+        parser.add_argument('--teachers', type=int, default=50, help="Number of teachers they are spread over.")
+        parser.add_argument('--checks', type=int, default=1000, help="Number of approvals to check.")
+        parser.add_argument('--seed', type=int, default=0, help="Seed for the random schedules.")
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        days = [day for day, _ in Request.DAY_CHOICES]
+        start = dt.date(2023, 1, 2)
+
+        def schedule():
+            return (rng.randrange(options['teachers']), rng.choice(days), dt.time(rng.randrange(8, 20)),
+                    rng.choice([30, 45, 60, 90]), start + dt.timedelta(days=rng.randrange(120)),
+                    rng.randrange(1, 21), rng.randrange(1, 3))
+
+        rows = [(request_id,) + schedule() for request_id in range(options['requests'])]
+        checks = [schedule() for _ in range(options['checks'])]
+
+        began = time.perf_counter()
+        index = ConflictIndex.from_rows(rows)
+        built = time.perf_counter() - began
+
+        began = time.perf_counter()
+        indexed = [index.conflicts(*check) for check in checks]
+        indexed_time = time.perf_counter() - began
+
+        began = time.perf_counter()
+        scanned = [self.scan(rows, *check) for check in checks]
+        scan_time = time.perf_counter() - began
+
+        if indexed != scanned:
+            self.stderr.write("The index and the scan disagree!")
+        self.stdout.write(f"Indexed {len(rows)} request(s) for {options['teachers']} teacher(s) "
+                          f"in {built * 1000:.1f} ms.")
+        self.stdout.write(f"Index: {indexed_time / len(checks) * 1e6:.1f} µs per check.")
+        self.stdout.write(f"Scan:  {scan_time / len(checks) * 1e6:.1f} µs per check.")
+        self.stdout.write(f"{sum(map(bool, indexed))} of {len(checks)} check(s) found a conflict.")
+
+    @staticmethod
+    def scan(rows, teacher_id, class_day, class_time, duration, start_date, number_of_lessons, interval):
+        """The conflicts found by comparing against every booking, as a reference for the index"""
+        week = 7 * 24 * 60
+        start, end = weekly_slot(class_day, class_time, duration)
+        first, last = term(start_date, class_day, number_of_lessons, interval)
+        found = []
+        for request_id, other_teacher, *other in rows:
+            if other_teacher != teacher_id:
+                continue
+            other_start, other_end = weekly_slot(*other[:3])
+            other_first, other_last = term(other[3], other[0], other[4], other[5])
+            overlaps = any(other_start + shift < end and start < other_end + shift for shift in (-week, 0, week))
+            if overlaps and other_first <= last and first <= other_last:
+                found.append(request_id)
+        return found
@@ -0,0 +1,89 @@
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from lessons.sqlite import apply_pragmas
+
+
+class Command(BaseCommand):
+    """
+    Measures read and write throughput of parallel readers and writers on a scratch SQLite database,
+    once with SQLite's defaults and once with settings.SQLITE_PRAGMAS.
+    """
+
+    help = "Benchmark concurrent SQLite readers and writers with and without the tuned pragmas."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--readers', type=int, default=8, help="Number of reader threads.")
+        parser.add_argument('--writers', type=int, default=2, help="Number of writer threads.")
+        parser.add_argument('--seconds', type=float, default=5, help="How long to run each configuration for.")
+        parser.add_argument('--rows', type=int, default=20000, help="Number of rows to start with.")
+
+    def handle(self, *args, **options):
+        for label, pragmas in (('defaults', {}), ('tuned', settings.SQLITE_PRAGMAS)):
+            with tempfile.TemporaryDirectory() as directory:
+                reads, writes, errors = self.run(os.path.join(directory, 'bench.sqlite3'), pragmas, options)
+            seconds = options['seconds']
+            self.stdout.write(f"{label:>8}: {reads / seconds:9.0f} reads/s {writes / seconds:8.0f} writes/s "
+                              f"{errors} locked")
+
+    def connect(self, path, pragmas):
+        # The same timeout Django's SQLite backend uses when none is configured
+        connection = sqlite3.connect(path, timeout=5, isolation_level=None, check_same_thread=False)
+        apply_pragmas(connection.cursor(), pragmas)
+        return connection
+
+    def run(self, path, pragmas, options):
+        setup = self.connect(path, pragmas)
+        setup.execute('CREATE TABLE request (id INTEGER PRIMARY KEY, user_id INTEGER, approved BOOL, content TEXT)')
+        setup.execute('CREATE INDEX request_user ON request (user_id, id)')
+        setup.execute('BEGIN')
+        setup.executemany('INSERT INTO request (user_id, approved, content) VALUES (?, ?, ?)',
+                          [(i % 500, i % 2, 'Piano') for i in range(options['rows'])])
+        setup.execute('COMMIT')
+        setup.close()
+
+        counts = {'reads': 0, 'writes': 0, 'errors': 0}
+        lock = threading.Lock()
+        stop = time.perf_counter() + options['seconds']
+
+        def work(write):
+            connection = self.connect(path, pragmas)
+            rng = random.Random()
+            done = failed = 0
+            while time.perf_counter() < stop:
+                try:
+                    if write:
+                        # A dashboard-style write: one short transaction touching a couple of rows
+                        connection.execute('BEGIN IMMEDIATE')
+                        connection.execute('UPDATE request SET approved = 1 - approved WHERE id = ?',
+                                           (rng.randrange(1, options['rows']),))
+                        connection.execute('INSERT INTO request (user_id, approved, content) VALUES (?, 0, ?)',
+                                           (rng.randrange(500), 'Drums'))
+                        connection.execute('COMMIT')
+                    else:
+                        connection.execute('SELECT id, approved, content FROM request WHERE user_id = ? '
+                                           'ORDER BY id LIMIT 25', (rng.randrange(500),)).fetchall()
+                    done += 1
+                except sqlite3.OperationalError:
+                    failed += 1
+                    if connection.in_transaction:
+                        connection.execute('ROLLBACK')
+            connection.close()
+            with lock:
+                counts['writes' if write else 'reads'] += done
+                counts['errors'] += failed
+
+        threads = [threading.Thread(target=work, args=(False,)) for _ in range(options['readers'])] + \
+                  [threading.Thread(target=work, args=(True,)) for _ in range(options['writers'])]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return counts['reads'], counts['writes'], counts['errors']
@@ -0,0 +1,74 @@
+import json
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+
+from lessons import benchmarks
+
+
+class Command(BaseCommand):
+    """
+    Seeds a scratch database at each size and times every benchmarked page, as the role that uses it.
+    Optionally compares the results with a saved baseline and fails if any page regressed.
+    """
+
+    help = "Benchmark the latency, query count and memory of each page at several dataset sizes."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default=','.join(map(str, benchmarks.SIZES)),
+                            help="Comma separated numbers of students to seed, e.g. 100,1000,10000.")
+        parser.add_argument('--urls', help="Comma separated URL names to benchmark, instead of all of them.")
+        parser.add_argument('--iterations', type=int, default=benchmarks.ITERATIONS,
+                            help="Number of timed requests per page.")
+        parser.add_argument('--warmup', type=int, default=benchmarks.WARMUP,
+                            help="Number of untimed requests per page first.")
+        parser.add_argument('--seed', type=int, default=0, help="Seed for the seeded data.")
+        parser.add_argument('--output', help="File to write the results to as JSON.")
+        parser.add_argument('--baseline', help="JSON results of an earlier run to compare with.")
+        parser.add_argument('--threshold', type=float, default=benchmarks.THRESHOLD,
+                            help="Fraction by which a page's p95 latency may grow before it counts as a regression.")
+
+    def handle(self, *args, **options):
+        try:
+            sizes = [int(size) for size in options['sizes'].split(',')]
+        except ValueError:
+            raise CommandError(f"'{options['sizes']}' is not a list of numbers.")
+        names = options['urls'].split(',') if options['urls'] else None
+        known = {target.name for target in benchmarks.TARGETS}
+        if names is not None and not set(names) <= known:
+            raise CommandError(f"Unknown URL name(s): {', '.join(sorted(set(names) - known))}. "
+                               f"Choose from {', '.join(sorted(known))}.")
+        if options['iterations'] < 1:
+            raise CommandError("--iterations must be at least 1.")
+        baseline = None
+        if options['baseline']:
+            with open(options['baseline']) as file:
+                baseline = json.load(file)
+
+        self.stdout.write(f"{'students':>8} {'url':<20} {'status':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+                          f"{'queries':>7} {'peak KB':>9}")
+
+        def progress(size, name, row):
+            self.stdout.write(f"{size:>8} {name:<20} {row['status']:>6} {row['p50_ms']:>8.1f} {row['p95_ms']:>8.1f} "
+                              f"{row['p99_ms']:>8.1f} {row['queries']:>7} {row['peak_kb']:>9.1f}")
+
+        # The replica is a copy of the configured database, not of the scratch one, and the benchmark's requests
+        # must not end up in the real metrics. The test client's requests are to 'testserver', which the test
+        # runner would otherwise allow.
+        with benchmarks.scratch_database(), override_settings(REPLICA_ENABLED=False, METRICS_ENABLED=False,
+                                                              ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+            try:
+                results = benchmarks.run(sizes, names, options['iterations'], options['warmup'], options['seed'],
+                                         progress)
+            except ValueError as error:
+                raise CommandError(error)
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                json.dump(results, file, indent=2)
+            self.stdout.write(f"Wrote the results to {options['output']}.")
+        if baseline is not None:
+            regressions = benchmarks.compare(results, baseline, options['threshold'])
+            if regressions:
+                raise CommandError("Slower than the baseline:\n" + "\n".join(regressions))
+            self.stdout.write("No regressions against the baseline.")
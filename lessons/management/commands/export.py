@@ -0,0 +1,50 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from lessons import exports
+
+
+class Command(BaseCommand):
+    """
+    Streams a full dump of invoices, transactions or requests to a file or stdout.
+    """
+
+    help = "Export invoices, transactions or requests as CSV or JSON Lines."
+
+    def add_arguments(self, parser):
+        parser.add_argument('name', choices=sorted(exports.EXPORTS))
+        parser.add_argument('--format', dest='export_format', choices=sorted(exports.FORMATS), default='csv')
+        parser.add_argument('--start', help="Only export rows dated on or after this day (YYYY-MM-DD).")
+        parser.add_argument('--end', help="Only export rows dated on or before this day (YYYY-MM-DD).")
+        parser.add_argument('--gzip', action='store_true', help="Compress the output with gzip.")
+        parser.add_argument('--output', help="File to write to instead of stdout.")
+        parser.add_argument('--chunk-size', type=int, default=exports.CHUNK_SIZE,
+                            help="Number of rows to fetch from the database at a time.")
+
+    def _date(self, value):
+        if value is None:
+            return None
+        try:
+            date = parse_date(value)
+        except ValueError:
+            date = None
+        if date is None:
+            raise CommandError(f"'{value}' is not a date in the form YYYY-MM-DD.")
+        return date
+
+    def handle(self, *args, **options):
+        chunks = exports.export(options['name'], options['export_format'], self._date(options['start']),
+                                self._date(options['end']), gzip=options['gzip'], chunk_size=options['chunk_size'])
+        if options['output']:
+            mode = {'mode': 'wb'} if options['gzip'] else {'mode': 'w', 'newline': ''}
+            with open(options['output'], **mode) as out:
+                for chunk in chunks:
+                    out.write(chunk)
+        elif options['gzip']:
+            for chunk in chunks:
+                sys.stdout.buffer.write(chunk)
+        else:
+            for chunk in chunks:
+                self.stdout.write(chunk, ending='')
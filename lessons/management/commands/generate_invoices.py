@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from lessons.invoicing import generate_invoices, BATCH_SIZE
+
+
+class Command(BaseCommand):
+    """
+    Creates invoices for every approved request that does not have one yet.
+    """
+
+    help = "Invoice all approved, uninvoiced requests in bulk."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE,
+                            help="Number of invoices to create per batch.")
+
+    def handle(self, *args, **options):
+        created = generate_invoices(batch_size=options['batch_size'])
+        self.stdout.write(f"Created {created} invoice(s).")
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from lessons import statements
+from lessons.models import User
+
+
+class Command(BaseCommand):
+    """
+    Records the payments on a bank statement against their invoices.
+    Lines that cannot be matched to an invoice are kept for review.
+    """
+
+    help = "Import a CSV or OFX bank statement."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="The statement file to import.")
+        parser.add_argument('--format', dest='statement_format', choices=sorted(statements.PARSERS), default='csv')
+        parser.add_argument('--admin', help="Email of the staff member to record the payments as administrated by.")
+        parser.add_argument('--batch-size', type=int, default=statements.BATCH_SIZE,
+                            help="Number of lines to insert at a time.")
+
+    def handle(self, *args, **options):
+        administrated_by = None
+        if options['admin']:
+            try:
+                administrated_by = User.objects.get(email=options['admin'], is_staff=True)
+            except User.DoesNotExist:
+                raise CommandError(f"There is no staff member with the email {options['admin']}.")
+        with open(options['path'], encoding='utf-8-sig', newline='') as stream:
+            counts = statements.import_statement(stream, options['statement_format'], administrated_by,
+                                                 options['batch_size'])
+        self.stdout.write(f"Recorded {counts['matched']} payment(s), closed {counts['closed']} invoice(s) and "
+                          f"left {counts['unmatched']} line(s) for review.")
@@ -0,0 +1,47 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from lessons.approvals import bulk_approve
+from lessons.timetable import propose_timetable
+
+
+class Command(BaseCommand):
+    """
+    Proposes a teacher, day and time for every pending request without double-booking any teacher,
+    and optionally approves the proposals straight away.
+    """
+
+    help = "Propose a timetable for all pending requests."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start-date', help="First date lessons can start on, as YYYY-MM-DD. Defaults to today.")
+        parser.add_argument('--approve', action='store_true', help="Approve every proposal instead of listing them.")
+
+    def handle(self, *args, **options):
+        start_date = None
+        if options['start_date']:
+            start_date = parse_date(options['start_date'])
+            if start_date is None:
+                raise CommandError("--start-date must be a date in the form YYYY-MM-DD.")
+
+        began = time.perf_counter()
+        proposals, unscheduled = propose_timetable(start_date)
+        elapsed = time.perf_counter() - began
+
+        if options['approve']:
+            approved, errors = bulk_approve([proposal._asdict() | {'teacher': proposal.teacher_id}
+                                             for proposal in proposals])
+            for request_id, error in sorted(errors.items()):
+                self.stderr.write(f"Request {request_id}: {error}")
+            self.stdout.write(f"Approved {len(approved)} request(s).")
+        else:
+            for proposal in proposals:
+                self.stdout.write(f"Request {proposal.request_id}: teacher {proposal.teacher_id}, "
+                                  f"{proposal.class_Day} at {proposal.class_Time:%H:%M} "
+                                  f"from {proposal.start_Date:%Y-%m-%d}")
+        if unscheduled:
+            self.stdout.write("Could not fit in request(s) " + ", ".join(str(request_id) for request_id in unscheduled))
+        self.stdout.write(f"Proposed {len(proposals)} of {len(proposals) + len(unscheduled)} pending request(s) "
+                          f"in {elapsed:.2f}s.")
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from lessons.ledger import rebuild_balances
+
+
+class Command(BaseCommand):
+    """
+    Recalculates every user's balance from their invoices and transactions and
+    repairs any stored balance that has drifted from the ledger.
+    """
+
+    help = "Rebuild and check all user balances from scratch."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true',
+                            help="Only report mismatched balances, without fixing them.")
+
+    def handle(self, *args, **options):
+        mismatched = rebuild_balances(commit=not options['check'])
+        for user, stored, calculated in mismatched:
+            self.stdout.write(f"{user.email}: stored {stored}, calculated {calculated}")
+        if options['check'] and mismatched:
+            raise CommandError(f"{len(mismatched)} balance(s) do not match the ledger.")
+        if mismatched:
+            self.stdout.write(f"Fixed {len(mismatched)} balance(s).")
+        else:
+            self.stdout.write("All balances match the ledger.")
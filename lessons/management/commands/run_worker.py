@@ -0,0 +1,38 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from lessons.jobs import run_jobs, run_until_empty, BATCH_SIZE
+
+
+class Command(BaseCommand):
+    """
+    Processes the background job queue: invoicing approved requests and refreshing balances.
+    On SQLite run a single worker, as the database only allows one writer at a time.
+    """
+
+    help = "Process queued background jobs."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help="Exit once the queue is empty instead of polling for new jobs.")
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE,
+                            help="Maximum number of jobs to process at a time.")
+        parser.add_argument('--sleep', type=float, default=5.0,
+                            help="Seconds to wait between polls when the queue is empty.")
+
+    def handle(self, *args, **options):
+        if options['once']:
+            processed = run_until_empty(options['batch_size'])
+            self.stdout.write(f"Processed {processed} job(s).")
+            return
+        self.stdout.write("Worker started, press Ctrl+C to stop.")
+        try:
+            while True:
+                processed = run_jobs(options['batch_size'])
+                if processed:
+                    self.stdout.write(f"Processed {processed} job(s).")
+                else:
+                    time.sleep(options['sleep'])
+        except KeyboardInterrupt:
+            self.stdout.write("Worker stopped.")
@@ -0,0 +1,45 @@
+import sqlite3
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from lessons.models import ReplicaHeartbeat
+from msms.routers import PRIMARY, REPLICA
+
+
+class Command(BaseCommand):
+    """
+    Copies the primary SQLite database over the replica with SQLite's online backup, so readers of either
+    are never blocked for long. The primary's heartbeat is stamped first, so the copy records when it was taken.
+    """
+
+    help = "Bring the SQLite replica up to date with the primary, once or every --interval seconds."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, help="Keep syncing, waiting this many seconds between syncs.")
+
+    def handle(self, *args, **options):
+        for alias in (PRIMARY, REPLICA):
+            if alias not in connections.databases or connections[alias].vendor != 'sqlite':
+                raise CommandError(f"The '{alias}' database must be configured and use SQLite.")
+        while True:
+            started = time.perf_counter()
+            self.snapshot()
+            self.stdout.write(f"Replica synced in {time.perf_counter() - started:.2f}s.")
+            if not options['interval']:
+                return
+            time.sleep(options['interval'])
+
+    def snapshot(self):
+        ReplicaHeartbeat.stamp()
+        source = sqlite3.connect(connections.databases[PRIMARY]['NAME'])
+        target = sqlite3.connect(connections.databases[REPLICA]['NAME'])
+        try:
+            # Copy in steps of 1000 pages so writers on the primary get a look in during a long copy
+            source.backup(target, pages=1000)
+        finally:
+            source.close()
+            target.close()
+        # Drop connections to the replica made before the copy
+        connections[REPLICA].close()
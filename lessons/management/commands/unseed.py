@@ -1,26 +1,30 @@
+import time
+
 from django.core.management.base import BaseCommand, CommandError
 
-from lessons.models import User, Transaction, Child, Invoice, Request
+from lessons import seeding
 
 
 class Command(BaseCommand):
     """
-    Deletes all non-superuser users, plus the seeded directors. Be careful!!
+    Deletes all non-superuser users, plus the seeded directors, with everything they own. Be careful!!
     """
 
-    def handle(self, *args, **options):
-        print("Unseeding...")
-        # Transactions are deleted first because they have a foreign key to User with a Protected constraint
-        for j in Transaction.objects.all(): # delete all transactions
-            j.delete()
-        for i in Invoice.objects.all(): # delete all invoices
-            i.delete()
-        for h in Request.objects.all(): # delete all requests
-            h.delete()
-        for k in Child.objects.all(): # delete all children
-            k.delete()
-        for o in User.objects.all():
-            if (not o.is_superuser) or (o.email == 'marty.major@example.org'):
-                o.delete()
-        print("Done")
+    help = "Delete the seeded users, children, requests, lessons, invoices and transactions."
 
+    def add_arguments(self, parser):
+        parser.add_argument('--truncate', action='store_true',
+                            help="Empty the tables outright and reset their id sequences (SQLite only).")
+        parser.add_argument('--batch-size', type=int, default=seeding.DELETE_BATCH_SIZE,
+                            help="Number of rows to delete per DELETE statement.")
+
+    def handle(self, *args, **options):
+        self.stdout.write("Unseeding...")
+        began = time.perf_counter()
+        try:
+            timings = seeding.unseed(options['truncate'], options['batch_size'])
+        except ValueError as error:
+            raise CommandError(error)
+        for table, count, seconds in timings:
+            self.stdout.write(f"{table}: {count} row(s) in {seconds:.2f} s")
+        self.stdout.write(f"Done in {time.perf_counter() - began:.1f} s.")
@@ -0,0 +1,322 @@
+"""
+Application metrics in the Prometheus text format, served at /metrics.
+
+The metrics are:
+
+- the latency of each view, by URL name and method
+- the number of queries and the database time of each request, by URL name
+- the time taken to render each top-level template, by template name
+- counters of invoices created, transactions recorded and requests approved
+
+Each WSGI worker process records into its own file in settings.METRICS_DIR,
+memory-mapped so that recording a value is a dict lookup and a write to
+shared memory, without a system call. A process only ever writes its own
+file, so processes never lock each other out. The /metrics view reads every
+file in the directory and adds the values together, so each scrape sees the
+totals of all the workers. Files of workers that have exited are still
+counted, which keeps counters from going backwards when a worker is
+recycled. Empty the directory when deploying, as Prometheus expects counters
+to restart from zero when the server does.
+
+A file is a used-length header followed by entries, each a key length, the
+key (JSON of the sample name and labels) padded to 8 bytes, and the value as
+a double. Entries are appended once and then updated in place. The header is
+only advanced after an entry is complete, so readers never see half of one.
+
+Histograms store the count of each bucket on its own, and the /metrics view
+adds them up into Prometheus' cumulative buckets.
+
+The counters are only incremented once the change they count commits, and
+nothing is recorded unless settings.METRICS_ENABLED is on. It is off under
+the test runner.
+"""
+import bisect
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.template.backends.django import DjangoTemplates, Template
+
+INITIAL_FILE_SIZE = 64 * 1024
+HEADER = struct.Struct('<Q')
+KEY_LENGTH = struct.Struct('<I')
+VALUE = struct.Struct('<d')
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+UNMATCHED = 'unmatched'  # The URL name of requests that no URL pattern matched
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200)
+
+
+def _padded(length):
+    return (length + 7) // 8 * 8
+
+
+class MmapStore:
+    """The values of the samples one process has recorded, in a memory-mapped file of its own"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.pid = os.getpid()
+        self.path = os.path.join(directory, f'{self.pid}.db')
+        self.lock = threading.Lock()
+        self.offsets = {}
+        exists = os.path.exists(self.path)
+        self.file = open(self.path, 'a+b')
+        if not exists or os.path.getsize(self.path) < INITIAL_FILE_SIZE:
+            self.file.truncate(INITIAL_FILE_SIZE)
+        self.map = mmap.mmap(self.file.fileno(), 0)
+        self.used = HEADER.unpack_from(self.map, 0)[0] if exists else 0
+        if self.used == 0:
+            self.used = HEADER.size
+            HEADER.pack_into(self.map, 0, self.used)
+        for key, _, offset in read_entries(self.map, self.used):
+            self.offsets[key] = offset
+
+    def add(self, *increments):
+        """Add to the values of samples, given as (key, amount) pairs"""
+        with self.lock:
+            for key, amount in increments:
+                offset = self.offsets.get(key)
+                if offset is None:
+                    offset = self._append(key)
+                VALUE.pack_into(self.map, offset, VALUE.unpack_from(self.map, offset)[0] + amount)
+
+    def _append(self, key):
+        encoded = key.encode()
+        start = self.used
+        value_offset = start + _padded(KEY_LENGTH.size + len(encoded))
+        end = value_offset + VALUE.size
+        if end > len(self.map):
+            size = max(end, len(self.map) * 2)
+            self.map.close()
+            self.file.truncate(size)
+            self.map = mmap.mmap(self.file.fileno(), 0)
+        KEY_LENGTH.pack_into(self.map, start, len(encoded))
+        self.map[start + KEY_LENGTH.size:start + KEY_LENGTH.size + len(encoded)] = encoded
+        VALUE.pack_into(self.map, value_offset, 0.0)
+        self.used = end
+        HEADER.pack_into(self.map, 0, self.used)
+        self.offsets[key] = value_offset
+        return value_offset
+
+    def close(self):
+        self.map.close()
+        self.file.close()
+
+
+def read_entries(data, used=None):
+    """The (key, value, offset of the value) of each entry in the bytes of a store's file"""
+    if used is None:
+        used = HEADER.unpack_from(data, 0)[0] if len(data) >= HEADER.size else 0
+    position = HEADER.size
+    while position + KEY_LENGTH.size <= used:
+        length = KEY_LENGTH.unpack_from(data, position)[0]
+        key = bytes(data[position + KEY_LENGTH.size:position + KEY_LENGTH.size + length]).decode()
+        value_offset = position + _padded(KEY_LENGTH.size + length)
+        yield key, VALUE.unpack_from(data, value_offset)[0], value_offset
+        position = value_offset + VALUE.size
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def store():
+    """This process' store, opened again after a fork or a change of settings.METRICS_DIR"""
+    global _store
+    current, directory, pid = _store, settings.METRICS_DIR, os.getpid()
+    if current is not None and current.pid == pid and current.directory == directory:
+        return current
+    with _store_lock:
+        if _store is None or _store.pid != pid or _store.directory != directory:
+            os.makedirs(directory, exist_ok=True)
+            _store = MmapStore(directory)
+        return _store
+
+
+def collect():
+    """The values of every sample, added up over the files of all the processes"""
+    totals = defaultdict(float)
+    try:
+        names = sorted(name for name in os.listdir(settings.METRICS_DIR) if name.endswith('.db'))
+    except FileNotFoundError:
+        return totals
+    for name in names:
+        try:
+            with open(os.path.join(settings.METRICS_DIR, name), 'rb') as file:
+                data = file.read()
+        except FileNotFoundError:
+            continue
+        for key, value, _ in read_entries(data):
+            totals[key] += value
+    return totals
+
+
+def format_value(value):
+    return repr(float(value))
+
+
+def escape(value):
+    return value.replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{escape(value)}"' for name, value in labels.items()) + '}'
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.keys = {}
+        registry.append(self)
+
+    def key(self, sample, labelvalues, le=None):
+        """The store key of a sample, built once per sample and label values"""
+        cached = self.keys.get((sample, labelvalues, le))
+        if cached is None:
+            labels = dict(zip(self.labelnames, map(str, labelvalues)))
+            if le is not None:
+                labels['le'] = le
+            cached = self.keys[(sample, labelvalues, le)] = json.dumps([self.name, sample, labels])
+        return cached
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, *labelvalues):
+        if settings.METRICS_ENABLED and amount:
+            store().add((self.key(self.name + '_total', labelvalues), amount))
+
+    def inc_on_commit(self, amount=1, *labelvalues):
+        """Increment once the current transaction commits, or now outside of one"""
+        if settings.METRICS_ENABLED and amount:
+            transaction.on_commit(lambda: self.inc(amount, *labelvalues))
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+        self.bounds = [format_value(bound) for bound in self.buckets] + ['+Inf']
+
+    def observe(self, value, *labelvalues):
+        if not settings.METRICS_ENABLED:
+            return
+        le = self.bounds[bisect.bisect_left(self.buckets, value)]
+        store().add((self.key(self.name + '_bucket', labelvalues, le), 1),
+                    (self.key(self.name + '_sum', labelvalues), value),
+                    (self.key(self.name + '_count', labelvalues), 1))
+
+
+registry = []
+
+view_latency = Histogram('msms_view_latency_seconds', "Time taken to respond to a request.", ['view', 'method'])
+db_queries = Histogram('msms_db_queries', "Database queries run by a request.", ['view'], buckets=QUERY_BUCKETS)
+db_time = Histogram('msms_db_duration_seconds', "Time a request spent in the database.", ['view'])
+template_render = Histogram('msms_template_render_seconds', "Time taken to render a template.", ['template'])
+invoices_created = Counter('msms_invoices_created', "Invoices created.")
+transactions_recorded = Counter('msms_transactions_recorded', "Payments recorded against invoices.")
+requests_approved = Counter('msms_requests_approved', "Lesson requests approved.")
+
+
+def exposition():
+    """Every metric, totalled over all the processes, in the Prometheus text format"""
+    samples = defaultdict(list)
+    for key, value in collect().items():
+        name, sample, labels = json.loads(key)
+        samples[name].append((sample, labels, value))
+
+    lines = []
+    for metric in registry:
+        lines.append(f'# HELP {metric.name} {metric.documentation}')
+        lines.append(f'# TYPE {metric.name} {metric.kind}')
+        if metric.kind == 'histogram':
+            lines.extend(histogram_lines(metric, samples[metric.name]))
+        else:
+            lines.extend(f'{sample}{format_labels(labels)} {format_value(value)}'
+                         for sample, labels, value in sorted(samples[metric.name], key=lambda row: row[1].items()))
+    return '\n'.join(lines) + '\n'
+
+
+def histogram_lines(metric, samples):
+    """A histogram's stored samples as cumulative buckets, then the sum and count, for each set of labels"""
+    series = defaultdict(lambda: {'buckets': defaultdict(float), 'sum': 0.0, 'count': 0.0})
+    for sample, labels, value in samples:
+        le = labels.pop('le', None)
+        row = series[tuple(sorted(labels.items()))]
+        if sample.endswith('_bucket'):
+            row['buckets'][le] += value
+        elif sample.endswith('_sum'):
+            row['sum'] += value
+        else:
+            row['count'] += value
+    for labels, row in sorted(series.items()):
+        labels = dict(labels)
+        cumulative = 0.0
+        for bound in metric.bounds:
+            cumulative += row['buckets'].get(bound, 0.0)
+            yield f"{metric.name}_bucket{format_labels({**labels, 'le': bound})} {format_value(cumulative)}"
+        yield f"{metric.name}_sum{format_labels(labels)} {format_value(row['sum'])}"
+        yield f"{metric.name}_count{format_labels(labels)} {format_value(row['count'])}"
+
+
+class MetricsMiddleware:
+    """
+    Records the latency of every request, and the queries counted by QueryCountMiddleware, which must come after
+    this in settings.MIDDLEWARE
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not settings.METRICS_ENABLED:
+            return self.get_response(request)
+        began = time.perf_counter()
+        response = self.get_response(request)
+        duration = time.perf_counter() - began
+        match = request.resolver_match
+        name = match.view_name if match is not None else UNMATCHED
+        view_latency.observe(duration, name, request.method)
+        recorder = getattr(request, 'query_recorder', None)
+        if recorder is not None:
+            db_queries.observe(recorder.count, name)
+            db_time.observe(recorder.duration, name)
+        return response
+
+
+class TimedTemplate(Template):
+    def render(self, context=None, request=None):
+        if not settings.METRICS_ENABLED:
+            return super().render(context, request)
+        began = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            template_render.observe(time.perf_counter() - began, self.template.origin.template_name or '<string>')
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """The Django template backend, timing the render of each template a view asks for"""
+
+    def from_string(self, template_code):
+        return TimedTemplate(super().from_string(template_code).template, self)
+
+    def get_template(self, template_name):
+        return TimedTemplate(super().get_template(template_name).template, self)
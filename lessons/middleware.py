@@ -0,0 +1,159 @@
+"""
+Per-request database instrumentation.
+
+QueryCountMiddleware wraps every database connection with an execute wrapper
+for the length of each request and records:
+
+- the number of statements
+- the total time spent in the database
+- the statements repeated within the request, grouped by fingerprint
+- the slowest statement
+
+These are sent back in a Server-Timing header, so they show up in the
+browser's network panel. They are also added to a rolling summary per URL
+name, which staff can read at /query_stats/. A view that issues more
+statements than its budget in settings.QUERY_BUDGETS logs a warning, or
+raises QueryBudgetExceeded when settings.QUERY_BUDGET_STRICT is on, as it is
+under the test runner.
+
+Statements run while a StreamingHttpResponse is being sent, after the view
+has returned, are not counted.
+"""
+import logging
+import re
+import threading
+import time
+from collections import Counter, defaultdict, deque
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+STATS_WINDOW = 100  # requests remembered per URL name
+SQL_PREVIEW = 300
+PLACEHOLDER_LIST = re.compile(r'\((?:%s, )+%s\)')
+LITERAL = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+
+
+class QueryBudgetExceeded(AssertionError):
+    """A view issued more statements than its budget in settings.QUERY_BUDGETS"""
+
+
+def fingerprint(sql):
+    """sql with literals and IN lists of any length collapsed, so statements that differ only in values match"""
+    return LITERAL.sub('?', PLACEHOLDER_LIST.sub('(...)', ' '.join(sql.split())))
+
+
+class QueryRecorder:
+    """An execute wrapper that records the statements run through it"""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.fingerprints = Counter()
+        self.slowest = (0.0, '')
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - start
+            self.count += 1
+            self.duration += duration
+            self.fingerprints[fingerprint(sql)] += 1
+            if duration >= self.slowest[0]:
+                self.slowest = (duration, sql)
+
+    @property
+    def duplicates(self):
+        """Fingerprints run more than once, with how many times, most repeated first"""
+        return [(sql, count) for sql, count in self.fingerprints.most_common() if count > 1]
+
+    def server_timing(self):
+        slowest, _ = self.slowest
+        return (f'db;dur={self.duration * 1000:.2f};desc="{self.count} queries", '
+                f'db-slowest;dur={slowest * 1000:.2f}, '
+                f'db-duplicates;desc="{len(self.duplicates)}"')
+
+
+class QueryStats:
+    """Rolling summary of the last STATS_WINDOW requests for each URL name, shared by all threads"""
+
+    def __init__(self, window=STATS_WINDOW):
+        self.window = window
+        self.lock = threading.Lock()
+        self.requests = defaultdict(lambda: deque(maxlen=self.window))
+
+    def add(self, name, recorder):
+        slowest, sql = recorder.slowest
+        with self.lock:
+            self.requests[name].append((recorder.count, recorder.duration, len(recorder.duplicates), slowest, sql))
+
+    def summary(self):
+        """One row per URL name, busiest first"""
+        with self.lock:
+            requests = {name: list(rows) for name, rows in self.requests.items()}
+        rows = []
+        for name, recorded in requests.items():
+            counts = [count for count, _, _, _, _ in recorded]
+            durations = [duration for _, duration, _, _, _ in recorded]
+            slowest, sql = max(((slowest, sql) for _, _, _, slowest, sql in recorded), key=lambda row: row[0])
+            rows.append({
+                'name': name,
+                'requests': len(recorded),
+                'mean_queries': sum(counts) / len(counts),
+                'max_queries': max(counts),
+                'mean_db_ms': sum(durations) * 1000 / len(durations),
+                'max_db_ms': max(durations) * 1000,
+                'duplicates': max(duplicates for _, _, duplicates, _, _ in recorded),
+                'slowest_ms': slowest * 1000,
+                'slowest_sql': sql[:SQL_PREVIEW],
+                'budget': settings.QUERY_BUDGETS.get(name),
+            })
+        return sorted(rows, key=lambda row: row['requests'], reverse=True)
+
+    def clear(self):
+        with self.lock:
+            self.requests.clear()
+
+
+stats = QueryStats()
+
+
+class QueryCountMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        recorder = QueryRecorder()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(recorder))
+            response = self.get_response(request)
+        # For lessons.metrics.MetricsMiddleware
+        request.query_recorder = recorder
+
+        response.headers['Server-Timing'] = ', '.join(
+            filter(None, [response.headers.get('Server-Timing'), recorder.server_timing()]))
+        match = request.resolver_match
+        name = match.view_name if match is not None else None
+        if name is not None:
+            stats.add(name, recorder)
+            self.check_budget(name, recorder)
+        return response
+
+    @staticmethod
+    def check_budget(name, recorder):
+        budget = settings.QUERY_BUDGETS.get(name, settings.QUERY_BUDGET_DEFAULT)
+        if budget is None or recorder.count <= budget:
+            return
+        message = f"{name} ran {recorder.count} queries, over its budget of {budget}"
+        if recorder.duplicates:
+            sql, count = recorder.duplicates[0]
+            message += f"; repeated {count} times: {sql[:SQL_PREVIEW]}"
+        if settings.QUERY_BUDGET_STRICT:
+            raise QueryBudgetExceeded(message)
+        logger.warning(message)
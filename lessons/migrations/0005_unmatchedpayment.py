@@ -0,0 +1,26 @@
+# Generated by Django 4.1.4 on 2026-10-18 11:49
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lessons', '0004_job'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UnmatchedPayment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('line_number', models.PositiveIntegerField()),
+                ('date_paid', models.DateTimeField(blank=True, null=True)),
+                ('amount', models.DecimalField(blank=True, decimal_places=2, max_digits=12, null=True)),
+                ('reference', models.CharField(blank=True, max_length=255)),
+                ('reason', models.CharField(max_length=100)),
+                ('created_date', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 4.1.4 on 2026-10-18 11:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lessons', '0005_unmatchedpayment'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(fields=['created_date', 'id'], name='invoice_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='request',
+            index=models.Index(fields=['isApproved', 'request_id'], name='request_approved_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['date_paid', 'id'], name='transaction_paid_idx'),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 4.1.4 on 2026-10-18 12:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lessons', '0007_lesson'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='request',
+            name='availability_mask',
+            field=models.PositiveSmallIntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='request',
+            index=models.Index(fields=['isApproved', 'availability_mask'], name='request_availability_idx'),
+        ),
+    ]
@@ -0,0 +1,40 @@
+from django.db import migrations
+
+BATCH_SIZE = 1000
+# Request.AVAILABILITY_CHOICES as of this migration, one bit each in this order
+SLOTS = ['MONDAYAM', 'MONDAYPM', 'TUESDAYAM', 'TUESDAYPM', 'WEDNESDAYAM', 'WEDNESDAYPM', 'THURSDAYAM', 'THURSDAYPM',
+         'FRIDAYAM', 'FRIDAYPM', 'SATURDAYAM', 'SATURDAYPM', 'SUNDAYAM', 'SUNDAYPM']
+
+
+def mask_of(codes):
+    mask = 0
+    for code in codes or []:
+        code = code.strip()
+        if code in SLOTS:
+            mask |= 1 << SLOTS.index(code)
+    return mask
+
+
+def backfill_availability_mask(apps, schema_editor):
+    Request = apps.get_model('lessons', 'Request')
+    last_id = 0
+    while True:
+        batch = list(Request.objects.filter(request_id__gt=last_id).only('request_id', 'availability')
+                     .order_by('request_id')[:BATCH_SIZE])
+        if not batch:
+            return
+        for request in batch:
+            request.availability_mask = mask_of(request.availability)
+        Request.objects.bulk_update(batch, ['availability_mask'])
+        last_id = batch[-1].request_id
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lessons', '0008_request_availability_mask'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_availability_mask, migrations.RunPython.noop),
+    ]
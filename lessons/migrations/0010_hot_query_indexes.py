@@ -0,0 +1,45 @@
+# Generated by Django 4.1.4 on 2026-10-18 12:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lessons', '0009_backfill_availability_mask'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='request',
+            name='request_approved_idx',
+        ),
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(fields=['status', 'created_date', 'id'], name='invoice_status_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='request',
+            index=models.Index(condition=models.Q(('isApproved', False)), fields=['request_id'], name='request_pending_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='request',
+            index=models.Index(condition=models.Q(('isApproved', True)), fields=['request_id'], name='request_approved_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='request',
+            index=models.Index(condition=models.Q(('isApproved', False)), fields=['user', 'request_id'], name='request_user_pending_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='request',
+            index=models.Index(condition=models.Q(('isApproved', True)), fields=['user', 'request_id'], name='request_user_approved_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='request',
+            index=models.Index(condition=models.Q(('isApproved', True)), fields=['child', 'request_id'], name='request_child_approved_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['created_by', 'date_paid', 'id'], name='transaction_user_paid_idx'),
+        ),
+    ]
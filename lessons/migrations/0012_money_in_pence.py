@@ -0,0 +1,74 @@
+from decimal import Decimal
+
+import django.core.validators
+from django.db import migrations, models
+from django.db.models import BigIntegerField, F
+from django.db.models.functions import Cast, Round
+
+import lessons.money
+
+BATCH_SIZE = 1000
+# (model, field) of every amount of money, all DecimalField(max_digits=12, decimal_places=2) before this migration
+MONEY_FIELDS = [('user', 'balance'), ('invoice', 'amount_to_be_paid'), ('transaction', 'amount'),
+                ('unmatchedpayment', 'amount')]
+
+
+def to_pence(apps, schema_editor):
+    # One UPDATE per table; NULLs stay NULL
+    for model_name, field in MONEY_FIELDS:
+        apps.get_model('lessons', model_name).objects.update(
+            **{field + '_pence': Cast(Round(F(field) * 100), output_field=BigIntegerField())})
+
+
+def to_pounds(apps, schema_editor):
+    # In Python, so that the division is exact whatever the database does with integer division
+    for model_name, field in MONEY_FIELDS:
+        model = apps.get_model('lessons', model_name)
+        last_pk = 0
+        while True:
+            batch = list(model.objects.filter(pk__gt=last_pk).only('pk', field + '_pence').order_by('pk')[:BATCH_SIZE])
+            if not batch:
+                break
+            for row in batch:
+                pence = getattr(row, field + '_pence')
+                setattr(row, field, None if pence is None else Decimal(pence).scaleb(-2))
+            model.objects.bulk_update(batch, [field])
+            last_pk = batch[-1].pk
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lessons', '0011_replicaheartbeat'),
+    ]
+
+    operations = [
+        *[migrations.AddField(model_name=model_name, name=field + '_pence', field=models.BigIntegerField(null=True))
+          for model_name, field in MONEY_FIELDS],
+        migrations.RunPython(to_pence, to_pounds),
+        *[migrations.RemoveField(model_name=model_name, name=field) for model_name, field in MONEY_FIELDS],
+        *[migrations.RenameField(model_name=model_name, old_name=field + '_pence', new_name=field)
+          for model_name, field in MONEY_FIELDS],
+        migrations.AlterField(
+            model_name='user',
+            name='balance',
+            field=lessons.money.MoneyField(default=lessons.money.Money(0), null=True,
+                                           validators=[django.core.validators.MinValueValidator(lessons.money.Money(0))]),
+        ),
+        migrations.AlterField(
+            model_name='invoice',
+            name='amount_to_be_paid',
+            field=lessons.money.MoneyField(null=True,
+                                           validators=[django.core.validators.MinValueValidator(lessons.money.Money(0))]),
+        ),
+        migrations.AlterField(
+            model_name='transaction',
+            name='amount',
+            field=lessons.money.MoneyField(validators=[django.core.validators.MinValueValidator(lessons.money.Money(1))]),
+        ),
+        migrations.AlterField(
+            model_name='unmatchedpayment',
+            name='amount',
+            field=lessons.money.MoneyField(blank=True, null=True),
+        ),
+    ]
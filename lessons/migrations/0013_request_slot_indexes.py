@@ -0,0 +1,25 @@
+# Generated by Django 4.1.4 on 2026-10-18 12:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lessons', '0012_money_in_pence'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='request',
+            name='request_availability_idx',
+        ),
+        migrations.AddIndex(
+            model_name='request',
+            index=models.Index(condition=models.Q(('isApproved', False)), fields=['availability_mask'], name='request_pending_slots_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='request',
+            index=models.Index(condition=models.Q(('isApproved', True)), fields=['availability_mask'], name='request_approved_slots_idx'),
+        ),
+    ]
@@ -1,9 +1,10 @@
-from decimal import Decimal
 from django.contrib.auth.models import AbstractUser
 from django.core.exceptions import ValidationError
 from django.core.validators import RegexValidator, MaxValueValidator, MinValueValidator
+from lessons import metrics
 from lessons.auth import MSMSUserManager
-from django.db import models
+from lessons.money import Money, MoneyField
+from django.db import models, transaction
 from multiselectfield import MultiSelectField
 import datetime as dt
 from django.utils import timezone
@@ -16,8 +17,8 @@ class User(AbstractUser):
     first_name = models.CharField(blank=True, unique=False, max_length=50)
     last_name = models.CharField(blank=True, unique=False, max_length=50)
     email = models.EmailField(unique=True, blank=False)
-    balance = models.DecimalField(blank=False, max_digits=12, default=Decimal('0.00'), decimal_places=2, null=True,
-                                  validators=[MinValueValidator(Decimal('0.00'))])  # Lyn version
+    balance = MoneyField(blank=False, default=Money(0), null=True,
+                         validators=[MinValueValidator(Money(0))])  # Lyn version
     # balance = models.IntegerField(blank=False, unique=False) # my version
 
     USERNAME_FIELD = 'email'
@@ -25,62 +26,47 @@ class User(AbstractUser):
 
     objects = MSMSUserManager()
 
-    def generateInvoices(self):
+    def save(self, *args, **kwargs):
+        # The balance column is kept up to date by lessons.ledger, so never write back a possibly stale copy of it
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [field.name for field in self._meta.concrete_fields
+                                       if not field.primary_key and field.name != 'balance']
+        super().save(*args, **kwargs)
 
-        approved = Request.objects.filter(isApproved=True, user=self.id, invoice=None)
-        for request in approved:
-            createInvoice(request)
+    def generateInvoices(self):
+        from lessons.invoicing import generate_invoices
+        generate_invoices(user_ids=[self.id])
 
     def generateChildInvoices(self):
-        for child in Child.objects.filter(parent=self):
-            approvedChild = Request.objects.filter(isApproved=True, child=child, invoice=None)
-            for request in approvedChild:
-                createInvoice(request)
+        # Requests made on behalf of children belong to the parent, so generateInvoices already covers them
         self.updateBalance()
 
-
     def updateBalance(self):
         self.generateInvoices()
-        invoices = Invoice.objects.filter(request__isApproved=True, request__user=self.id)
-        transactions = Transaction.objects.filter(created_by=self.id)
-        self.balance = calculateUserBalance(invoices, transactions)
-        self.save()
-
-
-def calculateUserBalance(invoices, transactions):
-    total_due = 0
-    total_paid = 0
-    for invoice in invoices:
-        total_due += invoice.amount_to_be_paid
-    for transaction in transactions:
-        total_paid += transaction.amount
-    return round(total_due - total_paid, 2)
+        # The ledger has already applied every invoice and transaction, so just reload the stored balance
+        self.refresh_from_db(fields=['balance'])
 
 
 def createInvoice(inpRequest):
-
-    # Helper function to generate the correct invoice number
-    def increment_invoice_number():
-        last_invoice = Invoice.objects.filter(request__user=inpRequest.user).order_by('created_date').last()
-        if not last_invoice:
-            # this is the first invoice for the user
-            first_part = str(inpRequest.user.id).zfill(4)
-            return first_part + '-001'
-        invoice_no = last_invoice.invoice_number
-        new_invoice_no = str(int(invoice_no[5:]) + 1)
-        new_invoice_no = invoice_no[0:-(len(new_invoice_no))] + new_invoice_no
-        return new_invoice_no
-
-    if ((not inpRequest.isApproved) or (inpRequest.DoesNotExist) or (inpRequest.invoice)):
+    if (not inpRequest.isApproved) or inpRequest.pk is None or inpRequest.invoice_id is not None:
         # raise ValidationError('Invalid Request')
         return
     new_invoice = Invoice.objects.create(request=inpRequest, amount_to_be_paid=inpRequest.get_total_amount_payable(),
-                                         invoice_number=increment_invoice_number())
+                                         invoice_number=InvoiceSequence.objects.reserve(inpRequest.user_id)[0])
     new_invoice.updateRequestInvoice()
     new_invoice.save()
+    metrics.invoices_created.inc_on_commit()
     return new_invoice
 
 
+def format_invoice_number(user_id, number):
+    """Format the number-th invoice of a user as xxxx-xxx, e.g. 0042-007"""
+    invoice_number = str(user_id).zfill(4) + '-' + str(number).zfill(3)
+    if len(invoice_number) != 8:
+        raise ValueError(f"Invoice {number} of user {user_id} does not fit the xxxx-xxx format")
+    return invoice_number
+
+
 class Child(models.Model):
     name = models.CharField(blank=False, unique=False, max_length=50)
     parent = models.ForeignKey(User, on_delete=models.CASCADE)
@@ -92,6 +78,35 @@ class Child(models.Model):
             )
         ]
 
+    def calendarToken(self):
+        from lessons.calendars import feed_token
+        return feed_token('child', self.id)
+
+
+class RequestQuerySet(models.QuerySet):
+    """
+    Filters on the half-days a request is available, evaluated by the database as bitwise operations on
+    availability_mask. Slots can be given as availability codes such as 'WEDNESDAYPM' or as masks.
+    """
+
+    def available_any(self, *slots):
+        """Requests available in at least one of the slots"""
+        mask = availability_mask(slots)
+        return self.alias(slot_overlap=models.F('availability_mask').bitand(mask)).filter(slot_overlap__gt=0)
+
+    def available_all(self, *slots):
+        """Requests available in every one of the slots"""
+        mask = availability_mask(slots)
+        return self.alias(slot_overlap=models.F('availability_mask').bitand(mask)).filter(slot_overlap=mask)
+
+    def free_with_teacher(self, teacher):
+        """Requests available in at least one half-day that the teacher has no approved lesson in"""
+        booked = availability_mask(slot_code(class_day, class_time) for class_day, class_time in
+                                   self.model.objects.filter(isApproved=True, teacher=teacher)
+                                   .values_list('class_Day', 'class_Time'))
+        free = ALL_SLOTS & ~booked
+        return self.available_any(free) if free else self.none()
+
 
 class Request(models.Model):
     """Model for a request"""
@@ -128,6 +143,9 @@ class Request(models.Model):
         (dt.time(hour=x), '{:02d}:00'.format(x)) for x in range(0, 24)
     ]
 
+    # The bit of availability_mask that stands for each availability choice, Monday AM first
+    AVAILABILITY_BITS = {code: 1 << bit for bit, (code, _) in enumerate(AVAILABILITY_CHOICES)}
+
     request_id = models.AutoField(
         primary_key=True
     )
@@ -148,6 +166,9 @@ class Request(models.Model):
         default="SUNDAYPM",
         max_length=200
     )
+    # The same availability as a bitmask of AVAILABILITY_BITS, kept in step by save()
+    # so slot queries are integer comparisons rather than LIKE over the joined codes
+    availability_mask = models.PositiveSmallIntegerField(default=0, editable=False)
 
     # Total number of lessons for a request in a term
     number_of_lessons = models.IntegerField(
@@ -226,6 +247,42 @@ class Request(models.Model):
     )
 
     invoice = models.OneToOneField('Invoice', on_delete=models.SET_NULL, null=True, blank=True, related_name='request.masterInvoice+')
+
+    class Meta:
+        indexes = [
+            # SQLite compares booleans as a bare column (WHERE NOT "isApproved"), which an index on
+            # (isApproved, ...) cannot search on, so each approval state gets partial indexes instead.
+            # The dashboards page through pending and approved requests in request_id order
+            models.Index(name="request_pending_idx", fields=('request_id',), condition=models.Q(isApproved=False)),
+            models.Index(name="request_approved_idx", fields=('request_id',), condition=models.Q(isApproved=True)),
+            # A student's own pending and approved requests, invoices and balance
+            models.Index(name="request_user_pending_idx", fields=('user', 'request_id'),
+                         condition=models.Q(isApproved=False)),
+            models.Index(name="request_user_approved_idx", fields=('user', 'request_id'),
+                         condition=models.Q(isApproved=True)),
+            # A child's calendar feed
+            models.Index(name="request_child_approved_idx", fields=('child', 'request_id'),
+                         condition=models.Q(isApproved=True)),
+            # Slot queries over pending or approved requests walk the masks of the requests in that state only.
+            # A bitwise test cannot be searched on, so a slot query over every request still reads the table
+            models.Index(name="request_pending_slots_idx", fields=('availability_mask',),
+                         condition=models.Q(isApproved=False)),
+            models.Index(name="request_approved_slots_idx", fields=('availability_mask',),
+                         condition=models.Q(isApproved=True)),
+        ]
+
+    objects = RequestQuerySet.as_manager()
+
+    def save(self, *args, **kwargs):
+        if 'availability' not in self.get_deferred_fields():
+            self.availability_mask = availability_mask(self.availability or [])
+            update_fields = kwargs.get('update_fields')
+            if update_fields is not None and 'availability' in update_fields:
+                kwargs['update_fields'] = set(update_fields) | {'availability_mask'}
+        # Keep the ledger update for an approval change in the same transaction as the row itself
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
     def clean(self):
         if self.child is not None and self.user != self.child.parent:
             raise ValidationError("The selected Child must have this User as its parent!")
@@ -236,10 +293,10 @@ class Request(models.Model):
     def get_total_class_duration_in_minutes(self):
         return self.number_of_lessons * self.duration
 
-    cost_per_minute = Decimal(10.00)  # Fixed cost per minute for any lesson
+    cost_per_minute = Money.of(10)  # Fixed cost per minute for any lesson
 
     def get_total_amount_payable(self):
-        return Decimal(self.get_total_class_duration_in_minutes * self.cost_per_minute)
+        return self.cost_per_minute * self.get_total_class_duration_in_minutes
 
     def __str__(self):
         # return the request ID, the user & the invoice associated with the request
@@ -247,6 +304,65 @@ class Request(models.Model):
         # return f"Request {self.request_id}"
 
 
+ALL_SLOTS = (1 << len(Request.AVAILABILITY_CHOICES)) - 1
+
+
+def availability_mask(slots):
+    """
+    The bitmask of a list of availability codes, which may also contain masks to include as they are.
+    A comma-joined string of codes, as assigned to Request.availability before it is saved, works too.
+    Unknown codes are skipped, as the migration that filled in the masks of existing requests skipped them.
+    """
+    if isinstance(slots, str):
+        slots = slots.split(',')
+    mask = 0
+    for slot in slots:
+        mask |= slot if isinstance(slot, int) else Request.AVAILABILITY_BITS.get(slot.strip(), 0)
+    return mask
+
+
+def availability_codes(mask):
+    """The availability codes set in a bitmask, in the order of AVAILABILITY_CHOICES"""
+    return [code for code, bit in Request.AVAILABILITY_BITS.items() if mask & bit]
+
+
+def slot_code(class_day, class_time):
+    """The availability code of the half-day a lesson starts in, e.g. ('WEDNESDAY', 14:00) is 'WEDNESDAYPM'"""
+    return class_day + ('AM' if class_time < dt.time(12) else 'PM')
+
+
+class LessonQuerySet(models.QuerySet):
+    def between(self, start, end):
+        """Lessons starting at or after start and before end"""
+        return self.filter(start__gte=start, start__lt=end)
+
+
+class Lesson(models.Model):
+    """One scheduled occurrence of an approved request, filled in by lessons.occurrences"""
+    request = models.ForeignKey(Request, on_delete=models.CASCADE, related_name='lessons')
+    # Copied from the request so a timetable can be read from this table alone
+    teacher = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='teaching')
+    student = models.ForeignKey(User, on_delete=models.CASCADE, related_name='lessons')
+    # 1 for the first lesson of the request, 2 for the second and so on
+    number = models.PositiveIntegerField()
+    start = models.DateTimeField()
+    end = models.DateTimeField()
+
+    objects = LessonQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(name="unique_lesson_number", fields=('request', 'number')),
+        ]
+        indexes = [
+            models.Index(name="lesson_teacher_start_idx", fields=('teacher', 'start')),
+            models.Index(name="lesson_student_start_idx", fields=('student', 'start')),
+        ]
+
+    def __str__(self):
+        return f"Lesson {self.number} of request {self.request_id} at {self.start}"
+
+
 class Invoice(models.Model):
     STATUS_CHOICES = [
         ('ACTIVE', 'Active'),
@@ -257,13 +373,21 @@ class Invoice(models.Model):
                                       help_text="Format: xxxx-xxx,required")
     request = models.OneToOneField(Request, on_delete=models.CASCADE, related_name='invoice.masterRequest+')
     created_date = models.DateTimeField(blank=False, default=timezone.now)
-    amount_to_be_paid = models.DecimalField(blank=False, max_digits=12, decimal_places=2, null=True,
-                                            validators=[MinValueValidator(Decimal('0.00'))])
+    amount_to_be_paid = MoneyField(blank=False, null=True, validators=[MinValueValidator(Money(0))])
     status = models.CharField(
         choices=STATUS_CHOICES,
         default="ACTIVE",
         max_length=7
     )
+
+    class Meta:
+        indexes = [
+            # The admin dashboard pages through invoices in (created_date, id) order
+            models.Index(name="invoice_created_idx", fields=('created_date', 'id')),
+            # ... and the same filtered by status
+            models.Index(name="invoice_status_created_idx", fields=('status', 'created_date', 'id')),
+        ]
+
     """
     def clean(self):
         if self.status is not "ACTIVE" or self.invoice_number is None or self.invoice_number == "":
@@ -277,6 +401,11 @@ class Invoice(models.Model):
 
     """
 
+    def save(self, *args, **kwargs):
+        # Keep the ledger update in the same transaction as the invoice itself
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
     def updateRequestInvoice(self):
         self.request.invoice = self
         self.request.save()
@@ -286,13 +415,114 @@ class Invoice(models.Model):
         return self.invoice_number
 
 
+class InvoiceSequenceManager(models.Manager):
+    """
+    Hands out invoice numbers by atomically incrementing a per-user counter.
+    The UPDATE takes the row (or on SQLite, database) write lock before the new value
+    is read back, so two approvals racing each other can never get the same number.
+    """
+
+    def reserve(self, user_id, count=1):
+        """Reserve the next count invoice numbers for a single user."""
+        return self.reserve_blocks({user_id: count})[user_id]
+
+    def reserve_blocks(self, counts):
+        """
+        Reserve a block of invoice numbers for each user in one go.
+        counts maps a user id to how many numbers it needs; returns a dict of user id to a list of invoice numbers.
+        """
+        counts = {user_id: count for user_id, count in counts.items() if count > 0}
+        if not counts:
+            return {}
+        with transaction.atomic():
+            existing = set(self.filter(user__in=counts).values_list('user_id', flat=True))
+            missing = [user_id for user_id in counts if user_id not in existing]
+            if missing:
+                # Start new sequences after any invoices the user was given before sequences existed
+                last_numbers = dict(Invoice.objects.filter(request__user__in=missing).values('request__user')
+                                    .annotate(last=models.Max('invoice_number')).values_list('request__user', 'last'))
+                self.bulk_create([self.model(user_id=user_id, last_number=int(last_numbers[user_id][5:])
+                                             if user_id in last_numbers else 0) for user_id in missing],
+                                 ignore_conflicts=True)
+            # One UPDATE per distinct block size, which is usually just one
+            by_count = {}
+            for user_id, count in counts.items():
+                by_count.setdefault(count, []).append(user_id)
+            for count, user_ids in by_count.items():
+                self.filter(user__in=user_ids).update(last_number=models.F('last_number') + count)
+            reserved = self.filter(user__in=counts).values_list('user_id', 'last_number')
+            return {user_id: [format_invoice_number(user_id, number)
+                              for number in range(last_number - counts[user_id] + 1, last_number + 1)]
+                    for user_id, last_number in reserved}
+
+
+class InvoiceSequence(models.Model):
+    """The number of the last invoice issued to a user"""
+    user = models.OneToOneField(User, primary_key=True, on_delete=models.CASCADE, related_name='invoice_sequence')
+    last_number = models.PositiveIntegerField(default=0)
+
+    objects = InvoiceSequenceManager()
+
+
+class Job(models.Model):
+    """A unit of background work for the run_worker command, e.g. invoicing a user's newly approved requests"""
+    INVOICE = 'INVOICE'
+    BALANCE = 'BALANCE'
+    KIND_CHOICES = [
+        (INVOICE, 'Generate invoices'),
+        (BALANCE, 'Refresh balance'),
+    ]
+    PENDING = 'PENDING'
+    FAILED = 'FAILED'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (FAILED, 'Failed'),
+    ]
+    kind = models.CharField(choices=KIND_CHOICES, max_length=7)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='jobs')
+    status = models.CharField(choices=STATUS_CHOICES, default=PENDING, max_length=7)
+    attempts = models.PositiveIntegerField(default=0)
+    run_after = models.DateTimeField(default=timezone.now)
+    created_date = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+
+    class Meta:
+        constraints = [
+            # Duplicate jobs for the same user are coalesced into the one already waiting
+            models.UniqueConstraint(
+                name="unique_pending_job_per_user",
+                fields=('kind', 'user'),
+                condition=models.Q(status='PENDING')
+            )
+        ]
+        indexes = [
+            models.Index(name="job_queue_idx", fields=('status', 'run_after')),
+        ]
+
+    def __str__(self):
+        return f"{self.get_kind_display()} for user {self.user_id} ({self.get_status_display()})"
+
+
 class Transaction(models.Model):
-    amount = models.DecimalField(max_digits=12, decimal_places=2, blank=False,
-                                 validators=[MinValueValidator(Decimal('0.01'))])
+    amount = MoneyField(blank=False, validators=[MinValueValidator(Money(1))])
     invoice = models.ForeignKey(Invoice, on_delete=models.SET_NULL, null=True)
     date_paid = models.DateTimeField(default=timezone.now)
     created_by = models.ForeignKey(User, null=True, on_delete=models.PROTECT, related_name='student_user')
     administrated_by = models.ForeignKey(User, null=True, on_delete=models.SET_NULL, related_name='admin_user')
+
+    class Meta:
+        indexes = [
+            # The admin dashboard pages through transactions in (date_paid, id) order
+            models.Index(name="transaction_paid_idx", fields=('date_paid', 'id')),
+            # A student's payments in the same order
+            models.Index(name="transaction_user_paid_idx", fields=('created_by', 'date_paid', 'id')),
+        ]
+
+    def save(self, *args, **kwargs):
+        # Keep the ledger update in the same transaction as the payment itself
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
     def clean(self):
         if self.amount is None or self.amount == "":
             raise ValidationError("The selected Transaction has no amount!")
@@ -323,3 +553,28 @@ class Transaction(models.Model):
         else:
             raise ValidationError("The selected Transaction amount is invalid!")
         """
+
+
+class UnmatchedPayment(models.Model):
+    """A line of an imported bank statement that could not be matched to an invoice, waiting for review"""
+    line_number = models.PositiveIntegerField()
+    date_paid = models.DateTimeField(null=True, blank=True)
+    amount = MoneyField(null=True, blank=True)
+    reference = models.CharField(blank=True, max_length=255)
+    reason = models.CharField(max_length=100)
+    created_date = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"Line {self.line_number}: {self.reference} ({self.reason})"
+
+
+class ReplicaHeartbeat(models.Model):
+    """
+    A single row holding the time the replica was last brought up to date, written on the primary
+    just before each sync. Read back from the replica, it shows how far behind the replica is (see msms.routers).
+    """
+    beat = models.DateTimeField()
+
+    @classmethod
+    def stamp(cls):
+        cls.objects.using('default').update_or_create(pk=1, defaults={'beat': timezone.now()})
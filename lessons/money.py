@@ -0,0 +1,182 @@
+"""
+Money as whole numbers of minor units (pence).
+
+MoneyField stores an amount as a BIGINT count of pence, so SUM() in the
+database is an integer sum and the ledger's arithmetic is integer arithmetic.
+In Python the amount is a Money, a small immutable wrapper round the int:
+
+- Adding or subtracting Money is int arithmetic, so the ledger's loops
+  allocate no Decimals.
+- Money compares equal to the Decimal or int (in pounds) of the same value,
+  so Money('12.34') == Decimal('12.34') and Money(0) == 0.
+- str() gives the usual two-place form, '12.34', as templates, exports and
+  forms expect.
+
+Money.of() converts a Decimal, str, int or float in pounds, rounding half up
+to the penny. Money(1234) is 1234 pence. Code that needs the raw integers
+can aggregate with output_field=BigIntegerField() and wrap the result once.
+"""
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+from functools import total_ordering
+
+from django import forms
+from django.core.exceptions import ValidationError
+from django.db import models
+
+PENNY = Decimal('0.01')
+# The most digits, pounds and pence together, an amount may have; as the DecimalFields MoneyField replaced
+MAX_DIGITS = 12
+
+
+@total_ordering
+class Money:
+    __slots__ = ('cents',)
+
+    def __init__(self, cents=0):
+        if not isinstance(cents, int):
+            raise TypeError(f"Money takes a whole number of pence, not {cents!r}; use Money.of() for pounds")
+        self.cents = cents
+
+    @classmethod
+    def of(cls, value):
+        """Money from an amount in pounds, rounded half up to the penny"""
+        if isinstance(value, Money):
+            return value
+        if isinstance(value, int):
+            return cls(value * 100)
+        if isinstance(value, float):
+            value = str(value)
+        amount = Decimal(value)
+        if not amount.is_finite():
+            raise ValueError(f"Not an amount of money: {value!r}")
+        return cls(int(amount.quantize(PENNY, rounding=ROUND_HALF_UP).scaleb(2)))
+
+    def deconstruct(self):
+        # So defaults and validators holding Money can be written into migrations
+        return 'lessons.money.Money', (self.cents,), {}
+
+    @property
+    def decimal(self):
+        return Decimal(self.cents).scaleb(-2)
+
+    def __str__(self):
+        sign = '-' if self.cents < 0 else ''
+        pounds, pence = divmod(abs(self.cents), 100)
+        return f'{sign}{pounds}.{pence:02d}'
+
+    def __repr__(self):
+        return f"Money('{self}')"
+
+    def __hash__(self):
+        return hash(self.decimal)
+
+    def __bool__(self):
+        return self.cents != 0
+
+    @staticmethod
+    def _cents(other):
+        """The pence in other if it is Money or a whole number of pence in pounds, otherwise None"""
+        if isinstance(other, Money):
+            return other.cents
+        if isinstance(other, int):
+            return other * 100
+        if isinstance(other, Decimal) and other.is_finite() and other == other.quantize(PENNY):
+            return int(other.scaleb(2))
+        return None
+
+    def __eq__(self, other):
+        cents = self._cents(other)
+        if cents is not None:
+            return self.cents == cents
+        if isinstance(other, (Decimal, float)):
+            return self.decimal == other
+        return NotImplemented
+
+    def __lt__(self, other):
+        cents = self._cents(other)
+        if cents is not None:
+            return self.cents < cents
+        if isinstance(other, (Decimal, float)):
+            return self.decimal < other
+        return NotImplemented
+
+    def __add__(self, other):
+        if isinstance(other, (Money, int, Decimal)):
+            return Money(self.cents + Money.of(other).cents)
+        return NotImplemented
+
+    __radd__ = __add__
+
+    def __sub__(self, other):
+        if isinstance(other, (Money, int, Decimal)):
+            return Money(self.cents - Money.of(other).cents)
+        return NotImplemented
+
+    def __rsub__(self, other):
+        if isinstance(other, (int, Decimal)):
+            return Money(Money.of(other).cents - self.cents)
+        return NotImplemented
+
+    def __mul__(self, factor):
+        if isinstance(factor, int):
+            return Money(self.cents * factor)
+        if isinstance(factor, (Decimal, float)):
+            return Money.of(self.decimal * Decimal(str(factor)))
+        return NotImplemented
+
+    __rmul__ = __mul__
+
+    def __neg__(self):
+        return Money(-self.cents)
+
+    def __abs__(self):
+        return Money(abs(self.cents))
+
+
+class MoneyField(models.BigIntegerField):
+    """
+    An amount of money, stored as a whole number of pence and read back as Money.
+
+    Validation accepts Money, or pounds as an int, Decimal or str with at most two decimal places and
+    MAX_DIGITS digits, and rejects floats. Saving rounds any amount to the penny, as DecimalField did.
+    """
+    description = "Amount of money in pence"
+    default_error_messages = {
+        'invalid': "“%(value)s” value must be an amount of money with at most two decimal places.",
+        'max_digits': f"Ensure that there are no more than {MAX_DIGITS} digits in total.",
+    }
+
+    def from_db_value(self, value, expression, connection):
+        return None if value is None else Money(value)
+
+    def to_python(self, value):
+        if value is None or isinstance(value, Money):
+            return value
+        if isinstance(value, float):
+            raise ValidationError(self.error_messages['invalid'], code='invalid', params={'value': value})
+        try:
+            money = Money.of(value)
+        except (InvalidOperation, TypeError, ValueError):
+            raise ValidationError(self.error_messages['invalid'], code='invalid', params={'value': value})
+        if money != (value if isinstance(value, (int, Decimal)) else Decimal(value)):
+            raise ValidationError(self.error_messages['invalid'], code='invalid', params={'value': value})
+        return money
+
+    def validate(self, value, model_instance):
+        super().validate(value, model_instance)
+        if value is not None and abs(value.cents) >= 10 ** MAX_DIGITS:
+            raise ValidationError(self.error_messages['max_digits'], code='max_digits')
+
+    def get_prep_value(self, value):
+        if value is None or hasattr(value, 'resolve_expression'):
+            return value
+        return Money.of(value).cents
+
+    def value_to_string(self, obj):
+        value = self.value_from_object(obj)
+        return None if value is None else str(value)
+
+    def formfield(self, **kwargs):
+        # Entered in pounds and pence, as before amounts were stored in pence
+        return models.Field.formfield(self, **{'form_class': forms.DecimalField, 'max_digits': MAX_DIGITS,
+                                               'decimal_places': 2, **kwargs})
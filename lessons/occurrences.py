@@ -0,0 +1,101 @@
+"""
+Materialised lesson occurrences.
+
+A request only stores its schedule: the first lesson is on the first class_Day
+on or after start_Date, at class_Time, and the rest follow every interval weeks
+until number_of_lessons have been given. The Lesson table holds one row per
+occurrence, so questions like "what is on next Tuesday" are one indexed range
+query on (teacher, start) or (student, start) instead of expanding every
+approved request in Python.
+
+The occurrences of a request are offsets from its first lesson
+(first + k * interval weeks), so expanding a request is a single list
+comprehension with no stepping from day to day.
+"""
+import datetime as dt
+
+from django.db import transaction
+from django.utils import timezone
+
+from lessons.models import Request, Lesson
+
+BATCH_SIZE = 1000
+WEEKDAYS = {day: index for index, (day, _) in enumerate(Request.DAY_CHOICES)}
+SCHEDULE_COLUMNS = ('request_id', 'user_id', 'teacher_id', 'class_Day', 'class_Time', 'start_Date', 'interval',
+                    'number_of_lessons', 'duration', 'isApproved')
+
+
+def first_lesson_date(start_date, class_day):
+    """The first date on or after start_date that falls on class_day, e.g. 'MONDAY'"""
+    if isinstance(start_date, dt.datetime):
+        start_date = timezone.localtime(start_date).date() if timezone.is_aware(start_date) else start_date.date()
+    return start_date + dt.timedelta(days=(WEEKDAYS[class_day] - start_date.weekday()) % 7)
+
+
+def lesson_times(request):
+    """The (start, end) of every lesson of a request, in order"""
+    first = first_lesson_date(request.start_Date, request.class_Day)
+    step = dt.timedelta(weeks=request.interval)
+    length = dt.timedelta(minutes=request.duration)
+    tz = timezone.get_current_timezone()
+    starts = [timezone.make_aware(dt.datetime.combine(first + step * k, request.class_Time), tz)
+              for k in range(request.number_of_lessons)]
+    return [(start, start + length) for start in starts]
+
+
+def build_lessons(request):
+    """Unsaved Lesson rows for every occurrence of an approved request, or none if it is not approved"""
+    if not request.isApproved:
+        return []
+    return [Lesson(request_id=request.request_id, teacher_id=request.teacher_id, student_id=request.user_id,
+                   number=number, start=start, end=end)
+            for number, (start, end) in enumerate(lesson_times(request), start=1)]
+
+
+def sync_lessons(request):
+    """
+    Bring the lessons of one request in line with its schedule after it is approved or edited.
+    Only the occurrences that changed are written. Returns the number of lessons created, updated and deleted.
+    """
+    wanted = {lesson.number: lesson for lesson in build_lessons(request)}
+    existing = {lesson.number: lesson for lesson in Lesson.objects.filter(request_id=request.request_id)}
+    changed = []
+    for number, lesson in wanted.items():
+        old = existing.get(number)
+        if old is not None and (old.start, old.end, old.teacher_id, old.student_id) != \
+                (lesson.start, lesson.end, lesson.teacher_id, lesson.student_id):
+            old.start, old.end, old.teacher_id, old.student_id = \
+                lesson.start, lesson.end, lesson.teacher_id, lesson.student_id
+            changed.append(old)
+    created = [lesson for number, lesson in wanted.items() if number not in existing]
+    removed = [old.pk for number, old in existing.items() if number not in wanted]
+    with transaction.atomic():
+        Lesson.objects.bulk_create(created)
+        Lesson.objects.bulk_update(changed, ['start', 'end', 'teacher', 'student'])
+        Lesson.objects.filter(pk__in=removed).delete()
+    return len(created), len(changed), len(removed)
+
+
+def replace_lessons(requests):
+    """Rewrite the lessons of a batch of requests with one DELETE and one bulk INSERT. Returns the lessons created."""
+    with transaction.atomic():
+        Lesson.objects.filter(request__in=[request.request_id for request in requests]).delete()
+        return Lesson.objects.bulk_create([lesson for request in requests for lesson in build_lessons(request)])
+
+
+def backfill_lessons(batch_size=BATCH_SIZE):
+    """
+    Expand every approved request into lessons, batch_size requests at a time, and remove the lessons of
+    requests that are no longer approved. Returns the number of requests expanded and lessons created.
+    """
+    Lesson.objects.filter(request__isApproved=False).delete()
+    expanded = created = 0
+    last_id = 0
+    while True:
+        batch = list(Request.objects.filter(isApproved=True, request_id__gt=last_id)
+                     .only(*SCHEDULE_COLUMNS).order_by('request_id')[:batch_size])
+        if not batch:
+            return expanded, created
+        created += len(replace_lessons(batch))
+        expanded += len(batch)
+        last_id = batch[-1].request_id
@@ -0,0 +1,128 @@
+"""
+Keyset (cursor) pagination for the dashboard tables.
+
+Instead of an OFFSET, which makes the database step over every earlier row, a
+page starts from a cursor holding the sort key of the last row already shown.
+The next page is then the rows whose key comes after the cursor, read from an
+index in order. Each page costs one query however deep the user pages. The
+key must be unique, so it always ends with the primary key, which also keeps
+the order stable when other key values are equal.
+
+Each table on a page uses its own query string prefix so they page
+independently, e.g. ?invoices_after=<cursor>&pending_before=<cursor>.
+"""
+import base64
+import json
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from django.utils.functional import SimpleLazyObject
+
+PER_PAGE = 25
+
+
+def encode_cursor(values):
+    # str() keeps the microseconds of a datetime, which DjangoJSONEncoder would round to milliseconds
+    return base64.urlsafe_b64encode(json.dumps(values, default=str).encode()).decode()
+
+
+def decode_cursor(cursor, fields):
+    """The key values held in a cursor, converted back to the types of fields, or None if it is not valid"""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if not isinstance(values, list) or len(values) != len(fields):
+            return None
+        return [field.to_python(value) for field, value in zip(fields, values)]
+    except (ValueError, TypeError, ValidationError):
+        return None
+
+
+def _beyond(keys, values, lookup):
+    """
+    Q for the rows whose keys come after values, or before them if lookup is 'lt'.
+    (a, b) > (x, y) is written as a >= x AND (a > x OR b > y) so the index on a bounds the scan.
+    """
+    key, value = keys[0], values[0]
+    if len(keys) == 1:
+        return Q(**{f'{key}__{lookup}': value})
+    return Q(**{f'{key}__{lookup}e': value}) & (
+        Q(**{f'{key}__{lookup}': value}) | _beyond(keys[1:], values[1:], lookup))
+
+
+class KeysetPage(list):
+    """
+    The rows of one page, with the query strings that link to the pages either side of it.
+    first() and last() work as they do on a QuerySet.
+    """
+
+    def __init__(self, rows, params, prefix, has_next, has_previous, first_key, last_key):
+        super().__init__(rows)
+        self.has_next = has_next
+        self.has_previous = has_previous
+        self.next_query = self._query(params, prefix, 'after', last_key) if has_next else ''
+        self.previous_query = self._query(params, prefix, 'before', first_key) if has_previous else ''
+
+    @staticmethod
+    def _query(params, prefix, direction, key):
+        params = params.copy()
+        params.pop(prefix + 'after', None)
+        params.pop(prefix + 'before', None)
+        if key is not None:
+            params[prefix + direction] = encode_cursor(key)
+        return '?' + params.urlencode()
+
+    def first(self):
+        return self[0] if self else None
+
+    def last(self):
+        return self[-1] if self else None
+
+
+def paginate(queryset, params, prefix, keys, filters=None, row=None, per_page=PER_PAGE):
+    """
+    One page of queryset ordered by keys, a tuple of field names ending with the primary key.
+    params is the request's GET QueryDict, which holds the cursor and any filters for this table.
+    filters maps a query string parameter, e.g. 'status', to the lookup it filters on; empty or invalid
+    values are ignored.
+    row, if given, turns each object into what the template shows for it, e.g. a dict.
+    """
+    model = queryset.model
+    for param, lookup in (filters or {}).items():
+        value = params.get(prefix + param)
+        if value:
+            field = model._meta.get_field(lookup.split('__')[0])
+            try:
+                queryset = queryset.filter(**{lookup: value if field.is_relation else field.to_python(value)})
+            except (ValidationError, ValueError):
+                pass
+
+    fields = [model._meta.get_field(key) for key in keys]
+    after = decode_cursor(params.get(prefix + 'after', ''), fields)
+    before = decode_cursor(params.get(prefix + 'before', ''), fields) if after is None else None
+
+    if before is not None:
+        queryset = queryset.filter(_beyond(keys, before, 'lt')).order_by(*('-' + key for key in keys))
+    else:
+        if after is not None:
+            queryset = queryset.filter(_beyond(keys, after, 'gt'))
+        queryset = queryset.order_by(*keys)
+    rows = list(queryset[:per_page + 1])
+    more = len(rows) > per_page
+    rows = rows[:per_page]
+    if before is not None:
+        rows.reverse()
+        has_next, has_previous = True, more
+    else:
+        has_next, has_previous = more, after is not None
+
+    def key_of(row):
+        return [getattr(row, field.attname) for field in fields]
+
+    # An empty page, e.g. from a cursor past the last row, links back to the first page
+    return KeysetPage(map(row, rows) if row is not None else rows, params, prefix, has_next, has_previous,
+                      key_of(rows[0]) if rows else None, key_of(rows[-1]) if rows else None)
+
+
+def lazy_paginate(*args, **kwargs):
+    """paginate(), but only run when the page is first used, so a table served from the cache costs no query"""
+    return SimpleLazyObject(lambda: paginate(*args, **kwargs))
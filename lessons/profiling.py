@@ -0,0 +1,204 @@
+"""
+On-demand profiling of single requests.
+
+ProfilingMiddleware runs a request under cProfile when either:
+
+- the request carries a token from profile_token(), in the X-Profile header
+  or the profile query parameter. Staff get a token on the /profiles/ page,
+  and it expires after settings.PROFILE_TOKEN_MAX_AGE seconds.
+- the request is sampled: one request in settings.PROFILE_SAMPLE_RATE is
+  profiled, or none when that is 0.
+
+The middleware sits last, so a profile covers the view and the templates it
+renders, but not the other middleware. Content a StreamingHttpResponse
+generates after the view has returned is not profiled either.
+
+Each profile is saved under settings.PROFILE_DIR as three files named by its
+id: the pstats dump (for pstats, snakeviz and the like), the stacks in the
+collapsed format that flamegraph.pl and speedscope read, and a small JSON
+record of the page, its duration and why it was profiled. Only the newest
+settings.PROFILE_KEEP profiles are kept. The id is returned in the X-Profile
+response header, and staff can list and download the profiles at /profiles/.
+
+cProfile records calls between pairs of functions rather than whole stacks,
+so the collapsed stacks are rebuilt from the call graph by sharing each
+function's time between its callers in proportion to the time spent under
+each. They are exact for functions with a single caller, and a close
+estimate otherwise.
+"""
+import cProfile
+import datetime as dt
+import json
+import logging
+import os
+import pstats
+import random
+import re
+import sys
+import time
+import uuid
+
+from django.conf import settings
+from django.core import signing
+
+logger = logging.getLogger(__name__)
+
+SALT = 'lessons.profiling'
+HEADER = 'X-Profile'
+PARAMETER = 'profile'
+KINDS = {'pstats': 'application/octet-stream', 'collapsed': 'text/plain'}
+PROFILE_ID = re.compile(r'^\d{8}T\d{6}-[0-9a-f]{8}$')
+# Call paths under this many seconds are left out of the collapsed stacks, which would otherwise grow exponentially
+MIN_STACK_SECONDS = 0.00005
+MAX_STACK_DEPTH = 200
+
+
+def profile_token(user):
+    """A token that has requests profiled, for a staff user"""
+    return signing.TimestampSigner(salt=SALT).sign(str(user.pk))
+
+
+def read_token(token):
+    """The id of the user a token was made for, or None if it was not made by profile_token() or has expired"""
+    try:
+        user_id = signing.TimestampSigner(salt=SALT).unsign(token, max_age=settings.PROFILE_TOKEN_MAX_AGE)
+    except signing.BadSignature:
+        return None
+    return int(user_id) if user_id.isdigit() else None
+
+
+def trigger(request):
+    """Why a request should be profiled ('token' or 'sample'), or None if it should not be"""
+    token = request.headers.get(HEADER) or request.GET.get(PARAMETER)
+    if token and read_token(token) is not None:
+        return 'token'
+    rate = settings.PROFILE_SAMPLE_RATE
+    if rate and random.randrange(rate) == 0:
+        return 'sample'
+    return None
+
+
+def label(function):
+    filename, line, name = function
+    if filename == '~':
+        return name.replace(';', ',')
+    return f"{name} ({os.path.basename(filename)}:{line})".replace(';', ',')
+
+
+def collapsed_stacks(stats):
+    """
+    The stacks in a pstats.Stats, as collapsed 'outer;...;inner microseconds' lines of the time spent in the
+    innermost function on that stack, largest first
+    """
+    callees = {}
+    for function, (_, _, _, _, callers) in stats.stats.items():
+        for caller, edge in callers.items():
+            callees.setdefault(caller, []).append((function, edge[3]))
+    roots = [function for function, (_, _, _, _, callers) in stats.stats.items() if not callers]
+
+    totals = {}
+    # (function, labels of the stack up to and including it, the functions on it, its share of the function's time)
+    pending = [(root, [label(root)], {root}, 1.0) for root in roots]
+    while pending:
+        function, stack, on_stack, share = pending.pop()
+        _, _, own_time, cumulative, _ = stats.stats[function]
+        key = ';'.join(stack)
+        totals[key] = totals.get(key, 0.0) + own_time * share
+        if len(stack) >= MAX_STACK_DEPTH:
+            continue
+        for callee, edge_cumulative in callees.get(function, []):
+            spent = edge_cumulative * share
+            callee_cumulative = stats.stats[callee][3]
+            if callee in on_stack or spent < MIN_STACK_SECONDS or not callee_cumulative:
+                continue
+            pending.append((callee, stack + [label(callee)], on_stack | {callee},
+                            min(spent / callee_cumulative, 1.0)))
+    lines = [(stack, round(seconds * 1_000_000)) for stack, seconds in totals.items()]
+    return [f"{stack} {microseconds}" for stack, microseconds in sorted(lines, key=lambda line: -line[1])
+            if microseconds > 0]
+
+
+def path_for(profile_id, kind):
+    return os.path.join(settings.PROFILE_DIR, f"{profile_id}.{kind}")
+
+
+def save(profiler, record):
+    """Write a finished profile and its record to settings.PROFILE_DIR, then prune the oldest. Returns its id."""
+    os.makedirs(settings.PROFILE_DIR, exist_ok=True)
+    profile_id = f"{dt.datetime.now(dt.timezone.utc):%Y%m%dT%H%M%S}-{uuid.uuid4().hex[:8]}"
+    stats = pstats.Stats(profiler)
+    stats.dump_stats(path_for(profile_id, 'pstats'))
+    with open(path_for(profile_id, 'collapsed'), 'w') as file:
+        file.writelines(line + '\n' for line in collapsed_stacks(stats))
+    # The record last, so the list only ever shows complete profiles
+    with open(path_for(profile_id, 'json'), 'w') as file:
+        json.dump({'id': profile_id, **record}, file)
+    prune()
+    return profile_id
+
+
+def recent(limit=None):
+    """The records of the saved profiles, newest first"""
+    try:
+        names = sorted((name for name in os.listdir(settings.PROFILE_DIR) if name.endswith('.json')), reverse=True)
+    except FileNotFoundError:
+        return []
+    records = []
+    for name in names[:limit]:
+        try:
+            with open(os.path.join(settings.PROFILE_DIR, name)) as file:
+                records.append(json.load(file))
+        except (OSError, ValueError):
+            continue
+    return records
+
+
+def prune(keep=None):
+    """Delete all but the newest keep (settings.PROFILE_KEEP) profiles"""
+    keep = settings.PROFILE_KEEP if keep is None else keep
+    ids = sorted((name[:-len('.json')] for name in os.listdir(settings.PROFILE_DIR) if name.endswith('.json')),
+                 reverse=True)
+    for profile_id in ids[keep:]:
+        for kind in ('json', *KINDS):
+            try:
+                os.remove(path_for(profile_id, kind))
+            except FileNotFoundError:
+                pass
+
+
+class ProfilingMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        reason = trigger(request)
+        # cProfile cannot nest, so leave requests alone while something else is profiling
+        if reason is None or sys.getprofile() is not None:
+            return self.get_response(request)
+
+        profiler = cProfile.Profile()
+        began = time.perf_counter()
+        profiler.enable()
+        try:
+            response = self.get_response(request)
+        finally:
+            profiler.disable()
+        duration = time.perf_counter() - began
+
+        match = request.resolver_match
+        try:
+            profile_id = save(profiler, {
+                'name': match.view_name if match is not None else None,
+                'path': request.path,
+                'method': request.method,
+                'status': response.status_code,
+                'duration_ms': round(duration * 1000, 3),
+                'user_id': request.user.pk if hasattr(request, 'user') else None,
+                'trigger': reason,
+                'created': dt.datetime.now(dt.timezone.utc).isoformat(timespec='seconds'),
+            })
+        except OSError:
+            logger.exception("Could not save the profile of %s", request.path)
+            return response
+        response.headers[HEADER] = profile_id
+        return response
@@ -0,0 +1,68 @@
+"""
+Query plans of the hot queries.
+
+HOT_QUERIES names the queries that run on every dashboard load, feed poll
+or balance update, built the same way the code that runs them builds them.
+full_scans() runs EXPLAIN QUERY PLAN on a queryset and returns the tables
+SQLite would read in full instead of through an index.
+lessons/tests/test_query_plans.py fails if any hot query does. A change to
+a filter that stops an index from matching is then caught by the tests,
+long before the tables are big enough for it to show.
+
+The ids in the queries are placeholders; plans do not depend on them.
+"""
+from django.db import connections
+from django.db.models import Sum
+
+from lessons import calendars, invoicing, selectors
+from lessons.models import Invoice, Request, Transaction
+
+PAGE = 26
+
+HOT_QUERIES = {
+    # The student dashboard and the student pages staff see
+    'user_pending_requests': lambda: selectors.pending_requests(user=1).order_by('request_id'),
+    'user_approved_requests': lambda: selectors.approved_requests(user=1).order_by('request_id'),
+    'user_active_invoices': lambda: selectors.invoices_table(user=1, status='ACTIVE'),
+    'user_transactions': lambda: selectors.transactions_table(user=1).order_by('date_paid', 'id'),
+    'children': lambda: selectors.children_table(1),
+    # The admin dashboard, a page at a time
+    'pending_requests_page': lambda: selectors.pending_requests().order_by('request_id')[:PAGE],
+    'invoices_by_status_page': lambda: selectors.invoices_table(status='CLOSED').order_by('created_date', 'id')[:PAGE],
+    'transactions_page': lambda: selectors.transactions_table().order_by('date_paid', 'id')[:PAGE],
+    # Calendar feeds
+    'student_feed': lambda: calendars.feed_requests('student', 1),
+    'child_feed': lambda: calendars.feed_requests('child', 1),
+    'teacher_feed': lambda: calendars.feed_requests('teacher', 1),
+    # Invoicing, approvals and balances
+    'uninvoiced_requests': lambda: invoicing.uninvoiced_requests(),
+    'user_uninvoiced_requests': lambda: invoicing.uninvoiced_requests(user_ids=[1]),
+    'teacher_bookings': lambda: Request.objects.filter(isApproved=True, teacher__isnull=False, teacher__in=[1])
+    .values_list('request_id', 'teacher_id', 'class_Day', 'class_Time'),
+    'user_invoiced_total': lambda: Invoice.objects.filter(request__isApproved=True, request__user=1)
+    .values('request__user').annotate(total=Sum('amount_to_be_paid')),
+    'user_paid_total': lambda: Transaction.objects.filter(created_by=1)
+    .values('created_by').annotate(total=Sum('amount')),
+}
+
+
+def explain(queryset, using='default'):
+    """The detail lines of SQLite's EXPLAIN QUERY PLAN for a queryset"""
+    sql, params = queryset.query.sql_with_params()
+    with connections[using].cursor() as cursor:
+        cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+        return [row[-1] for row in cursor.fetchall()]
+
+
+def full_scans(queryset, using='default'):
+    """
+    The plan lines in which SQLite reads a whole table rather than searching an index.
+    Walking an index in order (SCAN ... USING INDEX) is not counted, as a LIMIT stops it after a page.
+    """
+    return [line for line in explain(queryset, using) if line.startswith('SCAN ') and ' INDEX ' not in line
+            and 'PRIMARY KEY' not in line]
+
+
+def sorts(queryset, using='default'):
+    """The plan lines in which SQLite sorts the rows itself because no index gives them in order"""
+    return [line for line in explain(queryset, using) if line.startswith('USE TEMP B-TREE')]
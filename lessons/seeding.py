@@ -0,0 +1,292 @@
+"""
+Bulk seeding of fake students, requests, invoices and payments.
+
+Everything is built in memory and inserted with bulk_create, batch_size
+students at a time, so the number of queries grows with the number of
+batches rather than the number of rows. Passwords are hashed once and the
+hash is shared by every seeded account, because hashing is deliberately
+slow and would otherwise dominate. Invoices go through
+lessons.invoicing.invoice_requests(), which reserves invoice numbers a block
+per user, and balances are recalculated with one UPDATE per batch.
+
+Names come from small pools drawn from Faker up front, and every other
+choice from a random.Random. Seeding again with the same seed and profile
+gives the same data.
+
+unseed() clears the seeded data the same way: table by table in dependency
+order, with plain batched DELETEs that skip the per-row signals and cascade
+collection of Model.delete(). Those signals only move balances and bump
+cache versions, so unseed() recalculates the balances of the users it keeps
+once, at the end. On SQLite it can instead empty whole tables and reset
+their autoincrement sequences, as a freshly migrated database would have them.
+"""
+import datetime as dt
+import random
+import time
+from collections import namedtuple
+from contextlib import nullcontext
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.color import no_style
+from django.db import connection, models, transaction
+from django.utils import timezone
+from faker import Faker
+
+from lessons import caching
+from lessons.invoicing import invoice_requests, BATCH_SIZE as INVOICE_BATCH_SIZE
+from lessons.ledger import recalculate_balances
+from lessons.models import User, Request, Child, Invoice, Transaction, Lesson
+from lessons.occurrences import lesson_times
+from lessons.timetable import HALF_DAYS
+
+# teachers includes the two seeded ones, Petra and David
+Profile = namedtuple('Profile', ['students', 'requests_per_student', 'teachers'])
+PROFILES = {
+    'small': Profile(100, 1, 3),
+    'medium': Profile(10_000, 1, 20),
+    'large': Profile(100_000, 1, 200),
+    # A term's worth of requests ten times over, for the timetable, calendar and statement pages
+    '10x-term': Profile(10_000, 10, 20),
+}
+PASSWORD = 'Password123'
+BATCH_SIZE = 1000
+NAME_POOL_SIZE = 500
+REQUESTLESS_USER_RATE = 8  # One student in this many has made no requests
+PENDING_REQUEST_RATE = 20  # One request in this many is still pending
+NO_CHILDREN_RATE = 20  # One student in this many has no child
+LESSON_CONTENTS = ["Basic Piano", "Basic Guitar", "Intermediate Trumpet", "Singing", "Advanced Violin"]
+DURATIONS = [30, 45, 60, 90]
+# How much of each invoice has been paid, and how often: in full, in part, overpaid and not at all
+PAYMENTS = [(1, 50), (Decimal('0.5'), 20), (Decimal('1.5'), 5), (0, 25)]
+TERM_START = dt.date(2022, 12, 12)
+SEEDED_DIRECTOR = 'marty.major@example.org'
+DELETE_BATCH_SIZE = 10000
+# The tables unseed() empties completely, in an order that deletes rows before the rows they refer to
+UNSEEDED_MODELS = [Lesson, Transaction, Invoice, Request, Child]
+# Invoice numbers (xxxx-xxx) only have room for four digits of user id, so later students' requests stay pending
+MAX_INVOICED_USER_ID = 9999
+
+
+class Seeder:
+    def __init__(self, seed=None, password=PASSWORD):
+        self.rng = random.Random(seed)
+        faker = Faker('en_GB')
+        faker.seed_instance(seed)
+        self.first_names = [faker.first_name() for _ in range(NAME_POOL_SIZE)]
+        self.last_names = [faker.last_name() for _ in range(NAME_POOL_SIZE)]
+        self.password = make_password(password)
+        self.teacher_ids = []
+
+    def user(self, email, first_name, last_name, **extra):
+        return User(email=email, first_name=first_name, last_name=last_name, password=self.password, **extra)
+
+    def random_name(self):
+        return self.rng.choice(self.first_names), self.rng.choice(self.last_names)
+
+    def student(self, number):
+        """A random student, whose email address is made unique by their number"""
+        first, last = self.random_name()
+        return self.user(f'{first}.{last}.{number}@example.org'.lower().replace(' ', ''), first, last)
+
+    def request(self, user_id, child_id, approved):
+        code, _ = self.rng.choice(Request.AVAILABILITY_CHOICES)
+        request = Request(user_id=user_id, child_id=child_id, availability=[code],
+                          availability_mask=Request.AVAILABILITY_BITS[code],
+                          number_of_lessons=self.rng.randint(1, 10), interval=self.rng.randint(1, 2),
+                          duration=self.rng.choice(DURATIONS), lesson_content=self.rng.choice(LESSON_CONTENTS),
+                          teacher_id=self.rng.choice(self.teacher_ids))
+        if approved:
+            request.isApproved = True
+            request.class_Day = code[:-2]
+            request.class_Time = dt.time(self.rng.randrange(*HALF_DAYS[code[-2:]]))
+            request.start_Date = timezone.make_aware(
+                dt.datetime.combine(TERM_START + dt.timedelta(days=self.rng.randrange(12)), dt.time.min))
+        return request
+
+    def payment_for(self, invoice, user_id, teacher_id):
+        """An unsaved Transaction paying some, all or more than all of an invoice, or None if it is unpaid"""
+        share = self.rng.choices([share for share, _ in PAYMENTS], [weight for _, weight in PAYMENTS])[0]
+        if not share:
+            return None
+        date_paid = timezone.make_aware(
+            dt.datetime.combine(TERM_START + dt.timedelta(days=self.rng.randrange(365)), dt.time(12)))
+        return Transaction(amount=invoice.amount_to_be_paid * share, invoice_id=invoice.pk, created_by_id=user_id,
+                           administrated_by_id=teacher_id, date_paid=date_paid)
+
+    def seed_accounts(self, teachers):
+        """The fixed accounts and John Doe's lessons, plus random teachers to make up the given number of teachers"""
+        john_doe, petra, david = User.objects.bulk_create([
+            self.user('john.doe@example.org', 'John', 'Doe'),
+            self.user('petra.pickles@example.org', 'Petra', 'Pickles', is_staff=True),
+            self.user('david.spinks@example.org', 'David', 'Spinks', is_staff=True),
+            self.user(SEEDED_DIRECTOR, 'Marty', 'Major', is_staff=True, is_superuser=True),
+        ])[:3]
+        extra = [self.user(f'{first}.{last}.teacher{n}@example.org'.lower(), first, last, is_staff=True)
+                 for n, (first, last) in enumerate(self.random_name() for _ in range(max(teachers - 2, 0)))]
+        self.teacher_ids = [petra.pk, david.pk] + [teacher.pk for teacher in User.objects.bulk_create(extra)]
+        alice, bob = Child.objects.bulk_create([Child(name='Alice Doe', parent=john_doe),
+                                                Child(name='Bob Doe', parent=john_doe)])
+        requests = []
+        for day, child in [('MONDAY', None), ('TUESDAY', alice), ('THURSDAY', bob)]:
+            request = Request(user=john_doe, child=child, availability=[day + 'PM'],
+                              availability_mask=Request.AVAILABILITY_BITS[day + 'PM'], number_of_lessons=12,
+                              interval=1, duration=60, lesson_content="Basic Piano", teacher=petra, class_Day=day,
+                              class_Time=dt.time(16), start_Date=timezone.make_aware(dt.datetime(2022, 12, 12)),
+                              isApproved=True)
+            requests.append(request)
+        self.save_requests(Request.objects.bulk_create(requests))
+
+    def save_requests(self, requests, payments=None):
+        """
+        Fill in the lessons and invoices of newly inserted requests, and the payments of the invoices
+        of the requests in payments, a dict of request id to (user id, teacher id). Returns the invoices.
+        """
+        approved = [request for request in requests if request.isApproved]
+        insert_lessons(approved)
+        invoices = []
+        for start in range(0, len(approved), INVOICE_BATCH_SIZE):
+            invoices.extend(invoice_requests(approved[start:start + INVOICE_BATCH_SIZE]))
+        if payments:
+            paid = [self.payment_for(invoice, *payments[invoice.request_id]) for invoice in invoices]
+            paid = [payment for payment in paid if payment is not None]
+            Transaction.objects.bulk_create(paid, batch_size=BATCH_SIZE)
+            # Invoices paid in full are closed, as a bank statement import would have closed them
+            owed = {invoice.pk: invoice.amount_to_be_paid for invoice in invoices}
+            Invoice.objects.filter(pk__in=[payment.invoice_id for payment in paid
+                                           if payment.amount >= owed[payment.invoice_id]]).update(status='CLOSED')
+            recalculate_balances({payment.created_by_id for payment in paid})
+        return invoices
+
+    def seed_students(self, count, requests_per_student=1, batch_size=BATCH_SIZE, progress=None):
+        """Seed count random students with their children, requests, invoices and payments. Returns the rows made."""
+        made = {'students': 0, 'children': 0, 'requests': 0, 'invoices': 0}
+        for offset in range(0, count, batch_size):
+            with transaction.atomic():
+                numbers = range(offset, min(offset + batch_size, count))
+                users = User.objects.bulk_create([self.student(n) for n in numbers])
+                children = {n: Child(name=' '.join(self.random_name()), parent=user)
+                            for n, user in zip(numbers, users) if n % NO_CHILDREN_RATE}
+                Child.objects.bulk_create(children.values())
+                requests = [self.request(user.pk, children[n].pk if n in children else None,
+                                         approved=user.pk <= MAX_INVOICED_USER_ID
+                                         and self.rng.randrange(PENDING_REQUEST_RATE) != 0)
+                            for n, user in zip(numbers, users) if n % REQUESTLESS_USER_RATE
+                            for k in range(requests_per_student)]
+                requests = Request.objects.bulk_create(requests, batch_size=batch_size)
+                invoices = self.save_requests(requests, {request.request_id: (request.user_id, request.teacher_id)
+                                                         for request in requests})
+            made['students'] += len(users)
+            made['children'] += len(children)
+            made['requests'] += len(requests)
+            made['invoices'] += len(invoices)
+            if progress is not None:
+                progress(made)
+        return made
+
+
+def insert_lessons(requests):
+    """
+    Insert the lessons of newly approved requests, as occurrences.build_lessons() would make them.
+    There are several per request, so they skip the Lesson instances and bulk_create's per-value preparation.
+    """
+    adapt = connection.ops.adapt_datetimefield_value
+    rows = [(request.request_id, request.teacher_id, request.user_id, number, adapt(start), adapt(end))
+            for request in requests
+            for number, (start, end) in enumerate(lesson_times(request), start=1)]
+    columns = ', '.join(connection.ops.quote_name(Lesson._meta.get_field(name).column)
+                        for name in ('request', 'teacher', 'student', 'number', 'start', 'end'))
+    with connection.cursor() as cursor:
+        cursor.executemany(f"INSERT INTO {connection.ops.quote_name(Lesson._meta.db_table)} ({columns}) "
+                           f"VALUES (%s, %s, %s, %s, %s, %s)", rows)
+
+
+def seed(profile='small', students=None, seed=None, batch_size=BATCH_SIZE, progress=None):
+    """
+    Seed the fixed accounts and a profile's worth of random students, or the given number of students instead.
+    Returns the number of students, children, requests and invoices made for the random students.
+    """
+    chosen = PROFILES[profile]
+    seeder = Seeder(seed)
+    with transaction.atomic():
+        seeder.seed_accounts(chosen.teachers)
+    made = seeder.seed_students(chosen.students if students is None else students,
+                                chosen.requests_per_student, batch_size, progress)
+    caching.bump_owners(teacher_ids=seeder.teacher_ids)
+    return made
+
+
+def delete_rows(queryset, batch_size=DELETE_BATCH_SIZE):
+    """
+    Delete the rows of a queryset with plain DELETEs of at most batch_size rows each, without
+    sending signals or following relations. Returns the number of rows deleted.
+    """
+    deleted = 0
+    while True:
+        pks = list(queryset.values_list('pk', flat=True)[:batch_size])
+        if not pks:
+            return deleted
+        deleted += queryset.model._base_manager.filter(pk__in=pks)._raw_delete(queryset.db)
+
+
+def user_dependents():
+    """
+    The foreign keys to User from outside UNSEEDED_MODELS, such as those of jobs, invoice sequences, admin log
+    entries and the many-to-many tables of groups and permissions
+    """
+    for relation in User._meta.related_objects:
+        if relation.related_model not in UNSEEDED_MODELS and not relation.many_to_many:
+            yield relation.field
+    for field in User._meta.many_to_many:
+        yield field.remote_field.through._meta.get_field(field.m2m_field_name())
+
+
+def _flush(model):
+    """Empty a table and reset its autoincrement sequence. Returns the number of rows it had."""
+    count = model._base_manager.count()
+    with connection.cursor() as cursor:
+        for sql in connection.ops.sql_flush(no_style(), [model._meta.db_table], reset_sequences=True):
+            cursor.execute(sql)
+    return count
+
+
+def unseed(truncate=False, batch_size=DELETE_BATCH_SIZE):
+    """
+    Delete every lesson, transaction, invoice, request and child, and every user except the real superusers.
+    With truncate, on SQLite only, empty those tables outright and reset their sequences instead.
+    Returns a list of (table, rows deleted, seconds taken).
+    """
+    if truncate and connection.vendor != 'sqlite':
+        raise ValueError("Truncating is only supported on SQLite")
+    users = User.objects.filter(models.Q(is_superuser=False) | models.Q(email=SEEDED_DIRECTOR))
+    timings = []
+
+    def timed(label, delete):
+        began = time.perf_counter()
+        count = delete()
+        timings.append((label, count, time.perf_counter() - began))
+
+    # Every row referring to a deleted one is deleted too, so the foreign key checks can be skipped, which lets
+    # SQLite empty a table without visiting each row
+    with connection.constraint_checks_disabled() if truncate else nullcontext(), transaction.atomic():
+        for model in UNSEEDED_MODELS:
+            timed(model._meta.db_table,
+                  lambda: _flush(model) if truncate else delete_rows(model._base_manager.all(), batch_size))
+        for field in user_dependents():
+            rows = field.model._base_manager.filter(**{field.name + '__in': users})
+            if field.remote_field.on_delete is models.SET_NULL:
+                timed(field.model._meta.db_table, lambda: rows.update(**{field.name: None}))
+            else:
+                timed(field.model._meta.db_table, lambda: delete_rows(rows, batch_size))
+        timed(User._meta.db_table, lambda: delete_rows(users, batch_size))
+        if truncate:
+            # Carry on numbering users after the ones that are left
+            with connection.cursor() as cursor:
+                cursor.execute("UPDATE sqlite_sequence SET seq = (SELECT COALESCE(MAX(%s), 0) FROM %s) "
+                               "WHERE name = %%s" % (connection.ops.quote_name(User._meta.pk.column),
+                                                     connection.ops.quote_name(User._meta.db_table)),
+                               [User._meta.db_table])
+        recalculate_balances(User.objects.values_list('pk', flat=True))
+        # The teachers who are left lose the deleted requests from their feeds
+        caching.bump_owners(teacher_ids=User.objects.filter(is_staff=True).values_list('pk', flat=True))
+    return timings
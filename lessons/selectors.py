@@ -0,0 +1,74 @@
+"""
+Querysets for the tables on the dashboards and student pages.
+
+Each builder declares its query plan: the related rows the table shows are
+joined in with select_related, and only() limits the columns to those the
+templates use. Rendering a table then costs one query however many rows it
+has, instead of a further query per row for each relation. Views take their
+querysets from here rather than building them inline, so a template change
+that needs another column is made in one place.
+"""
+from lessons.models import Request, User, Child, Invoice, Transaction
+
+REQUEST_COLUMNS = (
+    'request_id', 'availability', 'lesson_content', 'submission_date', 'isApproved',
+    'user', 'user__email', 'user__first_name', 'user__last_name',
+    'child', 'child__name',
+)
+INVOICE_COLUMNS = (
+    'invoice_number', 'amount_to_be_paid', 'created_date', 'status',
+    'request', 'request__isApproved', 'request__user', 'request__user__email',
+)
+TRANSACTION_COLUMNS = (
+    'amount', 'date_paid', 'invoice', 'invoice__invoice_number', 'created_by', 'created_by__email',
+)
+USER_COLUMNS = ('email', 'first_name', 'last_name', 'balance', 'is_active', 'is_staff', 'is_superuser')
+
+
+def requests_table(approved, user=None):
+    """Pending or approved requests, optionally only those of one user, with the student or child they are for"""
+    requests = Request.objects.filter(isApproved=approved)
+    if user is not None:
+        requests = requests.filter(user=user)
+    return requests.select_related('user', 'child').only(*REQUEST_COLUMNS)
+
+
+def pending_requests(user=None):
+    return requests_table(False, user)
+
+
+def approved_requests(user=None):
+    return requests_table(True, user)
+
+
+def invoices_table(user=None, status=None):
+    """
+    Invoices with their request and student.
+    A user's own invoices are only those of their approved requests, as on their home page.
+    """
+    invoices = Invoice.objects.all()
+    if user is not None:
+        invoices = invoices.filter(request__isApproved=True, request__user=user)
+    if status is not None:
+        invoices = invoices.filter(status=status)
+    return invoices.select_related('request__user').only(*INVOICE_COLUMNS)
+
+
+def transactions_table(user=None):
+    """Payments with the invoice they pay and the student who made them"""
+    transactions = Transaction.objects.all()
+    if user is not None:
+        transactions = transactions.filter(created_by=user)
+    return transactions.select_related('invoice', 'created_by').only(*TRANSACTION_COLUMNS)
+
+
+def users_table(students_only=False):
+    """Active users, or only active students"""
+    users = User.objects.filter(is_active=True)
+    if students_only:
+        users = users.filter(is_staff=False)
+    return users.only(*USER_COLUMNS)
+
+
+def children_table(parent):
+    return Child.objects.filter(parent=parent).only('name', 'parent')
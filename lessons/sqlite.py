@@ -0,0 +1,48 @@
+"""
+Connection tuning for the SQLite database.
+
+Every new SQLite connection runs the PRAGMAs in settings.SQLITE_PRAGMAS
+when Django opens it (the connection_created signal). The defaults in
+msms/settings.py are chosen for a web server with many readers and a few
+writers:
+
+- journal_mode=WAL lets readers carry on while a write is in progress,
+  instead of every reader waiting for the writer's exclusive lock
+- synchronous=NORMAL only syncs at checkpoints, which is still safe
+  against corruption under WAL
+- cache_size (negative numbers are KiB), mmap_size and temp_store=MEMORY
+  keep hot pages and sort space in memory
+- busy_timeout makes a writer that finds the database locked wait for it,
+  rather than fail with "database is locked"
+
+journal_mode is a property of the database file and persists, so the
+other settings are the ones that must be repeated on every connection.
+With CONN_MAX_AGE at 0 that is once per request, so the PRAGMAs run on the
+DB-API connection, beneath the execute wrappers that count a request's
+queries.
+The benchmark_sqlite command compares throughput with and without them.
+"""
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+
+def pragma_statements(pragmas):
+    """The PRAGMA statements for a dict of pragma name to value, busy_timeout first so the rest can wait for locks"""
+    ordered = sorted(pragmas.items(), key=lambda item: item[0] != 'busy_timeout')
+    for name, value in ordered:
+        if not name.isidentifier() or not str(value).lstrip('-').isalnum():
+            raise ValueError(f"Invalid SQLite pragma {name}={value!r}")
+        yield f'PRAGMA {name} = {value}'
+
+
+def apply_pragmas(cursor, pragmas):
+    for statement in pragma_statements(pragmas):
+        cursor.execute(statement)
+
+
+@receiver(connection_created)
+def tune_connection(sender, connection, **kwargs):
+    if connection.vendor == 'sqlite':
+        # On the DB-API connection, so the query recorders' execute wrappers do not count them against the request
+        apply_pragmas(connection.connection, getattr(settings, 'SQLITE_PRAGMAS', {}))
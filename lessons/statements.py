@@ -0,0 +1,150 @@
+"""
+Bulk import of bank statements.
+
+A statement, in CSV or OFX form, is parsed one line at a time. Each payment is
+matched to an invoice by the invoice number in its reference, using an index of
+every invoice built from a single query. Matched payments are inserted as
+Transactions in bulk_create batches. The invoices they pay off in full are then
+closed with one bulk_update. Lines that cannot be matched are saved as
+UnmatchedPayments for staff to review.
+"""
+import csv
+import datetime as dt
+import re
+from decimal import Decimal, InvalidOperation
+
+from django.db import transaction
+from django.db.models import Sum
+from django.utils import timezone
+
+from lessons import metrics
+from lessons.ledger import recalculate_balances
+from lessons.models import Invoice, Transaction, UnmatchedPayment
+from lessons.money import Money
+
+BATCH_SIZE = 1000
+INVOICE_NUMBER = re.compile(r'\b(\d{4}-\d{3})\b')
+OFX_TAG = re.compile(r'<(/?)(\w+)>([^<\r\n]*)')
+DATE_FORMATS = ['%Y-%m-%d', '%d/%m/%Y', '%Y%m%d']
+
+
+def parse_csv(stream):
+    """
+    Yield (line number, date, amount, reference) for each row of a CSV statement.
+    The statement needs date and amount columns, and the invoice number is looked for in any
+    reference, description or memo column.
+    """
+    reader = csv.DictReader(stream)
+    for line_number, row in enumerate(reader, start=2):
+        row = {(key or '').strip().lower(): (value or '').strip() for key, value in row.items()}
+        reference = ' '.join(row.get(key, '') for key in ('reference', 'description', 'memo')).strip()
+        yield line_number, row.get('date', ''), row.get('amount', ''), reference
+
+
+def parse_ofx(stream):
+    """Yield (line number, date, amount, reference) for each <STMTTRN> transaction of an OFX statement."""
+    fields = None
+    for line_number, line in enumerate(stream, start=1):
+        for closing, tag, value in OFX_TAG.findall(line):
+            tag = tag.upper()
+            if tag == 'STMTTRN':
+                if closing and fields is not None:
+                    reference = ' '.join(fields.get(key, '') for key in ('REFNUM', 'NAME', 'MEMO')).strip()
+                    yield fields['line_number'], fields.get('DTPOSTED', '')[:8], fields.get('TRNAMT', ''), reference
+                    fields = None
+                elif not closing:
+                    fields = {'line_number': line_number}
+            elif fields is not None and not closing:
+                fields[tag] = value.strip()
+
+
+PARSERS = {
+    'csv': parse_csv,
+    'ofx': parse_ofx,
+}
+
+
+def _parse_date(value):
+    for date_format in DATE_FORMATS:
+        try:
+            return timezone.make_aware(dt.datetime.strptime(value, date_format))
+        except ValueError:
+            pass
+    return None
+
+
+def _parse_amount(value):
+    try:
+        amount = Decimal(value.replace(',', '').replace('£', ''))
+    except InvalidOperation:
+        return None
+    return Money.of(amount) if amount.is_finite() else None
+
+
+def invoice_index():
+    """Every invoice number mapped to its invoice id, owner, amount and status, from one query"""
+    return {number: (invoice_id, user_id, amount, status) for number, invoice_id, user_id, amount, status in
+            Invoice.objects.values_list('invoice_number', 'pk', 'request__user_id', 'amount_to_be_paid', 'status')}
+
+
+def import_statement(stream, statement_format='csv', administrated_by=None, batch_size=BATCH_SIZE):
+    """
+    Import the payments on a bank statement read from a text stream.
+    Returns the number of matched payments, closed invoices and unmatched lines.
+    """
+    index = invoice_index()
+    matched, unmatched = [], []
+    paid_invoices, users = set(), set()
+    counts = {'matched': 0, 'closed': 0, 'unmatched': 0}
+
+    def flush():
+        Transaction.objects.bulk_create(matched)
+        UnmatchedPayment.objects.bulk_create(unmatched)
+        metrics.transactions_recorded.inc_on_commit(len(matched))
+        counts['matched'] += len(matched)
+        counts['unmatched'] += len(unmatched)
+        matched.clear()
+        unmatched.clear()
+
+    with transaction.atomic():
+        for line_number, date, amount, reference in PARSERS[statement_format](stream):
+            date_paid = _parse_date(date)
+            amount_paid = _parse_amount(amount)
+            found = INVOICE_NUMBER.search(reference)
+            invoice = index.get(found.group(1)) if found else None
+            if date_paid is None:
+                reason = "Invalid date"
+            elif amount_paid is None:
+                reason = "Invalid amount"
+            elif amount_paid <= 0:
+                reason = "Not a payment"
+            elif found is None:
+                reason = "No invoice number"
+            elif invoice is None:
+                reason = "Unknown invoice"
+            else:
+                invoice_id, user_id, _, _ = invoice
+                matched.append(Transaction(amount=amount_paid, invoice_id=invoice_id, date_paid=date_paid,
+                                           created_by_id=user_id, administrated_by=administrated_by))
+                paid_invoices.add(invoice_id)
+                users.add(user_id)
+                reason = None
+            if reason is not None:
+                unmatched.append(UnmatchedPayment(line_number=line_number, date_paid=date_paid,
+                                                  amount=amount_paid, reference=reference[:255], reason=reason))
+            if len(matched) + len(unmatched) >= batch_size:
+                flush()
+        flush()
+
+        if paid_invoices:
+            # An invoice with no amount set yet cannot be paid off, so it is left active
+            active = {invoice_id: amount for invoice_id, _, amount, status in index.values()
+                      if status == 'ACTIVE' and amount is not None}
+            totals = Transaction.objects.filter(invoice__in=paid_invoices).values('invoice') \
+                .annotate(total=Sum('amount')).values_list('invoice', 'total')
+            closed = [Invoice(pk=invoice_id, status='CLOSED') for invoice_id, total in totals
+                      if invoice_id in active and total >= active[invoice_id]]
+            Invoice.objects.bulk_update(closed, ['status'])
+            counts['closed'] = len(closed)
+            recalculate_balances(users)
+    return counts
@@ -159,7 +159,8 @@ class ApproveRequestViewTestCase(TestCase):
         self.client.login(email="admin@bcmail.com", password="Password123")
         beforeInvoiceValue = Request.objects.get(request_id=self.requestId2).invoice
         self.assertIsNone(beforeInvoiceValue)
-        response = self.client.post(self.url2, self.form_input1, follow=True)
+        # Each approval gets its own slot, as request1 already has the teacher on Mondays at 8
+        response = self.client.post(self.url2, dict(self.form_input1, class_Time=dt.time(10)), follow=True)
         afterInvoiceValue = response.context['invoices'].last()
 
         self.assertIsNotNone(afterInvoiceValue)
@@ -169,7 +170,7 @@ class ApproveRequestViewTestCase(TestCase):
         self.assertRedirects(response, response_url, status_code=302, target_status_code=200)
         self.assertTemplateUsed(response, 'admin_home.html')
 
-        response = self.client.post(self.url3, self.form_input1, follow=True)
+        response = self.client.post(self.url3, dict(self.form_input1, class_Time=dt.time(12)), follow=True)
         afterInvoiceValue = response.context['invoices'].last()
 
         self.assertIsNotNone(afterInvoiceValue)
@@ -180,3 +181,12 @@ class ApproveRequestViewTestCase(TestCase):
         self.assertTemplateUsed(response, 'admin_home.html')
         self.client.logout()
 
+    def test_post_rejects_double_booked_teacher(self):
+        self.client.login(email="admin@bcmail.com", password="Password123")
+        form_input = dict(self.form_input1, teacher=self.teacher.id)
+        response = self.client.post(self.url2, form_input)
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(response, 'approve_request.html')
+        self.assertIn(f"already booked at that time for request {self.requestId1}",
+                      str(response.context['form'].errors['class_Time']))
+        self.assertFalse(Request.objects.get(pk=self.requestId2).isApproved)
@@ -0,0 +1,79 @@
+import datetime as dt
+import importlib
+
+from django.apps import apps
+from django.test import TestCase
+
+from lessons.models import Request, User, availability_codes, availability_mask
+
+backfill = importlib.import_module('lessons.migrations.0009_backfill_availability_mask')
+
+
+class AvailabilityMaskTestCase(TestCase):
+    """Tests of the availability bitmask and the slot queries on it"""
+
+    def setUp(self):
+        self.student = User.objects.create_user(email='student@example.com', password='Password123')
+        self.teacher = User.objects.create_user(email='teacher@example.com', password='Password123', is_staff=True)
+        self.monday = self._request("MONDAYAM, TUESDAYPM")
+        self.wednesday = self._request("WEDNESDAYPM")
+        self.both = self._request(['MONDAYAM', 'WEDNESDAYPM'])
+
+    def _request(self, availability, **kwargs):
+        return Request.objects.create(user=self.student, availability=availability, number_of_lessons=10,
+                                      interval=1, duration=45, lesson_content="Singing", **kwargs)
+
+    def _ids(self, queryset):
+        return sorted(queryset.values_list('request_id', flat=True))
+
+    def test_mask_is_set_on_save(self):
+        self.assertEqual(self.monday.availability_mask, 0b1001)
+        self.assertEqual(Request.objects.get(pk=self.wednesday.pk).availability_mask, 1 << 5)
+        self.assertEqual(availability_codes(self.both.availability_mask), ['MONDAYAM', 'WEDNESDAYPM'])
+
+    def test_mask_follows_changes(self):
+        request = Request.objects.get(pk=self.monday.pk)
+        request.availability = ['SUNDAYPM']
+        request.save(update_fields=['availability'])
+        self.assertEqual(Request.objects.get(pk=request.pk).availability_mask, 1 << 13)
+
+    def test_unknown_codes_are_skipped(self):
+        # Left over in old rows, which the backfill migration skipped too
+        Request.objects.filter(pk=self.monday.pk).update(availability="MONDAYAM,HOLIDAYAM")
+        request = Request.objects.get(pk=self.monday.pk)
+        request.save()
+        self.assertEqual(Request.objects.get(pk=request.pk).availability_mask, 1)
+        self.assertEqual(availability_mask("MONDAYAM,HOLIDAYAM"), backfill.mask_of(["MONDAYAM", "HOLIDAYAM"]))
+
+    def test_saving_without_availability_loaded_keeps_mask(self):
+        request = Request.objects.only('request_id', 'isApproved').get(pk=self.monday.pk)
+        request.isApproved = True
+        request.save()
+        self.assertEqual(Request.objects.get(pk=request.pk).availability_mask, 0b1001)
+
+    def test_available_any(self):
+        self.assertEqual(self._ids(Request.objects.available_any('WEDNESDAYPM')),
+                         [self.wednesday.pk, self.both.pk])
+        self.assertEqual(self._ids(Request.objects.available_any('TUESDAYPM', 'WEDNESDAYPM')),
+                         [self.monday.pk, self.wednesday.pk, self.both.pk])
+
+    def test_available_all(self):
+        self.assertEqual(self._ids(Request.objects.available_all('MONDAYAM', 'WEDNESDAYPM')), [self.both.pk])
+        self.assertEqual(self._ids(Request.objects.available_all(availability_mask(['MONDAYAM']))),
+                         [self.monday.pk, self.both.pk])
+
+    def test_free_with_teacher(self):
+        self._request("WEDNESDAYPM", isApproved=True, teacher=self.teacher, class_Day='WEDNESDAY',
+                      class_Time=dt.time(14))
+        pending = Request.objects.filter(isApproved=False)
+        self.assertEqual(self._ids(pending.free_with_teacher(self.teacher)), [self.monday.pk, self.both.pk])
+
+    def test_slot_filters_compose(self):
+        queryset = Request.objects.available_any('MONDAYAM').available_any('WEDNESDAYPM')
+        self.assertEqual(self._ids(queryset), [self.both.pk])
+
+    def test_migration_backfills_masks(self):
+        Request.objects.update(availability_mask=0)
+        backfill.backfill_availability_mask(apps, None)
+        self.assertEqual(dict(Request.objects.values_list('request_id', 'availability_mask')),
+                         {self.monday.pk: 0b1001, self.wednesday.pk: 1 << 5, self.both.pk: 0b100001})
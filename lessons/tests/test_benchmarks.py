@@ -0,0 +1,98 @@
+import json
+import os
+import tempfile
+from contextlib import nullcontext
+from io import StringIO
+from unittest.mock import patch
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase
+from django.urls import URLPattern
+
+from lessons import benchmarks, metrics
+from msms import urls
+
+
+def result(p95_ms, queries):
+    return {'results': {'100': {'home': {'status': 200, 'p50_ms': p95_ms, 'p95_ms': p95_ms, 'p99_ms': p95_ms,
+                                         'queries': queries, 'peak_kb': 10.0}}}}
+
+
+class BenchmarksTestCase(TestCase):
+    """Tests of the URL latency benchmarks"""
+
+    def test_every_named_url_is_benchmarked_or_skipped(self):
+        names = {pattern.name for pattern in urls.urlpatterns if isinstance(pattern, URLPattern) and pattern.name}
+        benchmarked = {target.name for target in benchmarks.TARGETS}
+        self.assertEqual(benchmarked & set(benchmarks.SKIPPED), set())
+        self.assertEqual(names, benchmarked | set(benchmarks.SKIPPED))
+
+    def test_percentile_is_nearest_rank(self):
+        values = list(range(100, 0, -1))
+        self.assertEqual(benchmarks.percentile(values, 0.50), 50)
+        self.assertEqual(benchmarks.percentile(values, 0.95), 95)
+        self.assertEqual(benchmarks.percentile(values, 0.99), 99)
+        self.assertEqual(benchmarks.percentile([7], 0.99), 7)
+
+    def test_compare_reports_slower_p95(self):
+        self.assertEqual(benchmarks.compare(result(12.0, 2), result(10.0, 2), threshold=0.25), [])
+        self.assertEqual(benchmarks.compare(result(13.0, 2), result(10.0, 2), threshold=0.25),
+                         ["home at 100 students: p95 10.0 ms -> 13.0 ms"])
+
+    def test_compare_ignores_sub_millisecond_changes(self):
+        self.assertEqual(benchmarks.compare(result(0.9, 2), result(0.2, 2)), [])
+
+    def test_compare_reports_any_extra_query(self):
+        self.assertEqual(benchmarks.compare(result(10.0, 3), result(10.0, 2)),
+                         ["home at 100 students: 2 -> 3 queries"])
+
+    def test_compare_skips_what_the_baseline_lacks(self):
+        self.assertEqual(benchmarks.compare(result(50.0, 9), {'results': {'1000': {}}}), [])
+
+    def test_run_measures_each_target(self):
+        with self.settings(REPLICA_ENABLED=False):
+            run = benchmarks.run(sizes=[100], names=['user_home', 'approve'], iterations=2, warmup=1)
+        self.assertEqual(set(run['results']['100']), {'user_home', 'approve'})
+        for row in run['results']['100'].values():
+            self.assertEqual(row['status'], 200)
+            self.assertLessEqual(row['p50_ms'], row['p95_ms'])
+            self.assertLessEqual(row['p95_ms'], row['p99_ms'])
+            self.assertGreater(row['queries'], 0)
+            self.assertGreater(row['peak_kb'], 0)
+        json.dumps(run)
+
+
+@patch.object(benchmarks, 'scratch_database', nullcontext)
+class BenchmarkUrlsCommandTestCase(TestCase):
+    """Tests of the benchmark_urls management command"""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.output = os.path.join(self.directory.name, 'results.json')
+
+    def test_writes_the_results(self):
+        out = StringIO()
+        call_command('benchmark_urls', sizes='100', urls='home', iterations=1, warmup=0, output=self.output,
+                     stdout=out)
+        self.assertIn(' home ', out.getvalue())
+        with open(self.output) as file:
+            self.assertEqual(json.load(file)['results']['100']['home']['status'], 200)
+
+    def test_leaves_the_metrics_alone(self):
+        with tempfile.TemporaryDirectory() as directory, self.settings(METRICS_ENABLED=True, METRICS_DIR=directory):
+            call_command('benchmark_urls', sizes='100', urls='home', iterations=1, warmup=0, stdout=StringIO())
+            self.assertEqual(metrics.collect(), {})
+
+    def test_fails_on_a_regression(self):
+        baseline = os.path.join(self.directory.name, 'baseline.json')
+        with open(baseline, 'w') as file:
+            json.dump({'results': {'100': {'home': {'p95_ms': 1000.0, 'queries': -1}}}}, file)
+        with self.assertRaisesMessage(CommandError, "home at 100 students: -1 -> 0 queries"):
+            call_command('benchmark_urls', sizes='100', urls='home', iterations=1, warmup=0, baseline=baseline,
+                         stdout=StringIO())
+
+    def test_rejects_unknown_urls(self):
+        with self.assertRaisesMessage(CommandError, "Unknown URL name(s): delete_user, nowhere"):
+            call_command('benchmark_urls', urls='home,nowhere,delete_user', stdout=StringIO())
@@ -0,0 +1,140 @@
+import datetime as dt
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from lessons.approvals import bulk_approve
+from lessons.models import Request, User, Invoice
+from lessons.views import BULK_APPROVE_PER_PAGE
+
+
+class BulkApproveTestCase(TestCase):
+    """Tests of approving many requests at once"""
+
+    def setUp(self):
+        self.student = User.objects.create_user(email='student@example.com', password='Password123')
+        self.admin = User.objects.create_user(first_name='Petra', last_name='Pickles', email='admin@example.com',
+                                              password='Password123', is_staff=True)
+        self.requests = [
+            Request.objects.create(user=self.student, availability="MONDAYAM", number_of_lessons=10, interval=1,
+                                   duration=45, lesson_content="Singing")
+            for _ in range(3)
+        ]
+        self.start = timezone.make_aware(dt.datetime(2023, 1, 9))
+
+    def _row(self, request, **kwargs):
+        row = {'request_id': request.request_id, 'teacher': self.admin.id, 'class_Day': 'MONDAY',
+               'class_Time': dt.time(8 + request.request_id % 10), 'start_Date': self.start}
+        row.update(kwargs)
+        return row
+
+    def test_approves_and_invoices_every_row(self):
+        approved, errors = bulk_approve([self._row(request) for request in self.requests])
+        self.assertEqual(errors, {})
+        self.assertEqual(len(approved), 3)
+        self.assertEqual(Request.objects.filter(isApproved=True, teacher=self.admin).count(), 3)
+        self.assertEqual(Invoice.objects.filter(request__user=self.student).count(), 3)
+        self.assertEqual(User.objects.get(pk=self.student.pk).balance, Decimal('13500.00'))
+
+    def test_invalid_rows_do_not_stop_valid_ones(self):
+        first, second, third = self.requests
+        approved, errors = bulk_approve([
+            self._row(first),
+            self._row(second, teacher=self.student.id),
+            self._row(third, class_Day=''),
+        ])
+        self.assertEqual([request.request_id for request in approved], [first.request_id])
+        self.assertEqual(set(errors), {second.request_id, third.request_id})
+        self.assertFalse(Request.objects.get(pk=second.pk).isApproved)
+        self.assertTrue(Request.objects.get(pk=first.pk).isApproved)
+
+    def test_rejects_teacher_booked_twice_in_batch(self):
+        first, second, _ = self.requests
+        approved, errors = bulk_approve([self._row(first, class_Time=dt.time(9)),
+                                         self._row(second, class_Time=dt.time(9))])
+        self.assertEqual(len(approved), 1)
+        self.assertIn(second.request_id, errors)
+
+    def test_locks_the_teachers_before_checking_the_rows(self):
+        # Otherwise another approval could book the teacher between the check and the write
+        with CaptureQueriesContext(connection) as queries:
+            bulk_approve([self._row(request) for request in self.requests])
+        statements = [query['sql'] for query in queries if not query['sql'].startswith(('SAVEPOINT', 'RELEASE'))]
+        self.assertTrue(statements[0].startswith('UPDATE "lessons_user"'), statements[0])
+
+    def test_rejects_already_approved_and_missing_requests(self):
+        self.requests[0].isApproved = True
+        self.requests[0].save()
+        approved, errors = bulk_approve([self._row(self.requests[0]), {'request_id': 9999}])
+        self.assertEqual(approved, [])
+        self.assertEqual(set(errors), {self.requests[0].request_id, 9999})
+
+    def test_view_uses_shared_defaults(self):
+        self.client.login(email='admin@example.com', password='Password123')
+        data = {
+            'form-TOTAL_FORMS': 3, 'form-INITIAL_FORMS': 3,
+            'defaults-teacher': self.admin.id, 'defaults-class_Day': 'TUESDAY',
+            'defaults-class_Time': '16:00:00', 'defaults-start_Date': '2023-01-10 00:00',
+        }
+        for i, request in enumerate(self.requests):
+            data[f'form-{i}-request_id'] = request.request_id
+            data[f'form-{i}-selected'] = 'on' if i < 2 else ''
+        # The second row overrides the shared time so the teacher is not booked twice
+        data['form-1-class_Time'] = '17:00:00'
+        response = self.client.post(reverse('bulk_approve'), data)
+        self.assertRedirects(response, reverse('admin_home'), status_code=302, target_status_code=200)
+        approved = Request.objects.filter(isApproved=True).order_by('request_id')
+        self.assertEqual(len(approved), 2)
+        self.assertEqual(approved[0].class_Day, 'TUESDAY')
+        self.assertEqual([request.class_Time for request in approved], [dt.time(16), dt.time(17)])
+
+    def test_view_reports_row_errors(self):
+        self.client.login(email='admin@example.com', password='Password123')
+        data = {'form-TOTAL_FORMS': 1, 'form-INITIAL_FORMS': 1,
+                'form-0-request_id': self.requests[0].request_id, 'form-0-selected': 'on'}
+        response = self.client.post(reverse('bulk_approve'), data)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "Please choose a day and time and start date.")
+
+    def test_get_lists_pending_requests(self):
+        self.client.login(email='admin@example.com', password='Password123')
+        response = self.client.get(reverse('bulk_approve'))
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(response, 'bulk_approve.html')
+        self.assertEqual(len(response.context['rows']), 3)
+
+    def test_pages_hundreds_of_pending_requests(self):
+        Request.objects.bulk_create([
+            Request(user=self.student, availability="MONDAYAM", number_of_lessons=10, interval=1, duration=45,
+                    lesson_content="Singing") for _ in range(250)])
+        self.client.login(email='admin@example.com', password='Password123')
+        response = self.client.get(reverse('bulk_approve'))
+        rows = response.context['rows']
+        self.assertEqual(len(rows), BULK_APPROVE_PER_PAGE)
+        self.assertTrue(response.context['page'].has_next)
+
+        # Posting a whole page, every row selected, stays under DATA_UPLOAD_MAX_NUMBER_FIELDS
+        data = {'form-TOTAL_FORMS': len(rows), 'form-INITIAL_FORMS': len(rows),
+                'defaults-class_Day': 'TUESDAY', 'defaults-class_Time': '16:00:00',
+                'defaults-start_Date': '2023-01-10 00:00'}
+        for i, (form, request) in enumerate(rows):
+            data[f'form-{i}-request_id'] = request.request_id
+            data[f'form-{i}-selected'] = 'on'
+        self.assertLess(len(data) + 1, settings.DATA_UPLOAD_MAX_NUMBER_FIELDS)
+        response = self.client.post(reverse('bulk_approve'), data)
+        self.assertRedirects(response, reverse('admin_home'), status_code=302, target_status_code=200)
+        self.assertEqual(Request.objects.filter(isApproved=True).count(), BULK_APPROVE_PER_PAGE)
+
+        response = self.client.get(reverse('bulk_approve'))
+        self.assertEqual(len(response.context['rows']), BULK_APPROVE_PER_PAGE)
+        self.assertNotIn(rows[0][1].request_id, [request.request_id for _, request in response.context['rows']])
+
+    def test_cannot_be_accessed_by_student(self):
+        self.client.login(email='student@example.com', password='Password123')
+        response = self.client.get(reverse('bulk_approve'))
+        self.assertEqual(response.status_code, 302)
@@ -0,0 +1,102 @@
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from lessons import caching
+from lessons.invoicing import invoice_requests
+from lessons.models import Request, User, Child, Invoice, Transaction
+
+TABLES = ('lessons_request', 'lessons_invoice', 'lessons_transaction', 'lessons_child')
+
+
+class FragmentCacheTestCase(TestCase):
+    """Tests of caching the dashboard tables and invalidating them when their data changes"""
+
+    def setUp(self):
+        cache.clear()
+        self.student = User.objects.create_user(email='student@example.com', password='Password123')
+        self.other = User.objects.create_user(email='other@example.com', password='Password123')
+        self.admin = User.objects.create_user(email='admin@example.com', password='Password123', is_staff=True)
+        self.request = Request.objects.create(user=self.student, availability="MONDAYAM", number_of_lessons=10,
+                                              interval=1, duration=45, lesson_content="Singing", isApproved=True)
+        self.invoice = Invoice.objects.create(request=self.request, amount_to_be_paid=Decimal('100.00'),
+                                              invoice_number='0001-001')
+
+    def _get(self, email, url):
+        self.client.login(email=email, password='Password123')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        table_queries = [query['sql'] for query in queries if any(table in query['sql'] for table in TABLES)]
+        return response, table_queries
+
+    def test_unchanged_user_home_is_served_from_cache(self):
+        _, first = self._get('student@example.com', reverse('user_home'))
+        response, second = self._get('student@example.com', reverse('user_home'))
+        self.assertTrue(first)
+        self.assertEqual(second, [])
+        self.assertContains(response, '0001-001')
+
+    def test_unchanged_admin_home_is_served_from_cache(self):
+        self._get('admin@example.com', reverse('admin_home'))
+        response, queries = self._get('admin@example.com', reverse('admin_home'))
+        self.assertEqual(queries, [])
+        self.assertContains(response, 'Singing')
+
+    def test_pages_of_a_table_are_cached_separately(self):
+        self._get('admin@example.com', reverse('admin_home'))
+        _, queries = self._get('admin@example.com', reverse('admin_home') + '?invoices_status=CLOSED')
+        self.assertTrue(queries)
+
+    def test_users_do_not_share_fragments(self):
+        self._get('student@example.com', reverse('user_home'))
+        response, _ = self._get('other@example.com', reverse('user_home'))
+        self.assertNotContains(response, '0001-001')
+
+    def test_payment_invalidates_student_and_staff_tables(self):
+        self._get('student@example.com', reverse('user_home'))
+        self._get('admin@example.com', reverse('admin_home'))
+        Transaction.objects.create(amount=Decimal('12.34'), invoice=self.invoice, created_by=self.student)
+        response, _ = self._get('student@example.com', reverse('user_home'))
+        self.assertContains(response, '12.34')
+        response, _ = self._get('admin@example.com', reverse('admin_home'))
+        self.assertContains(response, '12.34')
+
+    def test_change_for_one_user_keeps_other_users_cached(self):
+        self._get('other@example.com', reverse('user_home'))
+        Child.objects.create(name='Alice', parent=self.student)
+        _, queries = self._get('other@example.com', reverse('user_home'))
+        self.assertEqual(queries, [])
+
+    def test_deleting_invalidates(self):
+        self._get('student@example.com', reverse('user_home'))
+        self.invoice.delete()
+        response, _ = self._get('student@example.com', reverse('user_home'))
+        self.assertNotContains(response, '0001-001')
+
+    def test_bulk_invoicing_invalidates(self):
+        pending = Request.objects.create(user=self.student, availability="MONDAYAM", number_of_lessons=10,
+                                         interval=1, duration=45, lesson_content="Piano", isApproved=True)
+        self._get('student@example.com', reverse('user_home'))
+        invoice_requests([pending])
+        response, _ = self._get('student@example.com', reverse('user_home'))
+        self.assertContains(response, Invoice.objects.get(request=pending).invoice_number)
+
+    def test_reassigning_a_request_bumps_both_teachers(self):
+        teachers = [User.objects.create_user(email=f'teacher{i}@example.com', password='Password123', is_staff=True)
+                    for i in range(2)]
+        self.request.teacher = teachers[0]
+        self.request.save()
+        before = [caching.version(caching.teacher_scope(teacher.id)) for teacher in teachers]
+        self.request.teacher = teachers[1]
+        self.request.save()
+        after = [caching.version(caching.teacher_scope(teacher.id)) for teacher in teachers]
+        self.assertTrue(all(new > old for old, new in zip(before, after)))
+
+    def test_logging_in_does_not_invalidate(self):
+        version = caching.version(caching.STAFF)
+        self.client.login(email='student@example.com', password='Password123')
+        self.assertEqual(caching.version(caching.STAFF), version)
@@ -0,0 +1,99 @@
+import datetime as dt
+
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from lessons import calendars
+from lessons.approvals import bulk_approve
+from lessons.models import Child, Request, User
+
+
+class CalendarFeedTestCase(TestCase):
+    """Tests of the iCalendar feeds of students, children and teachers"""
+
+    def setUp(self):
+        cache.clear()
+        self.student = User.objects.create_user(email='student@example.com', password='Password123')
+        self.teacher = User.objects.create_user(email='teacher@example.com', password='Password123', is_staff=True)
+        self.child = Child.objects.create(name='Alice', parent=self.student)
+        self.request = Request.objects.create(
+            user=self.student, child=self.child, availability="MONDAYAM", number_of_lessons=10, interval=2,
+            duration=45, lesson_content="Piano, grade 3", isApproved=True, teacher=self.teacher,
+            class_Day='WEDNESDAY', class_Time=dt.time(9), start_Date=timezone.make_aware(dt.datetime(2023, 1, 9)))
+        self.pending = Request.objects.create(user=self.student, availability="MONDAYAM", number_of_lessons=5,
+                                              interval=1, duration=60, lesson_content="Drums")
+
+    def _url(self, kind, owner_id):
+        return reverse('calendar_feed', args=[calendars.feed_token(kind, owner_id)])
+
+    def test_feed_has_one_recurring_event_per_approved_request(self):
+        response = self.client.get(self._url('student', self.student.id))
+        self.assertEqual(response['Content-Type'], 'text/calendar; charset=utf-8')
+        body = response.content.decode()
+        self.assertEqual(body.count('BEGIN:VEVENT'), 1)
+        self.assertIn('DTSTART:20230111T090000Z\r\n', body)
+        self.assertIn('DTEND:20230111T094500Z\r\n', body)
+        self.assertIn('RRULE:FREQ=WEEKLY;INTERVAL=2;COUNT=10\r\n', body)
+        self.assertIn('SUMMARY:Piano\\, grade 3 (Alice)\r\n', body)
+        self.assertNotIn('Drums', body)
+
+    def test_child_and_teacher_feeds(self):
+        other = Child.objects.create(name='Bob', parent=self.student)
+        self.assertContains(self.client.get(self._url('child', self.child.id)), 'BEGIN:VEVENT')
+        self.assertNotContains(self.client.get(self._url('child', other.id)), 'BEGIN:VEVENT')
+        response = self.client.get(self._url('teacher', self.teacher.id))
+        self.assertContains(response, 'SUMMARY:Piano\\, grade 3\r\n')
+
+    def test_tampered_tokens_are_rejected(self):
+        token = calendars.feed_token('student', self.student.id)
+        forged = token.replace(f'student.{self.student.id}', f'student.{self.teacher.id}')
+        self.assertEqual(self.client.get(reverse('calendar_feed', args=[forged])).status_code, 404)
+        self.assertEqual(self.client.get(self._url('teacher', self.student.id)).status_code, 404)
+
+    def test_unchanged_feed_is_not_modified(self):
+        response = self.client.get(self._url('student', self.student.id))
+        with CaptureQueriesContext(connection) as queries:
+            again = self.client.get(self._url('student', self.student.id), HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(again.status_code, 304)
+        self.assertEqual(len(queries), 1)
+        since = self.client.get(self._url('student', self.student.id),
+                                HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(since.status_code, 304)
+
+    def test_changing_a_request_changes_the_feed(self):
+        etag = self.client.get(self._url('teacher', self.teacher.id))['ETag']
+        self.request.class_Time = dt.time(10)
+        self.request.save()
+        response = self.client.get(self._url('teacher', self.teacher.id), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'DTSTART:20230111T100000Z')
+
+    def test_bulk_approval_changes_the_teacher_feeds(self):
+        other = User.objects.create_user(email='other@example.com', password='Password123', is_staff=True)
+        self.pending.teacher = other
+        self.pending.save()
+        body, _, _ = calendars.get_feed('teacher', self.teacher.id)
+        self.assertEqual(body.count('BEGIN:VEVENT'), 1)
+        approved, errors = bulk_approve([{'request_id': self.pending.request_id, 'teacher': self.teacher.id,
+                                          'class_Day': 'FRIDAY', 'class_Time': dt.time(15),
+                                          'start_Date': timezone.make_aware(dt.datetime(2023, 1, 9))}])
+        self.assertEqual(errors, {})
+        body, _, _ = calendars.get_feed('teacher', self.teacher.id)
+        self.assertEqual(body.count('BEGIN:VEVENT'), 2)
+        self.assertIn('Drums', body)
+
+    def test_long_lines_are_folded(self):
+        line = 'SUMMARY:' + 'é' * 60
+        folded = calendars.fold(line)
+        self.assertTrue(all(len(part.encode()) <= 75 for part in folded.split('\r\n')))
+        self.assertEqual(folded.replace('\r\n ', ''), line)
+
+    def test_dashboard_links_to_feed(self):
+        self.client.login(email='student@example.com', password='Password123')
+        response = self.client.get(reverse('user_home'))
+        self.assertContains(response, calendars.feed_token('student', self.student.id))
+        self.assertContains(response, calendars.feed_token('child', self.child.id))
@@ -0,0 +1,115 @@
+import datetime as dt
+import io
+
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.test import TestCase
+from django.utils import timezone
+
+from lessons.conflicts import ConflictIndex, weekly_slot
+from lessons.forms import ApproveForm
+from lessons.models import Request, User
+
+
+class ConflictIndexTestCase(TestCase):
+    """Tests of detecting teachers booked for two lessons at once"""
+
+    def setUp(self):
+        self.teacher = User.objects.create_user(email='teacher@example.com', password='Password123', is_staff=True)
+        self.student = User.objects.create_user(email='student@example.com', password='Password123')
+        self.start = dt.date(2023, 1, 2)
+        self.index = ConflictIndex()
+        # Monday 09:00-10:00 for ten weeks
+        self.index.add(1, self.teacher.id, 'MONDAY', dt.time(9), 60, self.start, 10, 1)
+
+    def _conflicts(self, class_day='MONDAY', class_time=dt.time(9), duration=60, start_date=None, **kwargs):
+        return self.index.conflicts(self.teacher.id, class_day, class_time, duration, start_date or self.start,
+                                    kwargs.get('lessons', 10), 1, exclude=kwargs.get('exclude'))
+
+    def test_weekly_slot(self):
+        self.assertEqual(weekly_slot('TUESDAY', dt.time(8, 30), 45), (1440 + 510, 1440 + 555))
+
+    def test_overlapping_slots_conflict(self):
+        self.assertEqual(self._conflicts(), [1])
+        self.assertEqual(self._conflicts(class_time=dt.time(8), duration=90), [1])
+        self.assertEqual(self._conflicts(class_time=dt.time(9, 30), duration=30), [1])
+
+    def test_adjacent_slots_do_not_conflict(self):
+        self.assertEqual(self._conflicts(class_time=dt.time(10)), [])
+        self.assertEqual(self._conflicts(class_time=dt.time(8)), [])
+        self.assertEqual(self._conflicts(class_day='TUESDAY'), [])
+
+    def test_other_teachers_and_excluded_request_do_not_conflict(self):
+        self.assertEqual(self.index.conflicts(999, 'MONDAY', dt.time(9), 60, self.start, 10, 1), [])
+        self.assertEqual(self._conflicts(exclude=1), [])
+
+    def test_terms_that_do_not_overlap_do_not_conflict(self):
+        self.assertEqual(self._conflicts(start_date=self.start + dt.timedelta(weeks=10)), [])
+        self.assertEqual(self._conflicts(start_date=self.start + dt.timedelta(weeks=9)), [1])
+
+    def test_slot_wrapping_past_sunday_midnight(self):
+        self.index.add(2, self.teacher.id, 'SUNDAY', dt.time(23), 120, self.start, 10, 1)
+        self.assertEqual(self._conflicts(class_time=dt.time(0, 30), duration=30), [2])
+        self.assertEqual(self._conflicts(class_day='SUNDAY', class_time=dt.time(22), duration=90), [2])
+
+    def test_long_booking_found_from_later_start(self):
+        self.index.add(3, self.teacher.id, 'WEDNESDAY', dt.time(8), 180, self.start, 10, 1)
+        self.index.add(4, self.teacher.id, 'WEDNESDAY', dt.time(9), 30, self.start, 10, 1)
+        self.assertEqual(self._conflicts(class_day='WEDNESDAY', class_time=dt.time(10), duration=30), [3])
+
+    def test_index_built_from_rows_matches_one_added_at_a_time(self):
+        rows = [(2, self.teacher.id, 'SUNDAY', dt.time(23), 120, self.start, 10, 1),
+                (3, self.teacher.id, 'WEDNESDAY', dt.time(8), 180, self.start, 10, 1),
+                (4, self.teacher.id, 'WEDNESDAY', dt.time(9), 30, self.start, 10, 1),
+                (1, self.teacher.id, 'MONDAY', dt.time(9), 60, self.start, 10, 1)]
+        for row in rows[:3]:
+            self.index.add(*row)
+        built = ConflictIndex.from_rows(rows).teachers[self.teacher.id]
+        self.assertEqual(built.starts, sorted(built.starts))
+        self.assertEqual(built.bookings, self.index.teachers[self.teacher.id].bookings)
+        self.assertEqual(built.longest, 180)
+
+    def test_index_loaded_from_approved_requests(self):
+        Request.objects.create(user=self.student, availability="MONDAYAM", number_of_lessons=10, interval=1,
+                               duration=45, lesson_content="Singing", teacher=self.teacher, class_Day='FRIDAY',
+                               class_Time=dt.time(15), start_Date=timezone.make_aware(dt.datetime(2023, 1, 2)),
+                               isApproved=True)
+        with self.assertNumQueries(1):
+            index = ConflictIndex.for_teachers([self.teacher.id])
+        self.assertEqual(len(index.conflicts(self.teacher.id, 'FRIDAY', dt.time(15, 30), 30, self.start, 1, 1)), 1)
+
+    def test_approve_form_reports_conflict(self):
+        booked = Request.objects.create(user=self.student, availability="MONDAYAM", number_of_lessons=10, interval=1,
+                                        duration=60, lesson_content="Singing", teacher=self.teacher,
+                                        class_Day='MONDAY', class_Time=dt.time(9),
+                                        start_Date=timezone.make_aware(dt.datetime(2023, 1, 2)), isApproved=True)
+        form_input = {'number_of_lessons': 10, 'interval': 1, 'duration': 60, 'lesson_content': "Singing",
+                      'teacher': self.teacher.id, 'class_Day': 'MONDAY', 'class_Time': dt.time(9),
+                      'start_Date': '2023-01-02 00:00'}
+        form = ApproveForm(data=form_input)
+        self.assertFalse(form.is_valid())
+        self.assertIn('class_Time', form.errors)
+        # Re-approving the booked request itself is not a conflict
+        self.assertTrue(ApproveForm(data=form_input, request_id=booked.request_id).is_valid())
+
+    def test_approve_form_checks_again_when_saving(self):
+        pending = Request.objects.create(user=self.student, availability="MONDAYAM", number_of_lessons=10, interval=1,
+                                         duration=60, lesson_content="Singing")
+        form = ApproveForm(data={'number_of_lessons': 10, 'interval': 1, 'duration': 60, 'lesson_content': "Singing",
+                                 'teacher': self.teacher.id, 'class_Day': 'MONDAY', 'class_Time': dt.time(9),
+                                 'start_Date': '2023-01-02 00:00'}, request_id=pending.request_id)
+        self.assertTrue(form.is_valid())
+        # Another approval books the teacher between the check and the save
+        Request.objects.create(user=self.student, availability="MONDAYAM", number_of_lessons=10, interval=1,
+                               duration=60, lesson_content="Singing", teacher=self.teacher, class_Day='MONDAY',
+                               class_Time=dt.time(9), start_Date=timezone.make_aware(dt.datetime(2023, 1, 2)),
+                               isApproved=True)
+        with self.assertRaises(ValidationError):
+            form.save(request=pending)
+        self.assertFalse(Request.objects.get(pk=pending.pk).isApproved)
+
+    def test_benchmark_command(self):
+        out, err = io.StringIO(), io.StringIO()
+        call_command('benchmark_conflicts', '--requests', '500', '--checks', '50', stdout=out, stderr=err)
+        self.assertIn("per check", out.getvalue())
+        self.assertEqual(err.getvalue(), "")
@@ -1,9 +1,11 @@
+from decimal import Decimal
+
 from django import forms
 from django.test import TestCase
 from django.urls import reverse
 
 from lessons.forms import LogInForm
-from lessons.models import User
+from lessons.models import User, Request, Invoice
 
 
 class DirectorViewTestCase(TestCase):
@@ -37,5 +39,14 @@ class DirectorViewTestCase(TestCase):
         self.assertNotEqual(response.context['requests'], None)
         self.assertNotEqual(response.context['approved'], None)
 
+    def test_balances_are_shown_in_pounds(self):
+        user = User.objects.get(email='a@bc.com')
+        request = Request.objects.create(user=user, availability="MONDAYAM", number_of_lessons=1, interval=1,
+                                         duration=30, lesson_content="Piano", isApproved=True)
+        Invoice.objects.create(invoice_number="0001-001", request=request, amount_to_be_paid=Decimal('120.55'))
+        self.client.login(email='director@bc.com', password='MyPassword!1')
+        response = self.client.get(self.url)
+        self.assertContains(response, '£120.55')
+
     def _is_logged_in(self):
         return '_auth_user_id' in self.client.session.keys()
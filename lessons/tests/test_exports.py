@@ -0,0 +1,85 @@
+import csv
+import gzip
+import io
+import json
+import os
+import tempfile
+import datetime as dt
+from decimal import Decimal
+
+from django.core.management import call_command
+from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from lessons import exports
+from lessons.models import Request, User, Invoice, Transaction
+
+
+class ExportTestCase(TestCase):
+    """Tests of the streaming finance exports"""
+
+    def setUp(self):
+        self.student = User.objects.create_user(email='student@example.com', password='Password123')
+        self.admin = User.objects.create_user(email='admin@example.com', password='Password123', is_staff=True)
+        for day in (1, 15):
+            request = Request.objects.create(user=self.student, availability="MONDAYAM", number_of_lessons=10,
+                                             interval=1, duration=45, lesson_content="Singing", isApproved=True)
+            invoice = Invoice.objects.create(request=request, amount_to_be_paid=Decimal('4500.00'),
+                                             invoice_number=f'0001-{day:03d}',
+                                             created_date=timezone.make_aware(dt.datetime(2023, 1, day, 12)))
+            Transaction.objects.create(amount=Decimal('100.00'), invoice=invoice, created_by=self.student,
+                                       administrated_by=self.admin,
+                                       date_paid=timezone.make_aware(dt.datetime(2023, 2, day, 12)))
+
+    def _csv(self, chunks):
+        return list(csv.reader(io.StringIO(''.join(chunks))))
+
+    def test_csv_export_includes_joined_fields(self):
+        rows = self._csv(exports.export('invoices'))
+        self.assertEqual(rows[0], exports.EXPORTS['invoices'][2])
+        self.assertEqual(len(rows), 3)
+        self.assertEqual(rows[1][1], '0001-001')
+        self.assertEqual(rows[1][3], 'student@example.com')
+
+    def test_jsonl_export(self):
+        lines = ''.join(exports.export('transactions', 'jsonl')).splitlines()
+        self.assertEqual(len(lines), 2)
+        row = json.loads(lines[0])
+        self.assertEqual(row['invoice__invoice_number'], '0001-001')
+        self.assertEqual(row['administrated_by__email'], 'admin@example.com')
+
+    def test_date_range_is_inclusive(self):
+        rows = self._csv(exports.export('invoices', start=dt.date(2023, 1, 2), end=dt.date(2023, 1, 15)))
+        self.assertEqual([row[1] for row in rows[1:]], ['0001-015'])
+
+    def test_gzip(self):
+        data = b''.join(exports.export('requests', gzip=True))
+        rows = list(csv.reader(io.StringIO(gzip.decompress(data).decode())))
+        self.assertEqual(len(rows), 3)
+
+    def test_view_streams_export(self):
+        self.client.login(email='admin@example.com', password='Password123')
+        response = self.client.get(reverse('export_data', kwargs={'name': 'transactions'}), {'format': 'jsonl'})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        self.assertEqual(len(b''.join(response.streaming_content).splitlines()), 2)
+
+    def test_view_rejects_bad_input(self):
+        self.client.login(email='admin@example.com', password='Password123')
+        self.assertEqual(self.client.get(reverse('export_data', kwargs={'name': 'users'})).status_code, 404)
+        response = self.client.get(reverse('export_data', kwargs={'name': 'invoices'}), {'start': 'yesterday'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_view_is_staff_only(self):
+        self.client.login(email='student@example.com', password='Password123')
+        response = self.client.get(reverse('export_data', kwargs={'name': 'invoices'}))
+        self.assertEqual(response.status_code, 302)
+
+    def test_command_writes_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'invoices.csv.gz')
+            call_command('export', 'invoices', '--gzip', '--output', path)
+            with gzip.open(path, 'rt') as export_file:
+                self.assertEqual(len(list(csv.reader(export_file))), 3)
@@ -0,0 +1,47 @@
+from decimal import Decimal
+
+from django.test import TestCase
+
+from lessons.models import Request, User, Invoice, InvoiceSequence, format_invoice_number
+
+
+class InvoiceSequenceTestCase(TestCase):
+    """Tests of the per-user invoice number sequence"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(email='student@example.com', password='Password123')
+        self.other = User.objects.create_user(email='other@example.com', password='Password123')
+        self.prefix = str(self.user.id).zfill(4)
+
+    def test_first_number_is_001(self):
+        self.assertEqual(InvoiceSequence.objects.reserve(self.user.id), [self.prefix + '-001'])
+
+    def test_numbers_increase(self):
+        InvoiceSequence.objects.reserve(self.user.id)
+        self.assertEqual(InvoiceSequence.objects.reserve(self.user.id), [self.prefix + '-002'])
+
+    def test_reserve_block(self):
+        InvoiceSequence.objects.reserve(self.user.id)
+        self.assertEqual(InvoiceSequence.objects.reserve(self.user.id, count=3),
+                         [self.prefix + '-002', self.prefix + '-003', self.prefix + '-004'])
+        self.assertEqual(InvoiceSequence.objects.get(user=self.user).last_number, 4)
+
+    def test_reserve_blocks_for_several_users(self):
+        blocks = InvoiceSequence.objects.reserve_blocks({self.user.id: 2, self.other.id: 1})
+        self.assertEqual(blocks[self.user.id], [self.prefix + '-001', self.prefix + '-002'])
+        self.assertEqual(blocks[self.other.id], [str(self.other.id).zfill(4) + '-001'])
+
+    def test_sequences_are_independent(self):
+        InvoiceSequence.objects.reserve(self.user.id, count=5)
+        self.assertEqual(InvoiceSequence.objects.reserve(self.other.id), [str(self.other.id).zfill(4) + '-001'])
+
+    def test_new_sequence_continues_after_existing_invoices(self):
+        request = Request.objects.create(user=self.user, availability="MONDAYAM", number_of_lessons=10,
+                                         interval=1, duration=45, lesson_content="Singing", isApproved=True)
+        Invoice.objects.create(request=request, amount_to_be_paid=Decimal('10.00'), invoice_number=self.prefix + '-007')
+        self.assertEqual(InvoiceSequence.objects.reserve(self.user.id), [self.prefix + '-008'])
+
+    def test_numbers_match_invoice_number_format(self):
+        self.assertEqual(format_invoice_number(42, 7), '0042-007')
+        with self.assertRaises(ValueError):
+            format_invoice_number(42, 1000)
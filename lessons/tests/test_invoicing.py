@@ -0,0 +1,93 @@
+from io import StringIO
+from decimal import Decimal
+
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from lessons.invoicing import generate_invoices
+from lessons.models import Request, User, Invoice, createInvoice
+
+
+class InvoicingTestCase(TestCase):
+    """Tests of the batch invoice generation engine"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(email='student@example.com', password='Password123')
+
+    def _create_request(self, user, approved=True):
+        return Request.objects.create(user=user, availability="MONDAYAM", number_of_lessons=10, interval=1,
+                                      duration=45, lesson_content="Singing", isApproved=approved)
+
+    def _create_students(self, count, start=0):
+        for i in range(start, start + count):
+            student = User.objects.create_user(email=f'student{i}@example.com', password='Password123')
+            self._create_request(student)
+            self._create_request(student)
+
+    def test_invoices_approved_requests_only(self):
+        approved = self._create_request(self.user)
+        pending = self._create_request(self.user, approved=False)
+        self.assertEqual(generate_invoices(), 1)
+        approved.refresh_from_db()
+        pending.refresh_from_db()
+        self.assertIsNotNone(approved.invoice)
+        self.assertIsNone(pending.invoice)
+        self.assertEqual(approved.invoice.amount_to_be_paid, approved.get_total_amount_payable())
+
+    def test_invoice_numbers_continue_users_sequence(self):
+        first = self._create_request(self.user)
+        Invoice.objects.create(request=first, amount_to_be_paid=Decimal('10.00'),
+                               invoice_number=str(self.user.id).zfill(4) + '-001')
+        self._create_request(self.user)
+        self._create_request(self.user)
+        generate_invoices()
+        numbers = sorted(Invoice.objects.filter(request__user=self.user).values_list('invoice_number', flat=True))
+        prefix = str(self.user.id).zfill(4)
+        self.assertEqual(numbers, [prefix + '-001', prefix + '-002', prefix + '-003'])
+
+    def test_does_not_invoice_requests_twice(self):
+        self._create_request(self.user)
+        self.assertEqual(generate_invoices(), 1)
+        self.assertEqual(generate_invoices(), 0)
+        self.assertEqual(Invoice.objects.count(), 1)
+
+    def test_updates_balances(self):
+        request = self._create_request(self.user)
+        generate_invoices()
+        self.assertEqual(User.objects.get(pk=self.user.pk).balance, request.get_total_amount_payable())
+
+    def test_only_invoices_given_users(self):
+        other = User.objects.create_user(email='other@example.com', password='Password123')
+        self._create_request(self.user)
+        self._create_request(other)
+        self.assertEqual(generate_invoices(user_ids=[other.id]), 1)
+        self.assertFalse(Invoice.objects.filter(request__user=self.user).exists())
+
+    def test_query_count_does_not_grow_with_users(self):
+        query_counts = []
+        for size in (5, 50):
+            self._create_students(size, start=len(query_counts) * 100)
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(generate_invoices(), size * 2)
+            query_counts.append(len(queries))
+        self.assertEqual(query_counts[0], query_counts[1])
+
+    def test_command(self):
+        self._create_students(3)
+        out = StringIO()
+        call_command('generate_invoices', stdout=out)
+        self.assertIn("Created 6 invoice(s).", out.getvalue())
+
+    def test_create_invoice_invoices_an_approved_request_once(self):
+        request = self._create_request(self.user)
+        invoice = createInvoice(request)
+        self.assertIsNotNone(invoice)
+        self.assertEqual(Request.objects.get(pk=request.pk).invoice, invoice)
+        self.assertIsNone(createInvoice(Request.objects.get(pk=request.pk)))
+        self.assertEqual(Invoice.objects.count(), 1)
+
+    def test_create_invoice_skips_pending_requests(self):
+        self.assertIsNone(createInvoice(self._create_request(self.user, approved=False)))
+        self.assertEqual(Invoice.objects.count(), 0)
@@ -0,0 +1,121 @@
+from io import StringIO
+from decimal import Decimal
+from unittest import mock
+
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from lessons import jobs
+from lessons.models import Request, User, Invoice, Job, Transaction
+
+
+class JobQueueTestCase(TestCase):
+    """Tests of the background job queue"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(email='student@example.com', password='Password123')
+        self.admin = User.objects.create_user(email='admin@example.com', password='Password123', is_staff=True)
+
+    def _create_request(self, approved=True):
+        return Request.objects.create(user=self.user, availability="MONDAYAM", number_of_lessons=10, interval=1,
+                                      duration=45, lesson_content="Singing", isApproved=approved)
+
+    def test_approving_request_queues_invoice_job(self):
+        request = self._create_request(approved=False)
+        self.assertFalse(Job.objects.exists())
+        request.isApproved = True
+        request.save()
+        self.assertTrue(Job.objects.filter(kind=Job.INVOICE, user=self.user, status=Job.PENDING).exists())
+
+    def test_duplicate_jobs_are_coalesced(self):
+        self._create_request()
+        self._create_request()
+        self.assertEqual(Job.objects.filter(kind=Job.INVOICE, user=self.user).count(), 1)
+
+    def test_transaction_queues_balance_job(self):
+        request = self._create_request()
+        invoice = Invoice.objects.create(request=request, amount_to_be_paid=Decimal('10.00'), invoice_number='0001-001')
+        Transaction.objects.create(amount=Decimal('5.00'), invoice=invoice, created_by=self.user)
+        self.assertTrue(Job.objects.filter(kind=Job.BALANCE, user=self.user).exists())
+
+    def test_worker_processes_jobs(self):
+        request = self._create_request()
+        self.assertEqual(jobs.run_until_empty(), 1)
+        request.refresh_from_db()
+        self.assertIsNotNone(request.invoice)
+        self.assertEqual(User.objects.get(pk=self.user.pk).balance, request.get_total_amount_payable())
+        self.assertFalse(Job.objects.exists())
+
+    def test_balance_job_repairs_drift(self):
+        jobs.enqueue(Job.BALANCE, [self.user.id])
+        User.objects.filter(pk=self.user.pk).update(balance=Decimal('99.00'))
+        jobs.run_until_empty()
+        self.assertEqual(User.objects.get(pk=self.user.pk).balance, Decimal('0.00'))
+
+    def test_failed_job_is_retried_later(self):
+        self._create_request()
+        with mock.patch.dict(jobs.HANDLERS, {Job.INVOICE: mock.Mock(side_effect=ValueError("boom"))}):
+            self.assertEqual(jobs.run_until_empty(), 1)
+        job = Job.objects.get()
+        self.assertEqual(job.status, Job.PENDING)
+        self.assertEqual(job.attempts, 1)
+        self.assertIn("boom", job.last_error)
+        self.assertGreater(job.run_after, timezone.now())
+
+    def test_job_fails_after_max_attempts(self):
+        self._create_request()
+        Job.objects.update(attempts=jobs.MAX_ATTEMPTS - 1)
+        with mock.patch.dict(jobs.HANDLERS, {Job.INVOICE: mock.Mock(side_effect=ValueError("boom"))}):
+            jobs.run_until_empty()
+        self.assertEqual(Job.objects.get().status, Job.FAILED)
+        # A new event can still queue a fresh job for the user
+        self._create_request()
+        self.assertTrue(Job.objects.filter(status=Job.PENDING).exists())
+
+    def test_one_bad_job_does_not_block_the_batch(self):
+        other = User.objects.create_user(email='other@example.com', password='Password123')
+        jobs.enqueue(Job.BALANCE, [self.user.id, other.id])
+
+        def handler(user_ids):
+            if self.user.id in user_ids:
+                raise ValueError("boom")
+        with mock.patch.dict(jobs.HANDLERS, {Job.BALANCE: handler}):
+            jobs.run_until_empty()
+        self.assertEqual(list(Job.objects.values_list('user_id', flat=True)), [self.user.id])
+
+    def test_command(self):
+        self._create_request()
+        out = StringIO()
+        call_command('run_worker', '--once', stdout=out)
+        self.assertIn("Processed 1 job(s).", out.getvalue())
+
+
+class DashboardReadOnlyTestCase(TestCase):
+    """The dashboards must not write to the database"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(email='student@example.com', password='Password123')
+        User.objects.create_user(email='admin@example.com', password='Password123', is_staff=True)
+        Request.objects.create(user=self.user, availability="MONDAYAM", number_of_lessons=10, interval=1,
+                               duration=45, lesson_content="Singing", isApproved=True)
+
+    def _assert_no_writes(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        writes = [query['sql'] for query in queries
+                  if query['sql'].split()[0].upper() in ('INSERT', 'UPDATE', 'DELETE')]
+        self.assertEqual(writes, [])
+
+    def test_admin_home_only_reads(self):
+        self.client.login(email='admin@example.com', password='Password123')
+        self._assert_no_writes(reverse('admin_home'))
+        self._assert_no_writes(reverse('view_student', kwargs={'user_id': self.user.id}))
+
+    def test_user_home_only_reads(self):
+        self.client.login(email='student@example.com', password='Password123')
+        self._assert_no_writes(reverse('user_home'))
@@ -0,0 +1,86 @@
+from io import StringIO
+from decimal import Decimal
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase
+
+from lessons.ledger import rebuild_balances
+from lessons.models import Request, User, Invoice, Transaction
+
+
+class LedgerTestCase(TestCase):
+    """Tests of the running balance ledger"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(email='student@example.com', password='Password123')
+        self.admin = User.objects.create_user(email='admin@example.com', password='Password123', is_staff=True)
+        self.request = Request.objects.create(user=self.user, availability="MONDAYAM", number_of_lessons=10,
+                                              interval=1, duration=45, lesson_content="Singing", isApproved=True)
+        self.invoice = Invoice.objects.create(invoice_number="0001-001", request=self.request,
+                                              amount_to_be_paid=Decimal('120.55'))
+
+    def _balance(self):
+        return User.objects.get(pk=self.user.pk).balance
+
+    def test_invoice_for_approved_request_adds_to_balance(self):
+        self.assertEqual(self._balance(), Decimal('120.55'))
+
+    def test_invoice_for_pending_request_does_not_add_to_balance(self):
+        pending = Request.objects.create(user=self.user, availability="MONDAYAM", number_of_lessons=1,
+                                         interval=1, duration=30, lesson_content="Piano")
+        Invoice.objects.create(invoice_number="0001-002", request=pending, amount_to_be_paid=Decimal('300.00'))
+        self.assertEqual(self._balance(), Decimal('120.55'))
+
+    def test_approving_invoiced_request_adds_to_balance(self):
+        pending = Request.objects.create(user=self.user, availability="MONDAYAM", number_of_lessons=1,
+                                         interval=1, duration=30, lesson_content="Piano")
+        Invoice.objects.create(invoice_number="0001-002", request=pending, amount_to_be_paid=Decimal('300.00'))
+        pending.isApproved = True
+        pending.save()
+        self.assertEqual(self._balance(), Decimal('420.55'))
+
+    def test_changing_invoice_amount_applies_difference(self):
+        self.invoice.amount_to_be_paid = Decimal('100.00')
+        self.invoice.save()
+        self.assertEqual(self._balance(), Decimal('100.00'))
+
+    def test_deleting_invoice_removes_it_from_balance(self):
+        self.invoice.delete()
+        self.assertEqual(self._balance(), Decimal('0.00'))
+
+    def test_deleting_request_removes_its_invoice_from_balance(self):
+        self.request.delete()
+        self.assertEqual(self._balance(), Decimal('0.00'))
+
+    def test_transactions_are_taken_off_balance(self):
+        payment = Transaction.objects.create(amount=Decimal('20.55'), invoice=self.invoice, created_by=self.user,
+                                             administrated_by=self.admin)
+        self.assertEqual(self._balance(), Decimal('100.00'))
+        payment.amount = Decimal('0.55')
+        payment.save()
+        self.assertEqual(self._balance(), Decimal('120.00'))
+        payment.delete()
+        self.assertEqual(self._balance(), Decimal('120.55'))
+
+    def test_saving_stale_user_does_not_overwrite_balance(self):
+        stale = User.objects.get(pk=self.user.pk)
+        Transaction.objects.create(amount=Decimal('20.55'), invoice=self.invoice, created_by=self.user)
+        stale.first_name = 'Changed'
+        stale.save()
+        self.assertEqual(self._balance(), Decimal('100.00'))
+
+    def test_rebuild_repairs_drifted_balance(self):
+        User.objects.filter(pk=self.user.pk).update(balance=Decimal('5.00'))
+        mismatched = rebuild_balances()
+        self.assertEqual(len(mismatched), 1)
+        self.assertEqual(self._balance(), Decimal('120.55'))
+        self.assertEqual(rebuild_balances(), [])
+
+    def test_rebuild_command_check_fails_on_mismatch(self):
+        User.objects.filter(pk=self.user.pk).update(balance=Decimal('5.00'))
+        with self.assertRaises(CommandError):
+            call_command('rebuild_balances', '--check', stdout=StringIO())
+        self.assertEqual(self._balance(), Decimal('5.00'))
+        call_command('rebuild_balances', stdout=StringIO())
+        self.assertEqual(self._balance(), Decimal('120.55'))
@@ -0,0 +1,104 @@
+import json
+import tempfile
+from unittest.mock import patch
+
+from django.db import transaction
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from lessons import metrics
+from lessons.invoicing import generate_invoices
+from lessons.models import Request, User
+
+
+def value(name, **labels):
+    """The total of a sample over all the processes' files"""
+    for key, total in metrics.collect().items():
+        metric, sample, sample_labels = json.loads(key)
+        if sample == name and sample_labels == labels:
+            return total
+    return 0.0
+
+
+class MetricsTestCase(TestCase):
+    """Tests of the Prometheus metrics"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(email='student@example.com', password='Password123')
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings = override_settings(METRICS_DIR=directory.name, METRICS_ENABLED=True)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def test_adds_up_the_files_of_every_process(self):
+        for pid in (101, 102):
+            with patch('lessons.metrics.os.getpid', return_value=pid):
+                metrics.invoices_created.inc(2)
+        self.assertEqual(value('msms_invoices_created_total'), 4)
+
+    def test_keeps_values_when_a_file_is_opened_again(self):
+        metrics.invoices_created.inc(3)
+        path = metrics.store().path
+        reopened = metrics.MmapStore(metrics.store().directory)
+        self.assertEqual(reopened.path, path)
+        reopened.add(('["msms_invoices_created", "msms_invoices_created_total", {}]', 1))
+        reopened.close()
+        self.assertEqual(value('msms_invoices_created_total'), 4)
+
+    def test_file_grows_to_fit_more_samples(self):
+        for number in range(2000):
+            metrics.template_render.observe(0.001, f'template_{number}.html')
+        self.assertEqual(value('msms_template_render_seconds_count', template='template_1999.html'), 1)
+
+    def test_histograms_are_exposed_with_cumulative_buckets(self):
+        for seconds in (0.003, 0.02, 0.02, 30):
+            metrics.view_latency.observe(seconds, 'home', 'GET')
+        lines = metrics.exposition().splitlines()
+        self.assertIn('# TYPE msms_view_latency_seconds histogram', lines)
+        self.assertIn('msms_view_latency_seconds_bucket{method="GET",view="home",le="0.005"} 1.0', lines)
+        self.assertIn('msms_view_latency_seconds_bucket{method="GET",view="home",le="0.025"} 3.0', lines)
+        self.assertIn('msms_view_latency_seconds_bucket{method="GET",view="home",le="10.0"} 3.0', lines)
+        self.assertIn('msms_view_latency_seconds_bucket{method="GET",view="home",le="+Inf"} 4.0', lines)
+        self.assertIn('msms_view_latency_seconds_count{method="GET",view="home"} 4.0', lines)
+        self.assertIn('# TYPE msms_invoices_created counter', lines)
+
+    def test_records_each_request(self):
+        self.client.login(email='student@example.com', password='Password123')
+        self.client.get(reverse('user_home'))
+        self.assertEqual(value('msms_view_latency_seconds_count', view='user_home', method='GET'), 1)
+        self.assertEqual(value('msms_db_queries_count', view='user_home'), 1)
+        self.assertGreater(value('msms_db_queries_sum', view='user_home'), 0)
+        self.assertEqual(value('msms_template_render_seconds_count', template='user_home.html'), 1)
+
+    def test_unmatched_requests_share_a_label(self):
+        self.client.get('/no/such/page/')
+        self.assertEqual(value('msms_view_latency_seconds_count', view=metrics.UNMATCHED, method='GET'), 1)
+
+    def test_counts_invoices_once_committed(self):
+        Request.objects.create(user=self.user, availability="MONDAYAM", number_of_lessons=10, interval=1,
+                               duration=45, lesson_content="Singing", isApproved=True)
+        with self.captureOnCommitCallbacks(execute=True):
+            generate_invoices()
+        self.assertEqual(value('msms_invoices_created_total'), 1)
+
+    def test_does_not_count_rolled_back_changes(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                metrics.requests_approved.inc_on_commit(5)
+                transaction.set_rollback(True)
+        self.assertEqual(value('msms_requests_approved_total'), 0)
+
+    @override_settings(METRICS_ENABLED=False)
+    def test_records_nothing_when_disabled(self):
+        self.client.get(reverse('home'))
+        metrics.invoices_created.inc()
+        self.assertEqual(metrics.collect(), {})
+
+    def test_endpoint_serves_the_metrics_locally(self):
+        metrics.invoices_created.inc()
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], metrics.CONTENT_TYPE)
+        self.assertIn(b'msms_invoices_created_total 1.0', response.content)
+        self.assertEqual(self.client.get(reverse('metrics'), REMOTE_ADDR='203.0.113.9').status_code, 403)
@@ -0,0 +1,66 @@
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from lessons.middleware import QueryBudgetExceeded, QueryRecorder, fingerprint, stats
+from lessons.models import User
+
+
+class QueryCountMiddlewareTestCase(TestCase):
+    """Tests of the per-request query instrumentation"""
+
+    def setUp(self):
+        self.student = User.objects.create_user(email='student@example.com', password='Password123')
+        self.admin = User.objects.create_user(email='admin@example.com', password='Password123', is_staff=True)
+        stats.clear()
+
+    def test_server_timing_header(self):
+        self.client.login(email='student@example.com', password='Password123')
+        response = self.client.get(reverse('user_home'))
+        self.assertRegex(response.headers['Server-Timing'],
+                         r'^db;dur=[\d.]+;desc="\d+ queries", db-slowest;dur=[\d.]+, db-duplicates;desc="\d+"$')
+
+    def test_summary_per_url_name(self):
+        self.client.login(email='student@example.com', password='Password123')
+        self.client.get(reverse('user_home'))
+        self.client.get(reverse('user_home'))
+        row = next(row for row in stats.summary() if row['name'] == 'user_home')
+        self.assertEqual(row['requests'], 2)
+        self.assertGreater(row['max_queries'], 0)
+        self.assertEqual(row['budget'], 10)
+
+    def test_fingerprint_collapses_values(self):
+        self.assertEqual(fingerprint('SELECT * FROM t WHERE id IN (%s, %s, %s) LIMIT 21'),
+                         fingerprint('SELECT *  FROM t\nWHERE id IN (%s, %s) LIMIT 3'))
+
+    def test_recorder_reports_repeated_statements(self):
+        recorder = QueryRecorder()
+        with connection.execute_wrapper(recorder):
+            for user_id in (self.student.id, self.admin.id, self.student.id):
+                User.objects.filter(pk=user_id).exists()
+            User.objects.count()
+        self.assertEqual(recorder.count, 4)
+        self.assertEqual([count for _, count in recorder.duplicates], [3])
+
+    @override_settings(QUERY_BUDGETS={'user_home': 1}, QUERY_BUDGET_STRICT=True)
+    def test_budget_fails_when_strict(self):
+        self.client.login(email='student@example.com', password='Password123')
+        with self.assertRaisesMessage(QueryBudgetExceeded, 'over its budget of 1'):
+            self.client.get(reverse('user_home'))
+
+    @override_settings(QUERY_BUDGETS={'user_home': 1}, QUERY_BUDGET_STRICT=False)
+    def test_budget_warns_otherwise(self):
+        self.client.login(email='student@example.com', password='Password123')
+        with self.assertLogs('lessons.middleware', 'WARNING') as logs:
+            response = self.client.get(reverse('user_home'))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('user_home ran', logs.output[0])
+
+    def test_stats_page_is_staff_only(self):
+        self.client.login(email='student@example.com', password='Password123')
+        self.assertEqual(self.client.get(reverse('query_stats')).status_code, 302)
+        self.client.login(email='admin@example.com', password='Password123')
+        self.client.get(reverse('admin_home'))
+        response = self.client.get(reverse('query_stats'))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'admin_home')
@@ -0,0 +1,110 @@
+from decimal import Decimal
+
+from django.core.exceptions import ValidationError
+from django.db import connection
+from django.db.models import Sum
+from django.test import TestCase
+
+from lessons.ledger import calculate_balances
+from lessons.models import Request, User, Invoice, Transaction
+from lessons.money import Money, MoneyField
+
+
+class MoneyTestCase(TestCase):
+    """Tests of the Money value type"""
+
+    def test_of_converts_pounds_to_pence(self):
+        self.assertEqual(Money.of(Decimal('12.34')).cents, 1234)
+        self.assertEqual(Money.of('0.5').cents, 50)
+        self.assertEqual(Money.of(3).cents, 300)
+        self.assertEqual(Money.of(0.1).cents, 10)
+
+    def test_of_rounds_half_up_to_the_penny(self):
+        self.assertEqual(Money.of(Decimal('0.125')).cents, 13)
+        self.assertEqual(Money.of(Decimal('-0.125')).cents, -13)
+
+    def test_of_rejects_non_finite_amounts(self):
+        with self.assertRaises(ValueError):
+            Money.of(Decimal('NaN'))
+
+    def test_constructor_takes_only_whole_pence(self):
+        with self.assertRaises(TypeError):
+            Money(Decimal('1.5'))
+
+    def test_str_has_two_decimal_places(self):
+        self.assertEqual(str(Money(1234)), '12.34')
+        self.assertEqual(str(Money(5)), '0.05')
+        self.assertEqual(str(Money(-5)), '-0.05')
+        self.assertEqual(str(Money(0)), '0.00')
+
+    def test_compares_with_decimals_and_ints_in_pounds(self):
+        self.assertEqual(Money(1234), Decimal('12.34'))
+        self.assertEqual(Money(1200), 12)
+        self.assertEqual(Money(1250), 12.5)
+        self.assertNotEqual(Money(1234), Decimal('12.345'))
+        self.assertLess(Money(1234), Decimal('12.345'))
+        self.assertGreater(Money(1), 0)
+        self.assertLessEqual(Money(100), Money(100))
+
+    def test_hash_matches_equal_decimals(self):
+        self.assertEqual(hash(Money(1234)), hash(Decimal('12.34')))
+        self.assertEqual(len({Money(1234), Money.of('12.34')}), 1)
+
+    def test_arithmetic(self):
+        self.assertEqual(Money(150) + Money(275), Money(425))
+        self.assertEqual(Money(150) - Decimal('2'), Money(-50))
+        self.assertEqual(10 - Money(150), Money(850))
+        self.assertEqual(sum([Money(1), Money(2), Money(3)]), Money(6))
+        self.assertEqual(Money(150) * 3, Money(450))
+        self.assertEqual(Money(1000) * 0.5, Money(500))
+        self.assertEqual(-Money(5), Money(-5))
+        self.assertFalse(Money(0))
+
+
+class MoneyFieldTestCase(TestCase):
+    """Tests of amounts of money stored as pence"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(email='student@example.com', password='Password123')
+        self.request = Request.objects.create(user=self.user, availability="MONDAYAM", number_of_lessons=10,
+                                              interval=1, duration=45, lesson_content="Singing", isApproved=True)
+        self.invoice = Invoice.objects.create(invoice_number="0001-001", request=self.request,
+                                              amount_to_be_paid=Decimal('120.55'))
+
+    def test_amount_is_stored_as_integer_pence(self):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT amount_to_be_paid FROM lessons_invoice WHERE id = %s", [self.invoice.pk])
+            self.assertEqual(cursor.fetchone()[0], 12055)
+
+    def test_amount_is_read_back_as_money(self):
+        amount = Invoice.objects.get(pk=self.invoice.pk).amount_to_be_paid
+        self.assertIsInstance(amount, Money)
+        self.assertEqual(amount, Decimal('120.55'))
+
+    def test_lookups_take_pounds(self):
+        self.assertTrue(Invoice.objects.filter(amount_to_be_paid=Decimal('120.55')).exists())
+        self.assertTrue(Invoice.objects.filter(amount_to_be_paid__gt=Money(12054)).exists())
+        self.assertFalse(Invoice.objects.filter(amount_to_be_paid__gt=121).exists())
+
+    def test_sums_are_money(self):
+        Transaction.objects.create(amount=Decimal('20.05'), invoice=self.invoice, created_by=self.user)
+        Transaction.objects.create(amount=Decimal('0.50'), invoice=self.invoice, created_by=self.user)
+        self.assertEqual(Transaction.objects.aggregate(total=Sum('amount'))['total'], Money(2055))
+
+    def test_balance_is_kept_in_pence(self):
+        Transaction.objects.create(amount=Decimal('20.05'), invoice=self.invoice, created_by=self.user)
+        self.assertEqual(User.objects.get(pk=self.user.pk).balance, Money(10050))
+        self.assertEqual(calculate_balances([self.user.pk]), {self.user.pk: Money(10050)})
+
+    def test_to_python_rejects_floats_and_fractions_of_a_penny(self):
+        field = MoneyField()
+        for value in [123.45, Decimal('1.001'), '1.001', 'abc']:
+            with self.assertRaises(ValidationError):
+                field.to_python(value)
+        self.assertEqual(field.to_python('1.5'), Money(150))
+
+    def test_formfield_takes_pounds_and_pence(self):
+        form_field = MoneyField().formfield()
+        self.assertEqual(form_field.clean('12.34'), Decimal('12.34'))
+        with self.assertRaises(ValidationError):
+            form_field.clean('12.345')
@@ -0,0 +1,108 @@
+import datetime as dt
+import io
+
+from django.core.management import call_command
+from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from lessons.approvals import bulk_approve
+from lessons.models import Request, User, Lesson
+from lessons.occurrences import first_lesson_date, lesson_times, sync_lessons, backfill_lessons
+
+
+def aware(*args):
+    return timezone.make_aware(dt.datetime(*args))
+
+
+class LessonOccurrenceTestCase(TestCase):
+    """Tests of materialising the lessons of approved requests"""
+
+    def setUp(self):
+        self.student = User.objects.create_user(email='student@example.com', password='Password123')
+        self.teacher = User.objects.create_user(email='teacher@example.com', password='Password123', is_staff=True)
+        # 2023-01-04 is a Wednesday
+        self.request = Request.objects.create(user=self.student, availability="MONDAYAM", number_of_lessons=3,
+                                              interval=2, duration=45, lesson_content="Singing", teacher=self.teacher,
+                                              class_Day='MONDAY', class_Time=dt.time(9),
+                                              start_Date=aware(2023, 1, 4), isApproved=True)
+
+    def test_first_lesson_date(self):
+        self.assertEqual(first_lesson_date(dt.date(2023, 1, 4), 'MONDAY'), dt.date(2023, 1, 9))
+        self.assertEqual(first_lesson_date(dt.date(2023, 1, 4), 'WEDNESDAY'), dt.date(2023, 1, 4))
+        self.assertEqual(first_lesson_date(aware(2023, 1, 4, 23), 'SUNDAY'), dt.date(2023, 1, 8))
+
+    def test_lesson_times(self):
+        self.assertEqual(lesson_times(self.request), [
+            (aware(2023, 1, 9, 9), aware(2023, 1, 9, 9, 45)),
+            (aware(2023, 1, 23, 9), aware(2023, 1, 23, 9, 45)),
+            (aware(2023, 2, 6, 9), aware(2023, 2, 6, 9, 45)),
+        ])
+
+    def test_sync_only_writes_changes(self):
+        self.assertEqual(sync_lessons(self.request), (3, 0, 0))
+        first = Lesson.objects.get(request=self.request, number=1)
+        self.request.number_of_lessons = 2
+        self.assertEqual(sync_lessons(self.request), (0, 0, 1))
+        self.request.start_Date = aware(2023, 1, 16)
+        self.request.number_of_lessons = 4
+        self.assertEqual(sync_lessons(self.request), (2, 2, 0))
+        moved = Lesson.objects.get(request=self.request, number=1)
+        self.assertEqual(moved.pk, first.pk)
+        self.assertEqual(moved.start, aware(2023, 1, 16, 9))
+
+    def test_unapproved_request_has_no_lessons(self):
+        sync_lessons(self.request)
+        self.request.isApproved = False
+        sync_lessons(self.request)
+        self.assertFalse(Lesson.objects.exists())
+
+    def test_approve_view_fills_in_lessons(self):
+        pending = Request.objects.create(user=self.student, availability="MONDAYAM", number_of_lessons=10,
+                                         interval=1, duration=45, lesson_content="Piano")
+        self.client.login(email='teacher@example.com', password='Password123')
+        self.client.post(reverse('approve', kwargs={'requestId': pending.request_id}), {
+            'number_of_lessons': 4, 'interval': 1, 'duration': 30, 'lesson_content': 'Piano',
+            'teacher': self.teacher.id, 'class_Day': 'FRIDAY', 'class_Time': '16:00:00',
+            'start_Date': '2023-01-02 00:00'})
+        lessons = Lesson.objects.filter(request=pending).order_by('number')
+        self.assertEqual([lesson.start for lesson in lessons],
+                         [aware(2023, 1, day, 16) for day in (6, 13, 20, 27)])
+        self.assertEqual({lesson.teacher_id for lesson in lessons}, {self.teacher.id})
+
+    def test_bulk_approve_fills_in_lessons(self):
+        pending = Request.objects.create(user=self.student, availability="MONDAYAM", number_of_lessons=5,
+                                         interval=1, duration=45, lesson_content="Piano")
+        bulk_approve([{'request_id': pending.request_id, 'teacher': self.teacher.id, 'class_Day': 'TUESDAY',
+                       'class_Time': dt.time(10), 'start_Date': aware(2023, 1, 2)}])
+        self.assertEqual(Lesson.objects.filter(request=pending, student=self.student).count(), 5)
+
+    def test_editing_an_approved_request_updates_its_lessons(self):
+        sync_lessons(self.request)
+        self.client.login(email='student@example.com', password='Password123')
+        self.client.post(reverse('edit_request', args=[self.request.request_id]), {
+            'availability': ['MONDAYAM'], 'number_of_lessons': 5, 'interval': 2, 'duration': 45,
+            'lesson_content': 'Singing', 'teacher': self.teacher.id})
+        self.assertEqual(Lesson.objects.filter(request=self.request).count(), 5)
+
+    def test_backfill(self):
+        Request.objects.create(user=self.student, availability="MONDAYAM", number_of_lessons=5, interval=1,
+                               duration=45, lesson_content="Piano", isApproved=True)
+        stale = Request.objects.create(user=self.student, availability="MONDAYAM", number_of_lessons=5, interval=1,
+                                       duration=45, lesson_content="Piano", isApproved=True)
+        sync_lessons(stale)
+        Request.objects.filter(pk=stale.pk).update(isApproved=False)
+        self.assertEqual(backfill_lessons(batch_size=1), (2, 8))
+        self.assertEqual(backfill_lessons(), (2, 8))
+        self.assertEqual(Lesson.objects.count(), 8)
+        self.assertFalse(Lesson.objects.filter(request=stale).exists())
+
+    def test_lessons_between(self):
+        sync_lessons(self.request)
+        lessons = Lesson.objects.between(aware(2023, 1, 23), aware(2023, 1, 24)).filter(teacher=self.teacher)
+        self.assertEqual([lesson.number for lesson in lessons], [2])
+
+    def test_command(self):
+        out = io.StringIO()
+        call_command('backfill_lessons', '--batch-size', '10', stdout=out)
+        self.assertIn("Expanded 1 request(s) into 3 lesson(s).", out.getvalue())
@@ -0,0 +1,104 @@
+import datetime as dt
+from decimal import Decimal
+
+from django.db import connection
+from django.http import QueryDict
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from lessons.models import Request, User, Invoice, Transaction
+from lessons.pagination import paginate, encode_cursor
+
+
+class KeysetPaginationTestCase(TestCase):
+    """Tests of keyset pagination of the dashboard tables"""
+
+    def setUp(self):
+        self.student = User.objects.create_user(email='student@example.com', password='Password123')
+        self.admin = User.objects.create_user(email='admin@example.com', password='Password123', is_staff=True)
+        created = timezone.make_aware(dt.datetime(2023, 1, 1))
+        self.invoices = []
+        for i in range(1, 8):
+            request = Request.objects.create(user=self.student, availability="MONDAYAM", number_of_lessons=10,
+                                             interval=1, duration=45, lesson_content="Singing", isApproved=True)
+            # Several invoices share a created_date, so the order must fall back to the id
+            self.invoices.append(Invoice.objects.create(
+                request=request, amount_to_be_paid=Decimal('100.00'), invoice_number=f'0001-00{i}',
+                created_date=created + dt.timedelta(days=i // 3), status='CLOSED' if i % 2 else 'ACTIVE'))
+
+    def _page(self, query='', **kwargs):
+        return paginate(Invoice.objects.all(), QueryDict(query), 'invoices_', ('created_date', 'id'),
+                        {'status': 'status'}, per_page=3, **kwargs)
+
+    def _follow(self, query):
+        return QueryDict(query.lstrip('?')).urlencode()
+
+    def test_pages_cover_every_row_once_in_order(self):
+        seen, query = [], ''
+        while True:
+            page = self._page(query)
+            seen.extend(page)
+            if not page.has_next:
+                break
+            query = self._follow(page.next_query)
+        self.assertEqual(seen, sorted(self.invoices, key=lambda invoice: (invoice.created_date, invoice.id)))
+
+    def test_previous_page(self):
+        first = self._page()
+        second = self._page(self._follow(first.next_query))
+        self.assertFalse(first.has_previous)
+        self.assertTrue(second.has_previous)
+        self.assertEqual(list(self._page(self._follow(second.previous_query))), list(first))
+
+    def test_filters(self):
+        page = self._page('invoices_status=CLOSED')
+        self.assertEqual({invoice.status for invoice in page}, {'CLOSED'})
+        self.assertIn('invoices_status=CLOSED', page.next_query)
+        self.assertEqual(len(self._page(self._follow(page.next_query))), 1)
+        self.assertEqual(len(self._page('invoices_status=')), 3)
+
+    def test_invalid_cursor_starts_from_first_page(self):
+        self.assertEqual(list(self._page('invoices_after=not-a-cursor')), list(self._page()))
+
+    def test_cursor_past_the_end_links_to_first_page(self):
+        last = self.invoices[-1]
+        page = self._page('invoices_after=' + encode_cursor([last.created_date, last.id]))
+        self.assertEqual(list(page), [])
+        self.assertEqual(page.previous_query, '?')
+
+    def test_query_count_does_not_grow_with_depth(self):
+        last = self.invoices[-2]
+        with CaptureQueriesContext(connection) as first:
+            self._page()
+        with CaptureQueriesContext(connection) as deep:
+            self._page('invoices_after=' + encode_cursor([last.created_date, last.id]))
+        self.assertEqual(len(first), 1)
+        self.assertEqual(len(deep), 1)
+        self.assertNotIn('OFFSET', deep[0]['sql'])
+
+    def test_admin_home_pages_each_table(self):
+        for _ in range(30):
+            Transaction.objects.create(amount=Decimal('1.00'), invoice=self.invoices[0], created_by=self.student)
+        self.client.login(email='admin@example.com', password='Password123')
+        response = self.client.get(reverse('admin_home'))
+        transactions = response.context['transactions']
+        self.assertEqual(len(transactions), 25)
+        self.assertTrue(transactions.has_next)
+        self.assertContains(response, 'transactions_after=')
+        response = self.client.get(reverse('admin_home') + transactions.next_query)
+        self.assertEqual(len(response.context['transactions']), 5)
+        self.assertEqual(len(response.context['invoices']), 7)
+
+    def test_admin_home_query_count_does_not_grow_with_rows(self):
+        self.client.login(email='admin@example.com', password='Password123')
+        with CaptureQueriesContext(connection) as small:
+            self.client.get(reverse('admin_home'))
+        for _ in range(30):
+            Request.objects.create(user=self.student, availability="MONDAYAM", number_of_lessons=10,
+                                   interval=1, duration=45, lesson_content="Singing")
+            Transaction.objects.create(amount=Decimal('1.00'), invoice=self.invoices[0], created_by=self.student)
+        with CaptureQueriesContext(connection) as large:
+            self.client.get(reverse('admin_home'))
+        self.assertEqual(len(small), len(large))
@@ -0,0 +1,113 @@
+import cProfile
+import os
+import pstats
+import tempfile
+
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from lessons import profiling
+from lessons.models import User
+
+
+def work(n):
+    return sum(range(n))
+
+
+def outer():
+    return work(200000) + inner()
+
+
+def inner():
+    return work(100000)
+
+
+class ProfilingTestCase(TestCase):
+    """Tests of on-demand request profiling"""
+
+    def setUp(self):
+        self.student = User.objects.create_user(email='student@example.com', password='Password123')
+        self.admin = User.objects.create_user(email='admin@example.com', password='Password123', is_staff=True)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings = override_settings(PROFILE_DIR=directory.name, PROFILE_SAMPLE_RATE=0)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def test_token_in_the_query_profiles_the_request(self):
+        self.client.login(email='student@example.com', password='Password123')
+        response = self.client.get(reverse('user_home'), {'profile': profiling.profile_token(self.admin)})
+        self.assertEqual(response.status_code, 200)
+        [record] = profiling.recent()
+        self.assertEqual(response.headers['X-Profile'], record['id'])
+        self.assertEqual((record['name'], record['status'], record['trigger']), ('user_home', 200, 'token'))
+        self.assertGreater(record['duration_ms'], 0)
+        stats = pstats.Stats(profiling.path_for(record['id'], 'pstats'))
+        self.assertTrue(any(name == 'user_home' for _, _, name in stats.stats))
+        with open(profiling.path_for(record['id'], 'collapsed')) as file:
+            self.assertIn('user_home (views.py:', file.read())
+
+    def test_token_in_the_header_profiles_the_request(self):
+        response = self.client.get(reverse('home'), HTTP_X_PROFILE=profiling.profile_token(self.admin))
+        self.assertIn('X-Profile', response.headers)
+        self.assertEqual(profiling.recent()[0]['name'], 'home')
+
+    def test_bad_token_does_not_profile(self):
+        response = self.client.get(reverse('home'), {'profile': f'{self.admin.pk}:forged:token'})
+        self.assertNotIn('X-Profile', response.headers)
+        self.assertEqual(profiling.recent(), [])
+
+    @override_settings(PROFILE_TOKEN_MAX_AGE=-1)
+    def test_expired_token_does_not_profile(self):
+        self.client.get(reverse('home'), {'profile': profiling.profile_token(self.admin)})
+        self.assertEqual(profiling.recent(), [])
+
+    @override_settings(PROFILE_SAMPLE_RATE=1)
+    def test_sampled_requests_are_profiled(self):
+        self.client.get(reverse('home'))
+        self.assertEqual(profiling.recent()[0]['trigger'], 'sample')
+
+    @override_settings(PROFILE_KEEP=2)
+    def test_keeps_the_newest_profiles(self):
+        token = profiling.profile_token(self.admin)
+        ids = [self.client.get(reverse('home'), {'profile': token}).headers['X-Profile'] for _ in range(3)]
+        self.assertEqual([record['id'] for record in profiling.recent()], sorted(ids, reverse=True)[:2])
+        self.assertEqual(len(os.listdir(profiling.settings.PROFILE_DIR)), 6)
+
+    def test_collapsed_stacks_share_time_between_callers(self):
+        profiler = cProfile.Profile()
+        profiler.enable()
+        outer()
+        profiler.disable()
+        spent = {}
+        for line in profiling.collapsed_stacks(pstats.Stats(profiler)):
+            stack, microseconds = line.rsplit(' ', 1)
+            if stack.endswith('builtins.sum>'):
+                caller, *_ = stack.split(';')[-3].split()
+                spent[caller] = int(microseconds)
+        # work() is called from both, with twice the range from outer()
+        self.assertEqual(set(spent), {'outer', 'inner'})
+        self.assertGreater(spent['outer'], spent['inner'])
+
+    def test_page_lists_profiles_for_staff(self):
+        self.client.login(email='admin@example.com', password='Password123')
+        self.client.get(reverse('user_home'), {'profile': profiling.profile_token(self.admin)})
+        response = self.client.get(reverse('profiles'))
+        self.assertContains(response, 'user_home')
+        self.assertContains(response, reverse('profile_file', args=[profiling.recent()[0]['id'], 'collapsed']))
+
+    def test_page_is_staff_only(self):
+        self.client.login(email='student@example.com', password='Password123')
+        response = self.client.get(reverse('profiles'))
+        self.assertEqual(response.status_code, 302)
+
+    def test_downloads_a_profile(self):
+        self.client.login(email='admin@example.com', password='Password123')
+        profile_id = self.client.get(reverse('home'), {'profile': profiling.profile_token(self.admin)}) \
+            .headers['X-Profile']
+        response = self.client.get(reverse('profile_file', args=[profile_id, 'pstats']))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(f'filename="{profile_id}.pstats"', response.headers['Content-Disposition'])
+        self.assertEqual(self.client.get(reverse('profile_file', args=[profile_id, 'json'])).status_code, 404)
+        self.assertEqual(self.client.get(reverse('profile_file', args=['20200101T000000-00000000', 'pstats']))
+                         .status_code, 404)
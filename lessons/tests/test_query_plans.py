@@ -0,0 +1,36 @@
+from django.test import TestCase
+
+from lessons.models import Request
+from lessons.query_plans import HOT_QUERIES, explain, full_scans, sorts
+
+
+class QueryPlanTestCase(TestCase):
+    """Tests that the hot queries are answered from indexes rather than by reading whole tables"""
+
+    def test_no_hot_query_scans_a_table(self):
+        for name, query in HOT_QUERIES.items():
+            with self.subTest(name):
+                self.assertEqual(full_scans(query()), [], explain(query()))
+
+    def test_pages_are_read_in_index_order(self):
+        # Sorting a whole table to return one page would undo the keyset pagination
+        for name, query in HOT_QUERIES.items():
+            if name.endswith('_page') or name == 'user_transactions':
+                with self.subTest(name):
+                    self.assertEqual(sorts(query()), [], explain(query()))
+
+    def test_partial_indexes_are_used(self):
+        self.assertIn('request_pending_idx', ' '.join(explain(HOT_QUERIES['pending_requests_page']())))
+        self.assertIn('request_user_approved_idx', ' '.join(explain(HOT_QUERIES['user_active_invoices']())))
+        self.assertIn('invoice_status_created_idx', ' '.join(explain(HOT_QUERIES['invoices_by_status_page']())))
+
+    def test_slot_queries_read_the_requests_of_one_approval_state(self):
+        pending = Request.objects.filter(isApproved=False).available_any('MONDAYAM', 'WEDNESDAYPM')
+        approved = Request.objects.filter(isApproved=True).available_all('MONDAYAM').values_list('request_id')
+        self.assertIn('request_pending_slots_idx', ' '.join(explain(pending)))
+        self.assertIn('request_approved_slots_idx', ' '.join(explain(approved)))
+        self.assertEqual(full_scans(pending), [], explain(pending))
+        self.assertEqual(full_scans(approved), [], explain(approved))
+
+    def test_full_scans_are_detected(self):
+        self.assertTrue(full_scans(Request.objects.filter(lesson_content='Piano')))
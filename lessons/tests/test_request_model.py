@@ -2,7 +2,7 @@ from django.test import TestCase
 from django.core.exceptions import ValidationError
 from lessons.models import Request, User, Child
 import datetime as dt
-from decimal import Decimal
+from lessons.money import Money
 
 class RequestModelTestCase(TestCase):
     """Tests of the Request Model"""
@@ -31,7 +31,7 @@ class RequestModelTestCase(TestCase):
         self.assertEquals(self.request.get_total_amount_payable(), 4500.0)
 
     def test_type_get_amount_payable(self):
-        self.assertIsInstance(self.request.get_total_amount_payable(), Decimal)
+        self.assertIsInstance(self.request.get_total_amount_payable(), Money)
         # self.assertEquals(self.request.get_total_amount_payable(), 4500.0)
 
     def test_user_is_same_as_user_entered(self):
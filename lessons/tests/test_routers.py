@@ -0,0 +1,85 @@
+import datetime as dt
+import io
+import os
+import sqlite3
+import tempfile
+from unittest import mock
+
+from django.core.management import call_command
+from django.db import connections
+from django.test import TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from lessons.models import ReplicaHeartbeat, Request, User
+from msms import routers
+
+
+@override_settings(REPLICA_ENABLED=True, REPLICA_VIEWS={'admin_home': 60}, REPLICA_REPORTING_MAX_LAG=60)
+class ReplicaRouterTestCase(TransactionTestCase):
+    """Tests of sending reporting reads to the replica, which mirrors the primary under test"""
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        routers._lag['checked'] = float('-inf')
+        self.admin = User.objects.create_user(email='admin@example.com', password='Password123', is_staff=True)
+        self.client.login(email='admin@example.com', password='Password123')
+
+    def _replica_queries(self, url):
+        with CaptureQueriesContext(connections['replica']) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return [query['sql'] for query in queries if 'lessons_replicaheartbeat' not in query['sql']]
+
+    def test_fresh_replica_serves_reporting_views(self):
+        ReplicaHeartbeat.stamp()
+        self.assertTrue(self._replica_queries(reverse('admin_home')))
+        self.assertEqual(routers.current_read_alias(), routers.PRIMARY)
+
+    def test_other_views_stay_on_the_primary(self):
+        ReplicaHeartbeat.stamp()
+        self.assertEqual(self._replica_queries(reverse('query_stats')), [])
+
+    def test_unsynced_or_lagging_replica_is_not_used(self):
+        self.assertEqual(self._replica_queries(reverse('admin_home')), [])
+        ReplicaHeartbeat.objects.create(pk=1, beat=timezone.now() - dt.timedelta(minutes=5))
+        routers._lag['checked'] = float('-inf')
+        self.assertEqual(self._replica_queries(reverse('admin_home')), [])
+
+    def test_writers_read_their_writes_from_the_primary(self):
+        ReplicaHeartbeat.stamp()
+        self.client.post(reverse('propose_timetable'))
+        self.assertIn(routers.PIN_COOKIE, self.client.cookies)
+        self.assertEqual(self._replica_queries(reverse('admin_home')), [])
+
+    def test_a_write_sends_later_reads_to_the_primary(self):
+        ReplicaHeartbeat.stamp()
+        self.assertTrue(routers.read_from_replica(60))
+        self.assertEqual(routers.ReplicaRouter().db_for_read(Request), routers.REPLICA)
+        self.assertEqual(routers.ReplicaRouter().db_for_write(Request), routers.PRIMARY)
+        self.assertEqual(routers.ReplicaRouter().db_for_read(Request), routers.PRIMARY)
+
+    def test_reporting_querysets(self):
+        self.assertEqual(routers.reporting(Request.objects.all()).db, routers.PRIMARY)
+        ReplicaHeartbeat.stamp()
+        routers._lag['checked'] = float('-inf')
+        self.assertEqual(routers.reporting(Request.objects.all()).db, routers.REPLICA)
+        self.assertEqual(routers.reporting(Request.objects.all(), max_lag=-1).db, routers.PRIMARY)
+
+    def test_replica_is_never_migrated(self):
+        self.assertFalse(routers.ReplicaRouter().allow_migrate(routers.REPLICA, 'lessons'))
+
+    def test_snapshot_copies_the_primary(self):
+        with tempfile.TemporaryDirectory() as directory:
+            primary, replica = os.path.join(directory, 'primary.sqlite3'), os.path.join(directory, 'replica.sqlite3')
+            with sqlite3.connect(primary) as connection:
+                connection.execute('CREATE TABLE t (x)')
+                connection.execute('INSERT INTO t VALUES (42)')
+            with mock.patch.dict(connections.databases['default'], {'NAME': primary}), \
+                    mock.patch.dict(connections.databases['replica'], {'NAME': replica}), \
+                    mock.patch.object(ReplicaHeartbeat, 'stamp') as stamp:
+                call_command('snapshot_replica', stdout=io.StringIO())
+            stamp.assert_called_once()
+            with sqlite3.connect(replica) as connection:
+                self.assertEqual(connection.execute('SELECT x FROM t').fetchall(), [(42,)])
@@ -0,0 +1,141 @@
+from decimal import Decimal
+from io import StringIO
+from unittest.mock import patch
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.db.models import Sum
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from lessons import seeding
+from lessons.ledger import rebuild_balances
+from lessons.models import Request, User, Child, Invoice, Lesson, Transaction, Job, InvoiceSequence, \
+    availability_mask
+from lessons.occurrences import build_lessons
+
+
+class SeedingTestCase(TestCase):
+    """Tests of the bulk seeder"""
+
+    def test_seeds_the_fixed_accounts(self):
+        seeding.seed(students=0, seed=1)
+        john_doe = User.objects.get(email='john.doe@example.org')
+        self.assertTrue(john_doe.check_password(seeding.PASSWORD))
+        self.assertTrue(User.objects.get(email='marty.major@example.org').is_superuser)
+        self.assertTrue(User.objects.get(email='petra.pickles@example.org').is_staff)
+        self.assertEqual(Child.objects.filter(parent=john_doe).count(), 2)
+        self.assertEqual(Invoice.objects.filter(request__user=john_doe).count(), 3)
+        self.assertEqual(User.objects.filter(is_staff=True, is_superuser=False).count(),
+                         seeding.PROFILES['small'].teachers)
+
+    def test_seeds_students_with_requests(self):
+        made = seeding.seed(students=40, seed=1, batch_size=15)
+        self.assertEqual(made['students'], 40)
+        self.assertEqual(made['children'], 40 - 40 // seeding.NO_CHILDREN_RATE)
+        self.assertEqual(made['requests'], 40 - 40 // seeding.REQUESTLESS_USER_RATE)
+        self.assertEqual(User.objects.filter(email__endswith='.39@example.org').count(), 1)
+        for request in Request.objects.all():
+            self.assertEqual(request.availability_mask, availability_mask(request.availability))
+
+    def test_approved_requests_have_invoices_and_lessons(self):
+        seeding.seed(students=40, seed=2, batch_size=15)
+        approved = Request.objects.filter(isApproved=True)
+        self.assertFalse(approved.filter(invoice=None).exists())
+        self.assertFalse(Invoice.objects.filter(request__isApproved=False).exists())
+        self.assertEqual(Lesson.objects.count(), approved.aggregate(total=Sum('number_of_lessons'))['total'])
+        request = approved.last()
+        self.assertEqual([(lesson.number, lesson.start, lesson.end) for lesson in build_lessons(request)],
+                         list(Lesson.objects.filter(request=request).order_by('number')
+                              .values_list('number', 'start', 'end')))
+
+    def test_balances_match_the_ledger(self):
+        seeding.seed(students=40, seed=3, batch_size=15)
+        self.assertEqual(rebuild_balances(commit=False), [])
+        self.assertTrue(Invoice.objects.filter(status='CLOSED').exists())
+
+    def test_same_seed_gives_same_data(self):
+        first, second = seeding.Seeder(seed=4), seeding.Seeder(seed=4)
+        self.assertEqual([first.student(n).email for n in range(5)], [second.student(n).email for n in range(5)])
+
+    def test_students_whose_ids_do_not_fit_an_invoice_number_are_not_approved(self):
+        seeder = seeding.Seeder(seed=5)
+        seeder.seed_accounts(3)
+        last_id = User.objects.order_by('pk').last().pk
+        with patch.object(seeding, 'MAX_INVOICED_USER_ID', last_id + 10):
+            made = seeder.seed_students(30)
+        students = Request.objects.filter(user__pk__gt=last_id, isApproved=True)
+        self.assertTrue(students.exists())
+        self.assertFalse(students.filter(user__pk__gt=last_id + 10).exists())
+        self.assertEqual(made['invoices'], students.count())
+
+    def test_query_count_grows_with_batches_not_students(self):
+        first = seeding.Seeder(seed=6)
+        first.seed_accounts(2)
+        query_counts = []
+        for seed, count in ((6, 10), (7, 40)):
+            seeder = seeding.Seeder(seed=seed)
+            seeder.teacher_ids = first.teacher_ids
+            with CaptureQueriesContext(connection) as queries:
+                seeder.seed_students(count, batch_size=50)
+            query_counts.append(len(queries))
+        self.assertEqual(query_counts[0], query_counts[1])
+
+    def test_command(self):
+        out = StringIO()
+        call_command('seed', '--students', '10', '--seed', '7', stdout=out)
+        self.assertIn("Seeded 10 students", out.getvalue())
+        with self.assertRaises(CommandError):
+            call_command('seed', '--students', '10', stdout=StringIO())
+
+
+class UnseedingTestCase(TestCase):
+    """Tests of clearing the seeded data"""
+
+    def setUp(self):
+        self.director = User.objects.create_superuser(email='director@example.org', password='Password123')
+        seeding.seed(students=30, seed=8)
+        Job.objects.create(kind=Job.BALANCE, user=User.objects.get(email='john.doe@example.org'))
+
+    def _assert_unseeded(self):
+        self.assertEqual(list(User.objects.all()), [self.director])
+        for model in (Lesson, Transaction, Invoice, Request, Child, Job, InvoiceSequence):
+            self.assertFalse(model.objects.exists(), model)
+
+    def test_unseed_keeps_only_real_superusers(self):
+        timings = seeding.unseed()
+        self._assert_unseeded()
+        counts = {table: count for table, count, _ in timings}
+        self.assertEqual(counts[User._meta.db_table], 30 + 4 + seeding.PROFILES['small'].teachers - 2)
+        self.assertEqual(counts[Job._meta.db_table], 1)
+
+    def test_unseed_recalculates_the_balances_of_the_users_kept(self):
+        request = Request.objects.create(user=self.director, availability="MONDAYAM", number_of_lessons=1,
+                                         interval=1, duration=30, lesson_content="Piano", isApproved=True)
+        Invoice.objects.create(invoice_number="0001-999", request=request, amount_to_be_paid=Decimal('15.00'))
+        seeding.unseed()
+        self.assertEqual(User.objects.get(pk=self.director.pk).balance, 0)
+
+    def test_unseed_deletes_in_batches(self):
+        with CaptureQueriesContext(connection) as queries:
+            seeding.unseed(batch_size=10)
+        self._assert_unseeded()
+        lessons_table = connection.ops.quote_name(Lesson._meta.db_table)
+        deletes = [query for query in queries if query['sql'].startswith(f'DELETE FROM {lessons_table}')]
+        self.assertGreater(len(deletes), 1)
+
+    def test_truncate_resets_sequences(self):
+        seeding.unseed(truncate=True)
+        self._assert_unseeded()
+        request = Request.objects.create(user=self.director, availability="MONDAYAM", number_of_lessons=1,
+                                         interval=1, duration=30, lesson_content="Piano")
+        self.assertEqual(request.pk, 1)
+        self.assertEqual(User.objects.create_user(email='next@example.org', password='Password123').pk, self.director.pk + 1)
+
+    def test_command(self):
+        out = StringIO()
+        call_command('unseed', stdout=out)
+        self._assert_unseeded()
+        self.assertRegex(out.getvalue(), rf"{Lesson._meta.db_table}: \d+ row\(s\) in")
+        self.assertIn("Done in", out.getvalue())
@@ -0,0 +1,100 @@
+from decimal import Decimal
+
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from lessons import selectors
+from lessons.models import Request, User, Child, Invoice, Transaction
+
+
+class SelectorQueryPlanTestCase(TestCase):
+    """Each table's queryset, and everything its template reads from the rows, costs one query"""
+
+    def setUp(self):
+        self.student = User.objects.create_user(email='student@example.com', password='Password123',
+                                                first_name='Sam', last_name='Student')
+        self.admin = User.objects.create_user(email='admin@example.com', password='Password123', is_staff=True)
+        self.count = 0
+
+    def _add_rows(self, count):
+        for _ in range(count):
+            self.count += 1
+            child = Child.objects.create(name=f'Child {self.count}', parent=self.student)
+            pending = Request.objects.create(user=self.student, child=child, availability="MONDAYAM",
+                                             number_of_lessons=10, interval=1, duration=45, lesson_content="Singing")
+            approved = Request.objects.create(user=self.student, availability="MONDAYAM", number_of_lessons=10,
+                                              interval=1, duration=45, lesson_content="Piano", isApproved=True)
+            invoice = Invoice.objects.create(request=approved, amount_to_be_paid=Decimal('100.00'),
+                                             invoice_number=f'0001-{self.count:03}')
+            Transaction.objects.create(amount=Decimal('1.00'), invoice=invoice, created_by=self.student)
+            Invoice.objects.create(request=pending, amount_to_be_paid=Decimal('100.00'),
+                                   invoice_number=f'0002-{self.count:03}')
+
+    def _read_requests(self, requests):
+        return [(request.request_id, request.child.name if request.child else None, request.user.first_name,
+                 request.user.last_name, request.lesson_content, request.submission_date, request.availability)
+                for request in requests]
+
+    def _read_invoices(self, invoices):
+        return [(invoice.invoice_number, str(invoice.request.user), invoice.request.request_id,
+                 invoice.amount_to_be_paid, invoice.created_date, invoice.status) for invoice in invoices]
+
+    def _read_transactions(self, transactions):
+        return [(str(transaction.created_by), transaction.invoice.invoice_number, transaction.amount,
+                 transaction.date_paid) for transaction in transactions]
+
+    def _read_users(self, users):
+        return [(user.id, user.email, user.first_name, user.last_name, user.balance, user.is_staff,
+                 user.is_superuser) for user in users]
+
+    def _assert_one_query(self, build, read):
+        for count in (1, 5):
+            self._add_rows(count)
+            with self.assertNumQueries(1):
+                rows = read(build())
+            self.assertTrue(rows)
+
+    def test_pending_requests(self):
+        self._assert_one_query(selectors.pending_requests, self._read_requests)
+
+    def test_approved_requests(self):
+        self._assert_one_query(lambda: selectors.approved_requests(user=self.student), self._read_requests)
+
+    def test_invoices_table(self):
+        self._assert_one_query(selectors.invoices_table, self._read_invoices)
+
+    def test_student_invoices_only_include_approved_requests(self):
+        self._add_rows(2)
+        invoices = selectors.invoices_table(user=self.student, status='ACTIVE')
+        self.assertEqual({invoice.invoice_number for invoice in invoices}, {'0001-001', '0001-002'})
+
+    def test_transactions_table(self):
+        self._assert_one_query(lambda: selectors.transactions_table(user=self.student), self._read_transactions)
+
+    def test_users_table(self):
+        self._assert_one_query(selectors.users_table, self._read_users)
+        self.assertNotIn(self.admin, selectors.users_table(students_only=True))
+
+    def test_children_table(self):
+        self._assert_one_query(lambda: selectors.children_table(self.student),
+                               lambda children: [(child.id, child.name) for child in children])
+
+    def test_pages_query_count_does_not_grow_with_rows(self):
+        self._add_rows(1)
+        pages = [('student@example.com', reverse('user_home')),
+                 ('admin@example.com', reverse('view_student', kwargs={'user_id': self.student.id})),
+                 ('admin@example.com', reverse('admin_home'))]
+        small = {}
+        for email, url in pages:
+            self.client.login(email=email, password='Password123')
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(self.client.get(url).status_code, 200)
+            small[url] = len(queries)
+        self._add_rows(5)
+        for email, url in pages:
+            self.client.login(email=email, password='Password123')
+            with CaptureQueriesContext(connection) as queries:
+                self.client.get(url)
+            self.assertEqual(len(queries), small[url], url)
@@ -0,0 +1,57 @@
+import io
+
+from django.core.management import call_command
+from django.db import DEFAULT_DB_ALIAS, connection, connections
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+
+from lessons.middleware import QueryCountMiddleware
+from lessons.sqlite import pragma_statements
+
+
+class SQLitePragmaTestCase(TestCase):
+    """Tests of tuning new SQLite connections"""
+
+    def _pragma(self, name):
+        with connection.cursor() as cursor:
+            cursor.execute(f'PRAGMA {name}')
+            return cursor.fetchone()[0]
+
+    def test_connection_is_tuned(self):
+        self.assertEqual(self._pragma('synchronous'), 1)  # NORMAL
+        self.assertEqual(self._pragma('temp_store'), 2)  # MEMORY
+        self.assertEqual(self._pragma('busy_timeout'), 5000)
+        self.assertEqual(self._pragma('cache_size'), -64000)
+
+    def test_tuning_is_not_counted_as_queries_of_the_request(self):
+        # Without persistent connections, each request opens a new one
+        fresh = connections.create_connection(DEFAULT_DB_ALIAS)
+        self.addCleanup(connections.__setitem__, DEFAULT_DB_ALIAS, connections[DEFAULT_DB_ALIAS])
+        connections[DEFAULT_DB_ALIAS] = fresh
+
+        def view(request):
+            with fresh.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            return HttpResponse()
+
+        request = RequestFactory().get('/')
+        QueryCountMiddleware(view)(request)
+        self.assertEqual(request.query_recorder.count, 1)
+
+
+class PragmaStatementTestCase(SimpleTestCase):
+    def test_busy_timeout_comes_first(self):
+        statements = list(pragma_statements({'journal_mode': 'WAL', 'busy_timeout': 100}))
+        self.assertEqual(statements, ['PRAGMA busy_timeout = 100', 'PRAGMA journal_mode = WAL'])
+
+    def test_rejects_anything_but_a_name_and_value(self):
+        with self.assertRaises(ValueError):
+            list(pragma_statements({'journal_mode': 'WAL; DROP TABLE lessons_user'}))
+
+    @override_settings(SQLITE_PRAGMAS={'synchronous': 'NORMAL'})
+    def test_benchmark_runs(self):
+        out = io.StringIO()
+        call_command('benchmark_sqlite', '--seconds', '0.1', '--rows', '100', '--readers', '2', '--writers', '1',
+                     stdout=out)
+        self.assertIn('defaults', out.getvalue())
+        self.assertIn('tuned', out.getvalue())
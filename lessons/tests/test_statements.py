@@ -0,0 +1,119 @@
+import io
+import os
+import tempfile
+from decimal import Decimal
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from lessons.statements import import_statement
+from lessons.models import Request, User, Invoice, Transaction, UnmatchedPayment
+
+
+class StatementImportTestCase(TestCase):
+    """Tests of importing bank statements"""
+
+    def setUp(self):
+        self.student = User.objects.create_user(email='student@example.com', password='Password123')
+        self.admin = User.objects.create_user(email='admin@example.com', password='Password123', is_staff=True)
+        self.invoices = []
+        for i in range(1, 4):
+            request = Request.objects.create(user=self.student, availability="MONDAYAM", number_of_lessons=10,
+                                             interval=1, duration=45, lesson_content="Singing", isApproved=True)
+            self.invoices.append(Invoice.objects.create(request=request, amount_to_be_paid=Decimal('100.00'),
+                                                        invoice_number=f'0001-00{i}'))
+
+    def _statement(self, *lines):
+        return io.StringIO("Date,Amount,Reference\n" + "\n".join(lines) + "\n")
+
+    def test_matches_payments_to_invoices(self):
+        counts = import_statement(self._statement(
+            "2023-01-10,100.00,INV 0001-001",
+            "10/01/2023,40.00,0001-002 lessons",
+        ), administrated_by=self.admin)
+        self.assertEqual(counts, {'matched': 2, 'closed': 1, 'unmatched': 0})
+        payment = Transaction.objects.get(invoice=self.invoices[1])
+        self.assertEqual(payment.amount, Decimal('40.00'))
+        self.assertEqual(payment.created_by, self.student)
+        self.assertEqual(payment.administrated_by, self.admin)
+
+    def test_closes_invoices_that_are_paid_off(self):
+        Transaction.objects.create(amount=Decimal('60.00'), invoice=self.invoices[1], created_by=self.student)
+        import_statement(self._statement(
+            "2023-01-10,100.00,0001-001",
+            "2023-01-10,40.00,0001-002",
+            "2023-01-10,99.99,0001-003",
+        ))
+        statuses = list(Invoice.objects.order_by('invoice_number').values_list('status', flat=True))
+        self.assertEqual(statuses, ['CLOSED', 'CLOSED', 'ACTIVE'])
+
+    def test_invoices_without_an_amount_stay_active(self):
+        Invoice.objects.filter(pk=self.invoices[0].pk).update(amount_to_be_paid=None)
+        counts = import_statement(self._statement(
+            "2023-01-10,100.00,0001-001",
+            "2023-01-10,100.00,0001-002",
+        ))
+        self.assertEqual(counts, {'matched': 2, 'closed': 1, 'unmatched': 0})
+        statuses = list(Invoice.objects.order_by('invoice_number').values_list('status', flat=True))
+        self.assertEqual(statuses, ['ACTIVE', 'CLOSED', 'ACTIVE'])
+
+    def test_updates_balance(self):
+        import_statement(self._statement("2023-01-10,100.00,0001-001"))
+        self.assertEqual(User.objects.get(pk=self.student.pk).balance, Decimal('200.00'))
+
+    def test_unmatched_lines_go_to_review(self):
+        counts = import_statement(self._statement(
+            "2023-01-10,100.00,no reference",
+            "2023-01-10,100.00,9999-999",
+            "not a date,100.00,0001-001",
+            "2023-01-10,lots,0001-001",
+            "2023-01-10,-5.00,0001-001",
+        ))
+        self.assertEqual(counts['unmatched'], 5)
+        self.assertFalse(Transaction.objects.exists())
+        self.assertEqual(list(UnmatchedPayment.objects.order_by('line_number').values_list('reason', flat=True)),
+                         ["No invoice number", "Unknown invoice", "Invalid date", "Invalid amount", "Not a payment"])
+
+    def test_query_count_does_not_grow_with_lines(self):
+        lines = [f"2023-01-10,0.01,0001-00{i % 3 + 1}" for i in range(150)]
+        with CaptureQueriesContext(connection) as small:
+            import_statement(self._statement(*lines[:15]))
+        with CaptureQueriesContext(connection) as large:
+            import_statement(self._statement(*lines))
+        self.assertEqual(len(small), len(large))
+
+    def test_ofx_statement(self):
+        statement = io.StringIO(
+            "OFXHEADER:100\n<OFX><BANKMSGSRSV1><STMTTRNRS><STMTRS><BANKTRANLIST>\n"
+            "<STMTTRN>\n<TRNTYPE>CREDIT\n<DTPOSTED>20230110120000\n<TRNAMT>100.00\n<MEMO>0001-001\n</STMTTRN>\n"
+            "<STMTTRN><TRNTYPE>CREDIT<DTPOSTED>20230111<TRNAMT>20.00<NAME>Unknown</STMTTRN>\n"
+            "</BANKTRANLIST></STMTRS></STMTTRNRS></BANKMSGSRSV1></OFX>\n"
+        )
+        counts = import_statement(statement, 'ofx')
+        self.assertEqual(counts, {'matched': 1, 'closed': 1, 'unmatched': 1})
+
+    def test_upload_view(self):
+        self.client.login(email='admin@example.com', password='Password123')
+        upload = SimpleUploadedFile('statement.csv', b"Date,Amount,Reference\n2023-01-10,100.00,0001-001\n")
+        response = self.client.post(reverse('import_statement'), {'statement': upload, 'statement_format': 'csv'},
+                                    follow=True)
+        self.assertRedirects(response, reverse('import_statement'))
+        self.assertContains(response, "Recorded 1 payment(s)")
+        self.assertEqual(Transaction.objects.get().administrated_by, self.admin)
+
+    def test_upload_view_is_staff_only(self):
+        self.client.login(email='student@example.com', password='Password123')
+        self.assertEqual(self.client.get(reverse('import_statement')).status_code, 302)
+
+    def test_command(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'statement.csv')
+            with open(path, 'w') as statement:
+                statement.write("Date,Amount,Reference\n2023-01-10,100.00,0001-001\n")
+            out = io.StringIO()
+            call_command('import_statement', path, '--admin', 'admin@example.com', stdout=out)
+        self.assertIn("Recorded 1 payment(s), closed 1 invoice(s)", out.getvalue())
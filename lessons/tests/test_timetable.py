@@ -0,0 +1,169 @@
+import datetime as dt
+import io
+import random
+
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from lessons.conflicts import ConflictIndex
+from lessons.models import Request, User
+from lessons.timetable import Pending, candidate_slots, minute_mask, propose_timetable, solve
+
+
+class SolverTestCase(SimpleTestCase):
+    """Tests of the timetable solver on requests held in memory"""
+
+    def _masks(self, pending, assigned):
+        durations = {request.request_id: request.duration for request in pending}
+        for request_id, (teacher_id, class_day, class_time) in assigned.items():
+            [mask] = [mask for day, time, mask in candidate_slots([class_day + 'AM', class_day + 'PM'],
+                                                                   durations[request_id]) if time == class_time]
+            yield (teacher_id, class_day), mask
+
+    def assertNoDoubleBookings(self, pending, assigned):
+        busy = {}
+        for key, mask in self._masks(pending, assigned):
+            self.assertFalse(busy.get(key, 0) & mask)
+            busy[key] = busy.get(key, 0) | mask
+
+    def test_candidate_slots_stay_within_the_half_day(self):
+        slots = candidate_slots(['TUESDAYAM'], 90)
+        self.assertEqual([(day, time) for day, time, _ in slots], [('TUESDAY', dt.time(8)), ('TUESDAY', dt.time(9)),
+                                                                   ('TUESDAY', dt.time(10))])
+        self.assertEqual(candidate_slots(['MONDAYAM'], 300), [])
+
+    def test_proposals_respect_availability(self):
+        pending = [Pending(1, ['WEDNESDAYPM'], 60, None)]
+        assigned, left_over = solve(pending, [10])
+        self.assertEqual(assigned, {1: (10, 'WEDNESDAY', dt.time(13))})
+        self.assertEqual(left_over, [])
+
+    def test_existing_commitments_are_kept_clear_of(self):
+        pending = [Pending(1, ['MONDAYAM'], 60, None)]
+        assigned, _ = solve(pending, [10], [(10, 'MONDAY', dt.time(8), 90)])
+        self.assertEqual(assigned, {1: (10, 'MONDAY', dt.time(10))})
+
+    def test_load_is_spread_over_teachers(self):
+        pending = [Pending(request_id, ['MONDAYAM'], 60, None) for request_id in range(4)]
+        assigned, _ = solve(pending, [10, 11])
+        self.assertEqual(sorted(teacher for teacher, _, _ in assigned.values()), [10, 10, 11, 11])
+        self.assertNoDoubleBookings(pending, assigned)
+
+    def test_preferred_teacher_is_kept(self):
+        pending = [Pending(1, ['MONDAYAM'], 60, 11), Pending(2, ['MONDAYAM'], 60, 12)]
+        assigned, left_over = solve(pending, [10, 11])
+        self.assertEqual(assigned[1][0], 11)
+        # Teacher 12 is not on the staff, so request 2 cannot be placed
+        self.assertEqual(left_over, [2])
+
+    def test_blocking_proposal_is_moved_to_make_room(self):
+        pending = [Pending(1, ['MONDAYAM', 'FRIDAYAM'], 240, None),
+                   Pending(2, ['TUESDAYAM', 'SATURDAYAM'], 240, None),
+                   Pending(3, ['MONDAYAM', 'TUESDAYAM'], 60, None)]
+        # Placed greedily, the two long lessons fill Monday and Tuesday mornings and leave no room for the third
+        assigned, left_over = solve(pending, [10])
+        self.assertEqual(left_over, [])
+        self.assertEqual(assigned[3], (10, 'MONDAY', dt.time(8)))
+        self.assertEqual(assigned[1], (10, 'FRIDAY', dt.time(8)))
+        self.assertNoDoubleBookings(pending, assigned)
+
+    def test_requests_that_cannot_fit_are_left_over(self):
+        pending = [Pending(request_id, ['SUNDAYAM'], 240, None) for request_id in range(3)]
+        assigned, left_over = solve(pending, [10, 11])
+        self.assertEqual(len(assigned), 2)
+        self.assertEqual(len(left_over), 1)
+
+    def test_thousands_of_requests(self):
+        rng = random.Random(0)
+        codes = [code for code, _ in Request.AVAILABILITY_CHOICES]
+        pending = [Pending(request_id, rng.sample(codes, rng.randrange(1, 5)), rng.choice([30, 45, 60]), None)
+                   for request_id in range(3000)]
+        assigned, left_over = solve(pending, list(range(40)))
+        self.assertEqual(len(assigned) + len(left_over), 3000)
+        self.assertNoDoubleBookings(pending, assigned)
+
+    def test_minute_mask(self):
+        self.assertEqual(minute_mask(2, 5), 0b11100)
+
+
+class ProposeTimetableTestCase(TestCase):
+    """Tests of proposing a timetable for the pending requests in the database"""
+
+    def setUp(self):
+        self.student = User.objects.create_user(email='student@example.com', password='Password123')
+        self.admin = User.objects.create_user(email='admin@example.com', password='Password123', is_staff=True)
+        self.start = timezone.make_aware(dt.datetime(2023, 1, 9))
+        self.booked = Request.objects.create(user=self.student, availability="MONDAYAM", number_of_lessons=10,
+                                             interval=1, duration=60, lesson_content="Singing", isApproved=True,
+                                             teacher=self.admin, class_Day='MONDAY', class_Time=dt.time(8),
+                                             start_Date=self.start)
+        self.pending = Request.objects.create(user=self.student, availability="MONDAYAM", number_of_lessons=10,
+                                              interval=1, duration=60, lesson_content="Piano")
+
+    def test_proposals_avoid_lessons_still_running(self):
+        proposals, left_over = propose_timetable(dt.date(2023, 1, 9))
+        self.assertEqual(left_over, [])
+        [proposal] = proposals
+        self.assertEqual((proposal.request_id, proposal.teacher_id, proposal.class_Day, proposal.class_Time),
+                         (self.pending.request_id, self.admin.id, 'MONDAY', dt.time(9)))
+        self.assertEqual(proposal.start_Date, self.start)
+        index = ConflictIndex.for_teachers([self.admin.id])
+        self.assertEqual(index.conflicts(self.admin.id, 'MONDAY', proposal.class_Time, 60, self.start, 10, 1), [])
+
+    def test_finished_lessons_free_the_slot(self):
+        proposals, _ = propose_timetable(dt.date(2024, 1, 1))
+        self.assertEqual(proposals[0].class_Time, dt.time(8))
+
+    def test_button_fills_in_bulk_approval(self):
+        self.client.login(email='admin@example.com', password='Password123')
+        response = self.client.post(reverse('propose_timetable'), {'start_date': '2023-01-09'})
+        self.assertRedirects(response, reverse('bulk_approve') + '?proposed=1')
+        response = self.client.get(reverse('bulk_approve') + '?proposed=1')
+        [form] = response.context['formset'].forms
+        self.assertEqual(form.initial['request_id'], self.pending.request_id)
+        self.assertTrue(form.initial['selected'])
+        self.assertEqual(form.initial['teacher'], self.admin.id)
+        self.assertEqual(form.initial['class_Time'], '09:00:00')
+        self.assertContains(response, '<option value="09:00:00" selected>', html=False)
+
+    def test_proposed_page_only_lists_proposals(self):
+        self.client.login(email='admin@example.com', password='Password123')
+        self.client.post(reverse('propose_timetable'), {'start_date': '2023-01-09'})
+        Request.objects.create(user=self.student, availability="MONDAYAM", number_of_lessons=10, interval=1,
+                               duration=60, lesson_content="Drums")
+        response = self.client.get(reverse('bulk_approve') + '?proposed=1')
+        self.assertEqual([form.initial['request_id'] for form in response.context['formset'].forms],
+                         [self.pending.request_id])
+        self.assertContains(response, 'name="approveProposals"')
+
+    def test_approves_all_proposals_server_side(self):
+        self.client.login(email='admin@example.com', password='Password123')
+        self.client.post(reverse('propose_timetable'), {'start_date': '2023-01-09'})
+        response = self.client.post(reverse('bulk_approve'), {'approveProposals': 'Approve all proposals'})
+        self.assertRedirects(response, reverse('admin_home'), status_code=302, target_status_code=200)
+        self.pending.refresh_from_db()
+        self.assertTrue(self.pending.isApproved)
+        self.assertEqual((self.pending.teacher_id, self.pending.class_Day, self.pending.class_Time,
+                          self.pending.start_Date), (self.admin.id, 'MONDAY', dt.time(9), self.start))
+        self.assertNotIn('timetable_proposals', self.client.session)
+
+    def test_plain_bulk_approval_ignores_old_proposals(self):
+        self.client.login(email='admin@example.com', password='Password123')
+        self.client.post(reverse('propose_timetable'), {'start_date': '2023-01-09'})
+        response = self.client.get(reverse('bulk_approve'))
+        self.assertFalse(response.context['formset'].forms[0].initial['selected'])
+
+    def test_button_is_staff_only(self):
+        self.client.login(email='student@example.com', password='Password123')
+        self.client.post(reverse('propose_timetable'))
+        self.assertNotIn('timetable_proposals', self.client.session)
+
+    def test_command_approves_proposals(self):
+        out = io.StringIO()
+        call_command('propose_timetable', '--start-date', '2023-01-09', '--approve', stdout=out)
+        self.assertIn("Approved 1 request(s).", out.getvalue())
+        self.pending.refresh_from_db()
+        self.assertTrue(self.pending.isApproved)
+        self.assertEqual((self.pending.class_Day, self.pending.class_Time), ('MONDAY', dt.time(9)))
@@ -0,0 +1,215 @@
+"""
+Automatic timetabling of pending requests.
+
+propose_timetable() assigns each pending request a teacher, class_Day and
+class_Time within one of the half-day slots of its availability, without
+double-booking any teacher. It accounts for the teachers' existing approved
+lessons and for each other's proposals.
+
+Each teacher's days are bitmasks with one bit per minute, so checking whether
+a teacher is free for a lesson is a single AND. Requests are placed most
+constrained first: those with the fewest available half-days, then the
+longest lessons. Each goes to the least loaded free teacher at the earliest
+start time that fits. A request left without a slot then gets one repair
+attempt, as in augmenting-path matching. If the request is blocked by a
+single proposal for some teacher and start time, that proposal is moved
+elsewhere to make room for it. A proposal that could not be moved once is
+not tried again, which keeps a heavily oversubscribed run from rescanning
+every teacher's full week for each request that does not fit. 10,000
+requests over 40 teachers take about two seconds.
+
+The result is a list of proposals to review on the bulk approval page, not
+approvals. A request that asked for a particular teacher is only placed
+with that teacher.
+"""
+import datetime as dt
+from collections import defaultdict, namedtuple
+
+from django.utils import timezone
+
+from lessons.conflicts import DAY_MINUTES, term, weekly_slot
+from lessons.models import Request, User, availability_codes
+from lessons.occurrences import WEEKDAYS
+
+# The hours each half-day of availability covers: lessons start on the hour and finish by the end
+HALF_DAYS = {'AM': (8, 12), 'PM': (13, 18)}
+
+Pending = namedtuple('Pending', ['request_id', 'availability', 'duration', 'teacher_id'])
+DAYS = [day for day, _ in Request.DAY_CHOICES]
+# How many proposals may be tried moving to make room for each request left without a slot
+REPAIR_ATTEMPTS = 20
+
+Proposal = namedtuple('Proposal', ['request_id', 'teacher_id', 'class_Day', 'class_Time', 'start_Date'])
+
+
+def minute_mask(start, end):
+    """A bitmask of the minutes [start, end) of a day"""
+    return ((1 << (end - start)) - 1) << start
+
+
+def candidate_slots(availability, duration):
+    """Every (class_Day, class_Time, mask) a lesson of duration minutes fits in, earliest in the week first"""
+    slots = []
+    for code in availability:
+        code = code.strip()
+        day, half = code[:-2], code[-2:]
+        if day not in WEEKDAYS or half not in HALF_DAYS:
+            continue
+        first_hour, last_hour = HALF_DAYS[half]
+        for hour in range(first_hour, last_hour):
+            if hour * 60 + duration <= last_hour * 60:
+                slots.append((day, dt.time(hour), minute_mask(hour * 60, hour * 60 + duration)))
+    return sorted(slots, key=lambda slot: (WEEKDAYS[slot[0]], slot[1]))
+
+
+class Timetable:
+    """
+    The busy minutes of each teacher, one bitmask per teacher and day.
+    Fixed commitments are kept apart from this run's proposals, which can still be moved.
+    """
+
+    def __init__(self, teacher_ids):
+        self.teachers = list(teacher_ids)
+        self.fixed = defaultdict(int)
+        self.busy = defaultdict(int)
+        self.load = {teacher_id: 0 for teacher_id in self.teachers}
+        self.placed = defaultdict(dict)  # (teacher id, day) -> request id -> slot
+        self.stuck = set()  # proposals that had nowhere else to go when a repair tried to move them
+        self.movable = defaultdict(int)  # (teacher id, day) -> number of its proposals not stuck
+
+    def commit(self, teacher_id, class_day, class_time, duration):
+        """Mark an existing lesson as fixed, carrying lessons that run past midnight over to the next day"""
+        start, end = weekly_slot(class_day, class_time, duration)
+        while start < end:
+            day_start = start - start % DAY_MINUTES
+            stop = min(end, day_start + DAY_MINUTES)
+            key = (teacher_id, DAYS[day_start // DAY_MINUTES % 7])
+            self.fixed[key] |= minute_mask(start - day_start, stop - day_start)
+            self.busy[key] |= self.fixed[key]
+            start = stop
+        self.load[teacher_id] += duration
+
+    def place(self, request, teacher_id, slot):
+        key = (teacher_id, slot[0])
+        self.busy[key] |= slot[2]
+        self.load[teacher_id] += request.duration
+        self.placed[key][request.request_id] = slot
+        self.movable[key] += request.request_id not in self.stuck
+
+    def remove(self, request, teacher_id, day):
+        key = (teacher_id, day)
+        self.placed[key].pop(request.request_id)
+        self.movable[key] -= request.request_id not in self.stuck
+        self.busy[key] = self.fixed[key]
+        for _, _, mask in self.placed[key].values():
+            self.busy[key] |= mask
+        self.load[teacher_id] -= request.duration
+
+    def teachers_for(self, request):
+        if request.teacher_id is not None:
+            return [request.teacher_id] if request.teacher_id in self.load else []
+        return self.teachers
+
+    def first_fit(self, request, slots):
+        """Place request in its earliest slot with a free teacher, choosing the least loaded one"""
+        teachers = self.teachers_for(request)
+        busy, load = self.busy, self.load
+        for slot in slots:
+            day, _, mask = slot
+            free = [teacher_id for teacher_id in teachers if not busy[teacher_id, day] & mask]
+            if free:
+                teacher_id = min(free, key=lambda teacher: (load[teacher], teacher))
+                self.place(request, teacher_id, slot)
+                return teacher_id, slot
+        return None
+
+    def repair(self, request, slots, requests, all_slots):
+        """
+        Place request by moving the single proposal that blocks one of its slots somewhere else.
+        At most REPAIR_ATTEMPTS moves are tried, so requests that cannot fit in do not hold up the run.
+        """
+        attempts = 0
+        for slot in slots:
+            day, _, mask = slot
+            for teacher_id in self.teachers_for(request):
+                key = (teacher_id, day)
+                if not self.movable[key] or self.fixed[key] & mask:
+                    continue
+                blockers = [request_id for request_id, (_, _, other) in self.placed[key].items() if other & mask]
+                if len(blockers) != 1:
+                    continue
+                blocker = requests[blockers[0]]
+                if blocker.request_id in self.stuck:
+                    continue
+                old_slot = self.placed[key][blocker.request_id]
+                self.remove(blocker, teacher_id, day)
+                self.place(request, teacher_id, slot)
+                moved = self.first_fit(blocker, all_slots[blocker.request_id])
+                if moved is not None:
+                    return {request.request_id: (teacher_id, slot), blocker.request_id: moved}
+                self.remove(request, teacher_id, day)
+                self.place(blocker, teacher_id, old_slot)
+                self.stuck.add(blocker.request_id)
+                self.movable[key] -= 1
+                attempts += 1
+                if attempts == REPAIR_ATTEMPTS:
+                    return None
+        return None
+
+
+def solve(pending, teacher_ids, commitments=()):
+    """
+    Assign pending requests to teachers and weekly slots.
+    commitments are the (teacher id, class_Day, class_Time, duration) of lessons already booked.
+    Returns a dict of request id to (teacher id, class_Day, class_Time), and the ids of the requests left over.
+    """
+    timetable = Timetable(teacher_ids)
+    for teacher_id, class_day, class_time, duration in commitments:
+        if teacher_id in timetable.load:
+            timetable.commit(teacher_id, class_day, class_time, duration)
+
+    requests = {request.request_id: request for request in pending}
+    slots = {request.request_id: candidate_slots(request.availability, request.duration) for request in pending}
+    order = sorted(pending, key=lambda request: (len(request.availability), -request.duration, request.request_id))
+    assigned, unscheduled = {}, []
+    for request in order:
+        placed = timetable.first_fit(request, slots[request.request_id])
+        if placed is not None:
+            assigned[request.request_id] = placed
+        else:
+            unscheduled.append(request)
+
+    left_over = []
+    for request in unscheduled:
+        moved = timetable.repair(request, slots[request.request_id], requests, slots)
+        if moved is None:
+            left_over.append(request.request_id)
+        else:
+            assigned.update(moved)
+    return {request_id: (teacher_id, slot[0], slot[1]) for request_id, (teacher_id, slot) in assigned.items()}, \
+        sorted(left_over)
+
+
+def propose_timetable(start_date=None):
+    """
+    Propose a teacher and weekly slot for every pending request, for lessons starting from start_date
+    (today by default). Lessons already approved that are still running by then are kept clear of.
+    Returns a list of Proposals and the ids of the pending requests that could not be fitted in.
+    """
+    start_date = start_date or timezone.localdate()
+    teacher_ids = list(User.objects.filter(is_staff=True, is_active=True).values_list('pk', flat=True))
+    pending = [Pending(request_id, availability_codes(mask), duration, teacher_id)
+               for request_id, mask, duration, teacher_id in
+               Request.objects.filter(isApproved=False).values_list('request_id', 'availability_mask', 'duration',
+                                                                    'teacher_id').iterator()]
+    commitments = [(teacher_id, class_day, class_time, duration)
+                   for teacher_id, class_day, class_time, duration, start, lessons, interval in
+                   Request.objects.filter(isApproved=True, teacher__in=teacher_ids).values_list(
+                       'teacher_id', 'class_Day', 'class_Time', 'duration', 'start_Date', 'number_of_lessons',
+                       'interval').iterator()
+                   if term(start, class_day, lessons, interval)[1] >= start_date]
+    assigned, left_over = solve(pending, teacher_ids, commitments)
+    start = timezone.make_aware(dt.datetime.combine(start_date, dt.time.min))
+    proposals = [Proposal(request_id, teacher_id, class_day, class_time, start)
+                 for request_id, (teacher_id, class_day, class_time) in sorted(assigned.items())]
+    return proposals, left_over
@@ -1,13 +1,31 @@
+import datetime as dt
+import io
+
+from django.conf import settings
 from django.contrib import messages
 from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth import login, authenticate, get_user, logout
 from django.contrib.auth.decorators import user_passes_test, login_required
 from django.contrib.auth.models import AnonymousUser
+from django.core.exceptions import PermissionDenied, ValidationError
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseBadRequest, StreamingHttpResponse
 from django.shortcuts import render, redirect
 from django.urls import reverse
-from lessons import forms
-from .models import Request, User, Child, Invoice, Transaction
-from decimal import Decimal
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.dateparse import parse_date
+from django.utils.http import http_date
+from lessons import approvals, caching, calendars, exports, forms, metrics, middleware, pagination, profiling, \
+    selectors, statements, timetable
+from .models import Request, User, Child, Invoice, InvoiceSequence, UnmatchedPayment
+
+# Query string filters for the request tables on the dashboards
+REQUEST_FILTERS = {'content': 'lesson_content', 'student': 'user__email'}
+# Where propose_timetable leaves its proposals for the bulk approval page to pick up
+PROPOSALS_SESSION_KEY = 'timetable_proposals'
+# Rows on a page of the bulk approval formset. Each row posts six fields, so a page stays well under
+# settings.DATA_UPLOAD_MAX_NUMBER_FIELDS (1000 by default) however many requests are pending.
+BULK_APPROVE_PER_PAGE = 100
 
 
 # Create your views here.
@@ -68,24 +86,21 @@ def edit_user(req, user_id):
 
 
 def view_student(req, user_id):
-    users = User.objects.filter(is_active=True)
+    # Invoices and balances are kept up to date by the ledger and the job queue, so this view only reads
     student_to_view = User.objects.get(id=user_id)
-    student_to_view.generateInvoices()
-    student_to_view.updateBalance()
-    approved = Request.objects.filter(isApproved=True, user_id=student_to_view)
-    pending = Request.objects.filter(isApproved=False, user_id=student_to_view)
-    invoices = Invoice.objects.filter(request__isApproved=True, request__user=student_to_view)
+    # The querysets are lazy, so tables served from the fragment cache are not queried
+    approved = selectors.approved_requests(user=student_to_view)
+    pending = selectors.pending_requests(user=student_to_view)
+    invoices = selectors.invoices_table(user=student_to_view)
     # active_invoices = Invoice.objects.filter(request__isApproved=True, request__user=student_to_view, status='ACTIVE')
-    transactions = Transaction.objects.filter(created_by=student_to_view)
-    # Update balance in user model
-    balance = calculateUserBalance(invoices, transactions)
+    transactions = selectors.transactions_table(user=student_to_view)
     return render(req, 'see_more_student.html', {'user': {
         'id': student_to_view.id, 'email': student_to_view.email, 'first_name': student_to_view.first_name,
         'last_name': student_to_view.last_name,
         'balance': '£' + str(student_to_view.balance)}, 'approved': approved, 'pending': pending,
-        'children': Child.objects.filter(parent=student_to_view),
-        'invoices': invoices, 'balance': '£' + str(balance),
-        'transactions': transactions})
+        'children': selectors.children_table(student_to_view),
+        'invoices': invoices, 'balance': '£' + str(student_to_view.balance),
+        'transactions': transactions, **caching.fragment_context(caching.user_scope(student_to_view.id))})
 
 
 def log_out(req):
@@ -94,30 +109,18 @@ def log_out(req):
 
 
 def user_home(req):
-    approved = Request.objects.filter(isApproved=True, user_id=req.user)
-    pending = Request.objects.filter(isApproved=False, user_id=req.user)
-    invoices = Invoice.objects.filter(request__isApproved=True, request__user=req.user)
-    active_invoices = Invoice.objects.filter(request__isApproved=True, request__user=req.user, status='ACTIVE')
-    transactions = Transaction.objects.filter(created_by=req.user)
-    # Update balance in user model 
-    user = User.objects.get(id=req.user.id)
-    balance = calculateUserBalance(invoices, transactions)
-    user.balance = balance
-    user.save()
+    approved = selectors.approved_requests(user=req.user)
+    pending = selectors.pending_requests(user=req.user)
+    active_invoices = selectors.invoices_table(user=req.user, status='ACTIVE')
+    transactions = selectors.transactions_table(user=req.user)
+    # The balance is kept up to date by the ledger, so it can be read straight off the user
+    balance = req.user.balance
 
     return render(req, 'user_home.html',
-                  {'approved': approved, 'pending': pending, 'children': Child.objects.filter(parent=req.user),
-                   'invoices': active_invoices, 'balance': balance, 'transactions': transactions})
-
-
-def calculateUserBalance(invoices, transactions):
-    total_due = 0
-    total_paid = 0
-    for invoice in invoices:
-        total_due += invoice.amount_to_be_paid
-    for transaction in transactions:
-        total_paid += transaction.amount
-    return round(total_due  - total_paid, 2)
+                  {'approved': approved, 'pending': pending, 'children': selectors.children_table(req.user),
+                   'invoices': active_invoices, 'balance': balance, 'transactions': transactions,
+                   'calendar_url': calendar_url(req, 'student', req.user.id),
+                   **caching.fragment_context(caching.user_scope(req.user.id))})
 
 
 def make_request(req):
@@ -201,23 +204,27 @@ def delete_child(req, child_id):
 
 @staff_member_required(login_url="log_in")
 def admin_home(req):
-    lesson_requests = Request.objects.filter(isApproved=False)
-    approved_request = Request.objects.filter(isApproved=True)
-    users = User.objects.filter(is_active=True)
-
-    for user in users:
-        user.generateInvoices()
-        user.generateChildInvoices()
-        user.updateBalance()
+    # Each table is a keyset-paginated page, so the cost of the page does not grow with the tables,
+    # and is only queried if its cached fragment has expired or been invalidated
+    lesson_requests = pagination.lazy_paginate(selectors.pending_requests(), req.GET, 'pending_', ('request_id',),
+                                               REQUEST_FILTERS)
+    approved_request = pagination.lazy_paginate(selectors.approved_requests(), req.GET, 'approved_',
+                                                ('request_id',), REQUEST_FILTERS)
+    users = pagination.lazy_paginate(
+        selectors.users_table(students_only=True), req.GET, 'students_', ('id',),
+        row=lambda user: {'id': user.id, 'email': user.email, 'first_name': user.first_name,
+                          'last_name': user.last_name, 'balance': '£' + str(user.balance)})
 
     # invoices = Invoice.objects.filter(request__isApproved=True)
-    invoices = Invoice.objects.all()
-    transactions = Transaction.objects.all()
+    invoices = pagination.lazy_paginate(selectors.invoices_table(), req.GET, 'invoices_', ('created_date', 'id'),
+                                        {'status': 'status'})
+    transactions = pagination.lazy_paginate(selectors.transactions_table(), req.GET, 'transactions_',
+                                            ('date_paid', 'id'), {'invoice': 'invoice__invoice_number'})
 
-    return render(req, 'admin_home.html', {'requests': lesson_requests, 'approved': approved_request, 'users': [
-        {'id': user.id, 'email': user.email, 'first_name': user.first_name, 'last_name': user.last_name,
-         'balance': '£' + str(user.balance)} for user in users if not user.is_staff], 'invoices': invoices,
-                                           'transactions': transactions})
+    return render(req, 'admin_home.html', {'requests': lesson_requests, 'approved': approved_request, 'users': users,
+                                           'invoices': invoices, 'transactions': transactions,
+                                           'calendar_url': calendar_url(req, 'teacher', req.user.id),
+                                           **caching.fragment_context(caching.STAFF)})
 
 
 @staff_member_required(login_url="log_in")
@@ -229,21 +236,114 @@ def approve_request(req, requestId):
         return redirect_to_home(get_user(req))
 
     if req.method == 'POST':
-        form = forms.ApproveForm(req.POST)
+        form = forms.ApproveForm(req.POST, request_id=requestId)
         # form.helper.form_action = reverse('approve', args=[request.request_id])
         form.helper.form_action = reverse('approve', kwargs={'requestId': requestId})
         if form.is_valid():
             delete_invoice(requestId)  # delete the old invoice if exists
             createInvoice(requestId)  # create an updated invoice
-            approve = form.save(request=lessonRequestObject)
-            return redirect_to_home(get_user(req))
-        else:
-            messages.add_message(req, messages.ERROR, "Invalid input into the Form.")
+            lessonRequestObject.refresh_from_db(fields=['invoice'])  # so saving the approval keeps the new invoice
+            try:
+                approve = form.save(request=lessonRequestObject)
+                return redirect_to_home(get_user(req))
+            except ValidationError as error:
+                # Another approval booked the teacher after the form was checked
+                form.add_error('class_Time', error)
+        messages.add_message(req, messages.ERROR, "Invalid input into the Form.")
     else:
         form = forms.ApproveForm()
     return render(req, 'approve_request.html', {'form': form, 'request': lessonRequestObject})
 
 
+def proposal_rows(proposals):
+    """The rows for approvals.bulk_approve() that approve the timetable proposals kept in the session"""
+    return [{'request_id': int(request_id), 'teacher': proposal['teacher'], 'class_Day': proposal['class_Day'],
+             'class_Time': dt.time.fromisoformat(proposal['class_Time']),
+             'start_Date': timezone.make_aware(dt.datetime.combine(parse_date(proposal['start_Date']), dt.time.min))}
+            for request_id, proposal in proposals.items()]
+
+
+@staff_member_required(login_url="log_in")
+def bulk_approve(req):
+    teachers = forms.teacher_choices()
+    approved_ids = set()
+    page = None
+    if req.method == 'POST' and 'approveProposals' in req.POST:
+        # Approved from the proposals kept server-side, so the POST stays small however many there are
+        approved, errors = approvals.bulk_approve(proposal_rows(req.session.pop(PROPOSALS_SESSION_KEY, {})))
+        messages.add_message(req, messages.SUCCESS, f"Approved {len(approved)} request(s).")
+        if errors:
+            messages.add_message(req, messages.ERROR, f"{len(errors)} request(s) could not be approved.")
+        return redirect('admin_home')
+    if req.method == 'POST':
+        defaults_form = forms.BulkApproveDefaultsForm(req.POST, prefix='defaults', teachers=teachers)
+        formset = forms.BulkApproveFormSet(req.POST, form_kwargs={'teachers': teachers})
+        rows = []
+        if defaults_form.is_valid():
+            rows = [form.schedule(defaults_form.cleaned_data) for form in formset
+                    if form.is_valid() and form.cleaned_data['selected']]
+        approved, errors = approvals.bulk_approve(rows)
+        approved_ids = {request.request_id for request in approved}
+        for form in formset:
+            if form.is_valid() and form.cleaned_data['request_id'] in errors:
+                form.add_error(None, errors[form.cleaned_data['request_id']])
+        if approved:
+            messages.add_message(req, messages.SUCCESS, f"Approved {len(approved)} request(s).")
+        if approved and not errors and formset.is_valid():
+            return redirect('admin_home')
+        if not rows:
+            messages.add_message(req, messages.ERROR, "No valid requests were selected.")
+        elif errors:
+            messages.add_message(req, messages.ERROR, f"{len(errors)} request(s) could not be approved.")
+    else:
+        pending = Request.objects.filter(isApproved=False)
+        ids = [int(request_id) for request_id in req.GET.get('ids', '').split(',') if request_id.isdigit()]
+        if ids:
+            pending = pending.filter(request_id__in=ids)
+        # Rows the timetable solver found a slot for come filled in and selected, ready to review
+        proposals = req.session.get(PROPOSALS_SESSION_KEY, {}) if req.GET.get('proposed') else {}
+        if req.GET.get('proposed'):
+            pending = pending.filter(request_id__in=[int(request_id) for request_id in proposals])
+        page = pagination.paginate(pending.only('request_id', 'teacher_id'), req.GET, '', ('request_id',),
+                                   per_page=BULK_APPROVE_PER_PAGE)
+        defaults_form = forms.BulkApproveDefaultsForm(prefix='defaults', teachers=teachers)
+        formset = forms.BulkApproveFormSet(form_kwargs={'teachers': teachers}, initial=[
+            {'request_id': request.request_id, 'selected': bool(ids), 'teacher': request.teacher_id,
+             **proposals.get(str(request.request_id), {})}
+            for request in page])
+
+    # Look up every row's request in one query to show who and what it is for
+    row_ids = [form['request_id'].value() for form in formset]
+    requests = Request.objects.select_related('user', 'child').in_bulk(
+        [int(request_id) for request_id in row_ids if str(request_id).isdigit()])
+    rows = [(form, requests.get(int(request_id)) if str(request_id).isdigit() else None)
+            for form, request_id in zip(formset, row_ids)]
+    return render(req, 'bulk_approve.html', {'defaults_form': defaults_form, 'formset': formset, 'rows': rows,
+                                             'approved_ids': approved_ids, 'page': page,
+                                             'per_page': BULK_APPROVE_PER_PAGE,
+                                             'proposals': len(req.session.get(PROPOSALS_SESSION_KEY, {}))
+                                             if req.GET.get('proposed') else 0})
+
+
+@staff_member_required(login_url="log_in")
+def propose_timetable(req):
+    """Run the timetable solver over every pending request and show its proposals on the bulk approval page"""
+    if req.method != 'POST':
+        return redirect('admin_home')
+    start_date = parse_date(req.POST.get('start_date', '')) or None
+    proposals, unscheduled = timetable.propose_timetable(start_date)
+    req.session[PROPOSALS_SESSION_KEY] = {
+        str(proposal.request_id): {'selected': True, 'teacher': proposal.teacher_id, 'class_Day': proposal.class_Day,
+                                   'class_Time': proposal.class_Time.isoformat(),
+                                   'start_Date': proposal.start_Date.date().isoformat()}
+        for proposal in proposals}
+    messages.add_message(req, messages.SUCCESS, f"Proposed a timetable for {len(proposals)} request(s).")
+    if unscheduled:
+        messages.add_message(req, messages.ERROR,
+                             f"{len(unscheduled)} request(s) could not be fitted in with any teacher.")
+    return redirect(reverse('bulk_approve') + '?proposed=1')
+
+
 def delete_invoice(requestId):
     """ Deletes the old invoice associated with the request if it exists """
     try:
@@ -259,6 +359,46 @@ def delete_invoice(requestId):
     """
 
 
+@staff_member_required(login_url="log_in")
+def export_data(req, name):
+    """Stream a full dump of invoices, transactions or requests as CSV or JSON Lines, optionally gzipped"""
+    export_format = req.GET.get('format', 'csv')
+    if name not in exports.EXPORTS or export_format not in exports.FORMATS:
+        raise Http404("Unknown export.")
+    try:
+        start = parse_date(req.GET['start']) if req.GET.get('start') else None
+        end = parse_date(req.GET['end']) if req.GET.get('end') else None
+    except ValueError:
+        start = end = None
+    if (req.GET.get('start') and start is None) or (req.GET.get('end') and end is None):
+        return HttpResponseBadRequest("Dates must be given as YYYY-MM-DD.")
+
+    use_gzip = req.GET.get('gzip') == '1'
+    response = StreamingHttpResponse(exports.export(name, export_format, start, end, gzip=use_gzip),
+                                     content_type=exports.FORMATS[export_format])
+    filename = f"{name}.{export_format}" + ('.gz' if use_gzip else '')
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
+@staff_member_required(login_url="log_in")
+def import_statement(req):
+    if req.method == 'POST':
+        form = forms.StatementUploadForm(req.POST, req.FILES)
+        if form.is_valid():
+            stream = io.TextIOWrapper(form.cleaned_data['statement'].file, encoding='utf-8-sig', newline='')
+            counts = statements.import_statement(stream, form.cleaned_data['statement_format'], get_user(req))
+            messages.add_message(req, messages.SUCCESS,
+                                 f"Recorded {counts['matched']} payment(s), closed {counts['closed']} invoice(s) and "
+                                 f"left {counts['unmatched']} line(s) for review.")
+            return redirect('import_statement')
+        messages.add_message(req, messages.ERROR, "Invalid statement upload.")
+    else:
+        form = forms.StatementUploadForm()
+    unmatched = UnmatchedPayment.objects.order_by('-created_date', 'line_number')[:100]
+    return render(req, 'import_statement.html', {'form': form, 'unmatched': unmatched})
+
+
 @staff_member_required(login_url="log_in")
 def deleteInvoice(req, invoiceId):
     try:
@@ -283,18 +423,72 @@ def delete_request(req, requestId):
         return redirect('user_home')
 
 
+def calendar_feed(req, token):
+    """The iCalendar feed a signed token was made for, answered with a 304 if the client's copy is current"""
+    owner = calendars.read_token(token)
+    feed = calendars.get_feed(*owner) if owner is not None else None
+    if feed is None:
+        raise Http404("No such calendar.")
+    body, etag, last_modified = feed
+    response = get_conditional_response(req, etag=etag, last_modified=int(last_modified.timestamp()))
+    if response is None:
+        response = HttpResponse(body, content_type='text/calendar; charset=utf-8')
+    response.headers['ETag'] = etag
+    response.headers['Last-Modified'] = http_date(last_modified.timestamp())
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+def calendar_url(req, kind, owner_id):
+    return req.build_absolute_uri(reverse('calendar_feed', args=[calendars.feed_token(kind, owner_id)]))
+
+
+@staff_member_required(login_url="log_in")
+def query_stats(req):
+    return render(req, 'query_stats.html', {'rows': middleware.stats.summary()})
+
+
+def export_metrics(req):
+    """The metrics of all the worker processes, for Prometheus to scrape"""
+    if req.META.get('REMOTE_ADDR') not in settings.METRICS_ALLOWED_IPS:
+        raise PermissionDenied
+    return HttpResponse(metrics.exposition(), content_type=metrics.CONTENT_TYPE)
+
+
+@staff_member_required(login_url="log_in")
+def profiles(req):
+    return render(req, 'profiles.html', {'profiles': profiling.recent(),
+                                         'token': profiling.profile_token(req.user),
+                                         'parameter': profiling.PARAMETER, 'header': profiling.HEADER,
+                                         'sample_rate': settings.PROFILE_SAMPLE_RATE})
+
+
+@staff_member_required(login_url="log_in")
+def profile_file(req, profile_id, kind):
+    """Download a saved profile's pstats dump or collapsed stacks"""
+    if kind not in profiling.KINDS or not profiling.PROFILE_ID.match(profile_id):
+        raise Http404("Unknown profile.")
+    try:
+        file = open(profiling.path_for(profile_id, kind), 'rb')
+    except FileNotFoundError:
+        raise Http404("Unknown profile.")
+    return FileResponse(file, as_attachment=True, filename=f"{profile_id}.{kind}",
+                        content_type=profiling.KINDS[kind])
+
+
 @user_passes_test(lambda u: u.is_superuser, login_url="log_in")
 def director_home(req):
-    users = User.objects.filter(is_active=True)
-    lesson_requests = Request.objects.filter(isApproved=False)
-    approved_request = Request.objects.filter(isApproved=True)
-    return render(req, 'director_home.html', {'users': [
-        {'id': user.id, 'email': user.email, 'first_name': user.first_name, 'last_name': user.last_name,
-         'balance': '£' + str(user.balance / 100), 'is_staff': "✓" if user.is_staff else "✗",
-         'is_superuser': "✓" if user.is_superuser else "✗"}
-        for user in users],
-        'requests': lesson_requests, 'approved': approved_request
-    })
+    users = pagination.lazy_paginate(
+        selectors.users_table(), req.GET, 'users_', ('id',), {'staff': 'is_staff'},
+        row=lambda user: {'id': user.id, 'email': user.email, 'first_name': user.first_name,
+                          'last_name': user.last_name, 'balance': '£' + str(user.balance),
+                          'is_staff': "✓" if user.is_staff else "✗", 'is_superuser': "✓" if user.is_superuser else "✗"})
+    lesson_requests = pagination.lazy_paginate(selectors.pending_requests(), req.GET, 'pending_', ('request_id',),
+                                               REQUEST_FILTERS)
+    approved_request = pagination.lazy_paginate(selectors.approved_requests(), req.GET, 'approved_',
+                                                ('request_id',), REQUEST_FILTERS)
+    return render(req, 'director_home.html', {'users': users, 'requests': lesson_requests, 'approved': approved_request,
+                                              **caching.fragment_context(caching.STAFF)})
 
 
 @user_passes_test(lambda u: u.is_superuser, login_url="log_in")
@@ -325,18 +519,6 @@ def delete_user(req, user_id):
 
 def createInvoice(inpRequestId):
 
-    # Helper function to generate the correct invoice number
-    def increment_invoice_number(inpRequest):
-        last_invoice = Invoice.objects.filter(request__user=inpRequest.user).order_by('created_date').last()
-        if not last_invoice:
-            # this is the first invoice for the user
-            first_part = str(inpRequest.user.id).zfill(4)
-            return first_part + '-001'
-        invoice_no = last_invoice.invoice_number
-        new_invoice_no = str(int(invoice_no[5:]) + 1)
-        new_invoice_no = invoice_no[0:-(len(new_invoice_no))] + new_invoice_no
-        return new_invoice_no
-
     # Not essential to validate parameter as it is only called from within the approve_request method with valid input
     # but it is good practice nonetheless
     try:
@@ -345,9 +527,10 @@ def createInvoice(inpRequestId):
         return redirect('admin_home')  # go to admin home page if request does not exist
 
     new_invoice = Invoice.objects.create(request=request, amount_to_be_paid=request.get_total_amount_payable(),
-                                         invoice_number=increment_invoice_number(request))
+                                         invoice_number=InvoiceSequence.objects.reserve(request.user_id)[0])
     new_invoice.updateRequestInvoice()
     new_invoice.save()
+    metrics.invoices_created.inc_on_commit()
 
 
 @staff_member_required(login_url="log_in")
@@ -0,0 +1,127 @@
+"""
+Routing of read-only reporting queries to a replica database.
+
+ReplicaRouter sends reads to the alias chosen for the current request, which is
+the primary ('default') unless ReplicaMiddleware, below, chose the replica.
+It does that for GET requests to the views in settings.REPLICA_VIEWS,
+so heavy dashboard tables stop competing with approvals and payments. Code
+that runs outside those views can mark a queryset for the replica with
+reporting(). Writes always go to the primary. So that a request reads its own
+writes, a write during a request sends that request's remaining reads to the
+primary too. After a user writes something, ReplicaMiddleware also keeps
+their reads on the primary for REPLICA_PIN_SECONDS, with a cookie.
+
+Each view in REPLICA_VIEWS names how many seconds behind the primary its data
+may be. Replication lag is measured with a heartbeat: the primary's
+ReplicaHeartbeat row holds the time of the last sync, and reading the row
+back from the replica shows how old the replica's copy is. A replica that is
+too far behind, has never synced or is not configured is not used.
+Locally, the replica is a second SQLite file that the snapshot_replica
+command refreshes and stamps. Turn on settings.REPLICA_ENABLED once that
+command has made the file, as SQLite would otherwise create an empty one on
+the first read.
+"""
+import contextvars
+import time
+
+from django.conf import settings
+from django.db import DatabaseError
+from django.utils import timezone
+
+PRIMARY = 'default'
+REPLICA = 'replica'
+PIN_COOKIE = 'msms_primary'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+# How long a measured replication lag is trusted before the heartbeat is read again, in seconds
+LAG_CHECK_INTERVAL = 1.0
+
+_read_alias = contextvars.ContextVar('read_alias', default=PRIMARY)
+_lag = {'checked': float('-inf'), 'synced_at': None}
+
+
+def replica_configured():
+    return getattr(settings, 'REPLICA_ENABLED', False) and REPLICA in settings.DATABASES
+
+
+def replica_synced_at():
+    """When the replica's copy of the data was taken from the primary, or None if it never was"""
+    now = time.monotonic()
+    if now - _lag['checked'] >= LAG_CHECK_INTERVAL:
+        from lessons.models import ReplicaHeartbeat
+        try:
+            _lag['synced_at'] = ReplicaHeartbeat.objects.using(REPLICA).values_list('beat', flat=True).first()
+        except DatabaseError:
+            _lag['synced_at'] = None
+        _lag['checked'] = now
+    return _lag['synced_at']
+
+
+def replica_within(max_lag):
+    """Whether the replica exists and is at most max_lag seconds behind the primary"""
+    if not replica_configured():
+        return False
+    synced_at = replica_synced_at()
+    return synced_at is not None and (timezone.now() - synced_at).total_seconds() <= max_lag
+
+
+def read_from_replica(max_lag):
+    """Route the rest of this request's reads to the replica if it is fresh enough. Returns whether it is."""
+    if replica_within(max_lag):
+        _read_alias.set(REPLICA)
+        return True
+    return False
+
+
+def read_from_primary():
+    _read_alias.set(PRIMARY)
+
+
+def current_read_alias():
+    return _read_alias.get()
+
+
+def reporting(queryset, max_lag=None):
+    """Run a queryset on the replica if it is at most max_lag seconds behind (REPLICA_REPORTING_MAX_LAG by default)"""
+    if max_lag is None:
+        max_lag = getattr(settings, 'REPLICA_REPORTING_MAX_LAG', 0)
+    return queryset.using(REPLICA) if replica_within(max_lag) else queryset
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        return _read_alias.get()
+
+    def db_for_write(self, model, **hints):
+        # Read your own writes: once this request has written, it reads from the primary
+        read_from_primary()
+        return PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Both databases hold the same data
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # The replica is a copy of the primary and is never migrated itself
+        return db == PRIMARY
+
+
+class ReplicaMiddleware:
+    """Serve GET requests to the views in settings.REPLICA_VIEWS from the replica, when it is fresh enough"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, req):
+        try:
+            response = self.get_response(req)
+        finally:
+            read_from_primary()
+        if req.method not in SAFE_METHODS:
+            response.set_cookie(PIN_COOKIE, '1', max_age=getattr(settings, 'REPLICA_PIN_SECONDS', 0),
+                                httponly=True, samesite='Lax')
+        return response
+
+    def process_view(self, req, view_func, view_args, view_kwargs):
+        max_lag = getattr(settings, 'REPLICA_VIEWS', {}).get(req.resolver_match.url_name)
+        if max_lag is not None and req.method in SAFE_METHODS and PIN_COOKIE not in req.COOKIES:
+            read_from_replica(max_lag)
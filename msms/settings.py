@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.1/ref/settings/
 """
 import os
+import sys
 from pathlib import Path
 from django.contrib.messages import constants as message_constants
 
@@ -44,6 +45,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'lessons.metrics.MetricsMiddleware',
+    'lessons.middleware.QueryCountMiddleware',
+    'msms.routers.ReplicaMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -51,13 +55,14 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'lessons.profiling.ProfilingMiddleware',
 ]
 
 ROOT_URLCONF = 'msms.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'lessons.metrics.TimedDjangoTemplates',
         'DIRS': [],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -80,6 +85,47 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+    },
+    # A read-only copy for reporting views, refreshed by the snapshot_replica command (see msms/routers.py)
+    'replica': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / 'replica.sqlite3',
+        'TEST': {'MIRROR': 'default'},
+    },
+}
+DATABASE_ROUTERS = ['msms.routers.ReplicaRouter']
+# Off until snapshot_replica has made the replica: opening a missing SQLite file creates an empty database,
+# which every dashboard request would then connect to. The test database mirrors the primary, so tests
+# only route to it when they turn this on
+REPLICA_ENABLED = False
+
+# Views whose GET requests may be served from the replica, by URL name, with how many seconds
+# behind the primary it may be for each
+REPLICA_VIEWS = {
+    'admin_home': 60,
+    'director_home': 60,
+}
+# How far behind querysets marked with msms.routers.reporting() may be, e.g. the finance exports
+REPLICA_REPORTING_MAX_LAG = 300
+# After a user writes something, their reads stay on the primary this long so they see their change
+REPLICA_PIN_SECONDS = 60
+
+# Run on every new SQLite connection, see lessons/sqlite.py
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'cache_size': -64000,  # 64 MB
+    'mmap_size': 256 * 1024 * 1024,
+    'temp_store': 'MEMORY',
+    'busy_timeout': 5000,  # milliseconds
+}
+
+# Cache for the dashboard table fragments, see lessons/caching.py
+# Use a cache shared by every server process (e.g. Memcached or Redis) when running more than one
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'msms',
     }
 }
 
@@ -134,3 +180,32 @@ MESSAGE_TAGS = {
     message_constants.DEBUG: 'dark',
     message_constants.ERROR: 'danger'
 }
+
+# Query budgets checked by lessons.middleware.QueryCountMiddleware, by URL name
+# A view over its budget logs a warning, or fails when running the tests
+QUERY_BUDGETS = {
+    'admin_home': 10,
+    'director_home': 10,
+    'user_home': 10,
+    'view_student': 10,
+    'see_more_request': 10,
+    'export_data': 5,
+    # Regenerates the invoice, then locks the teacher and checks for conflicts again before approving
+    'approve': 60,
+}
+QUERY_BUDGET_DEFAULT = 50
+QUERY_BUDGET_STRICT = len(sys.argv) > 1 and sys.argv[1] == 'test'
+
+# Request profiles saved by lessons.profiling.ProfilingMiddleware, listed for staff at /profiles/
+PROFILE_DIR = BASE_DIR / 'profiles'
+PROFILE_KEEP = 200
+# Profile one request in this many, whoever makes it, or none if 0
+PROFILE_SAMPLE_RATE = 0
+# How long a token from the /profiles/ page has requests profiled for, in seconds
+PROFILE_TOKEN_MAX_AGE = 60 * 60
+
+# Metrics recorded by lessons.metrics and served at /metrics, one file per worker process in METRICS_DIR
+METRICS_ENABLED = not (len(sys.argv) > 1 and sys.argv[1] == 'test')
+METRICS_DIR = BASE_DIR / 'metrics'
+# Addresses that may read /metrics
+METRICS_ALLOWED_IPS = ['127.0.0.1', '::1']
@@ -35,6 +35,9 @@ urlpatterns = [
     path('administrator/', views.admin_home, name="admin_home"),
     # Path to administrator's side of approving requests
     path('approve/<int:requestId>/', views.approve_request, name='approve'),  # name='approve_request'),
+    # Path to administrator's side of approving many requests at once
+    path('bulk_approve/', views.bulk_approve, name='bulk_approve'),
+    path('propose_timetable/', views.propose_timetable, name='propose_timetable'),
     # Path to administrator's side of deleting requests
     # path('deleteRequest/<int:requestId>/', views.deleteRequest, name='delete_request'), # LYN's VERSION
     # Path to  delete requests
@@ -43,6 +46,17 @@ urlpatterns = [
     path('deleteInvoice/<int:invoiceId>/', views.deleteInvoice, name='delete_invoice'),
     # Path to the create transaction form
     path('create_transaction/', views.create_transaction, name="create_transaction"),
+    # Path to the bank statement import
+    path('import_statement/', views.import_statement, name="import_statement"),
+    # Path to the finance exports of invoices, transactions and requests
+    path('export/<str:name>/', views.export_data, name="export_data"),
+    # Path to the iCalendar feed of a student, child or teacher, identified by a signed token
+    path('calendar/<str:token>.ics', views.calendar_feed, name='calendar_feed'),
+    # Path to the per-page database query statistics
+    path('query_stats/', views.query_stats, name="query_stats"),
+    path('profiles/', views.profiles, name="profiles"),
+    path('metrics', views.export_metrics, name="metrics"),
+    path('profiles/<str:profile_id>/<str:kind>/', views.profile_file, name="profile_file"),
     path('director/', views.director_home, name="director_home"),
     path('edit_user/<int:user_id>/', views.edit_user, name="edit_user"),
     path('delete_user/<int:user_id>/', views.delete_user, name="delete_user"),